@@ -9,4 +9,8 @@ admin.site.register(Employee)
 admin.site.register(Kiosk)
 admin.site.register(Tariff)
 admin.site.register(Admin)
-
+admin.site.register(Occupancy)
+admin.site.register(LotOccupancy)
+admin.site.register(IdempotencyKey)
+admin.site.register(DailyRevenue)
+admin.site.register(DailyOccupancy)
@@ -0,0 +1,263 @@
+"""Admission control for the GraphQL endpoints.
+
+Before a request is parsed, ``admit`` turns it away with a fast JSON error
+when:
+
+* its body is larger than ``GRAPHQL_MAX_BODY_SIZE`` (413), photos included.
+  The size is read from ``Content-Length``, so while the limit is set a
+  request with a body but no length (chunked) is refused with 411;
+* its client has used up its token bucket (429): ``GRAPHQL_RATE_LIMIT_RATE``
+  requests per second with bursts of ``GRAPHQL_RATE_LIMIT_BURST``. Clients
+  are told apart by ``GRAPHQL_RATE_LIMIT_CLIENT_HEADER`` (only set it when a
+  trusted proxy fills it in) or else by their address;
+* ``GRAPHQL_MAX_IN_FLIGHT`` requests are already in progress (503), so a
+  burst is shed instead of queueing behind every worker.
+
+``QueryLimitsRule`` is a validation rule, so a query deeper than
+``GRAPHQL_MAX_QUERY_DEPTH`` or costlier than ``GRAPHQL_MAX_QUERY_COST`` is
+rejected before execution. The cost of a field is 1 plus, for lists and
+connections, the page size (``first``, ``last`` or ``limit``; the maximum
+when it comes from a variable) times the cost of its selection. Documents of
+more than ``GRAPHQL_MAX_TOKENS`` tokens are not parsed at all.
+
+Buckets and counters are kept per process.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import JsonResponse
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode, FragmentSpreadNode, GraphQLError, GraphQLList, InlineFragmentNode, IntValueNode, ValidationRule,
+    get_named_type, get_nullable_type, specified_rules,
+)
+
+from parkingApp.pagination import DEFAULT_PAGE_SIZE
+
+MAX_CLIENTS = 10000  # Buckets kept; the least recently seen clients are dropped
+PAGE_ARGUMENTS = ("first", "last", "limit")
+BODILESS_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # client -> [tokens, last refill]
+
+    def acquire(self, client, rate, burst):
+        """Take a token; returns 0, or the seconds until the client gets one."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [burst, now]
+                if len(self._buckets) > MAX_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class Admission:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.limiter = RateLimiter()
+        self.in_flight = 0
+        self.rejected = {"too_large": 0, "length_required": 0, "rate_limited": 0, "overloaded": 0}
+
+    def _reject(self, reason, status, message, retry_after=None):
+        with self._lock:
+            self.rejected[reason] += 1
+        response = JsonResponse({"errors": [{"message": message}]}, status=status)
+        if retry_after is not None:
+            response["Retry-After"] = str(retry_after)
+        return response
+
+    def _client(self, request):
+        header = _setting("GRAPHQL_RATE_LIMIT_CLIENT_HEADER", None)
+        return (header and request.headers.get(header)) or request.META.get("REMOTE_ADDR", "")
+
+    def check(self, request):
+        """The error response for a request that must be turned away, or None."""
+        max_size = _setting("GRAPHQL_MAX_BODY_SIZE", None)
+        if max_size:
+            try:
+                size = int(request.META["CONTENT_LENGTH"])
+            except (KeyError, ValueError):
+                size = None
+            if size is None and request.method not in BODILESS_METHODS:
+                return self._reject("length_required", 411, "Content-Length is required.")
+            if size is not None and size > max_size:
+                return self._reject("too_large", 413, f"Request body is larger than {max_size} bytes.")
+
+        rate = _setting("GRAPHQL_RATE_LIMIT_RATE", None)
+        if rate:
+            burst = _setting("GRAPHQL_RATE_LIMIT_BURST", rate)
+            wait = self.limiter.acquire(self._client(request), rate, burst)
+            if wait:
+                return self._reject("rate_limited", 429, "Too many requests.", math.ceil(wait))
+        return None
+
+    @contextmanager
+    def admit(self, request):
+        """Yields an error response to return, or None while the request runs."""
+        rejection = self.check(request)
+        if rejection is not None:
+            yield rejection
+            return
+        max_in_flight = _setting("GRAPHQL_MAX_IN_FLIGHT", None)
+        with self._lock:
+            overloaded = bool(max_in_flight) and self.in_flight >= max_in_flight
+            if not overloaded:
+                self.in_flight += 1
+        if overloaded:
+            yield self._reject("overloaded", 503, "Server is busy, try again.", 1)
+            return
+        try:
+            yield None
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, **self.rejected}
+
+    def reset(self):
+        self.limiter.reset()
+        with self._lock:
+            self.rejected = dict.fromkeys(self.rejected, 0)
+
+
+admission = Admission()
+
+
+def _page_size(node, field_def):
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    for argument in node.arguments:
+        if argument.name.value in PAGE_ARGUMENTS:
+            if isinstance(argument.value, IntValueNode):
+                return min(int(argument.value.value), max_limit)
+            return max_limit  # A variable: assume the worst
+    for name in PAGE_ARGUMENTS:
+        default = field_def.args[name].default_value if name in field_def.args else None
+        if isinstance(default, int):
+            return default
+    return None
+
+
+class _LimitExceeded(Exception):
+    pass
+
+
+class _Measure:
+    """Walks an operation for its ``(cost, depth)``.
+
+    Each named fragment is measured once per document, however many times it
+    is spread, and the walk stops with ``_LimitExceeded`` as soon as the cost
+    or the depth is over its limit.
+    """
+
+    def __init__(self, context, max_cost, max_depth):
+        self.context = context
+        self.max_cost = max_cost
+        self.max_depth = max_depth
+        self.fragments = {}  # name -> (cost, depth)
+
+    def _check(self, cost, depth):
+        if self.max_depth and depth > self.max_depth:
+            raise _LimitExceeded(f"Query depth exceeds the limit of {self.max_depth}.")
+        if self.max_cost and cost > self.max_cost:
+            raise _LimitExceeded(f"Query cost exceeds the limit of {self.max_cost}.")
+
+    def selection_set(self, parent_type, selection_set, level=0, fragments_seen=()):
+        """``(cost, depth)`` of a selection set ``level`` fields below the root."""
+        cost, depth = 0, 0
+        fields = getattr(parent_type, "fields", {})
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                name = selection.name.value
+                field_def = fields.get(name)
+                if name.startswith("__") or field_def is None:
+                    continue  # Introspection is free; unknown fields are reported by other rules
+                self._check(0, level + 1)
+                field_type = get_named_type(field_def.type)
+                child_cost, child_depth = (
+                    self.selection_set(field_type, selection.selection_set, level + 1, fragments_seen)
+                    if selection.selection_set else (0, 0)
+                )
+                multiplier = 1
+                if field_type.name.endswith("Connection"):
+                    multiplier = _page_size(selection, field_def) or DEFAULT_PAGE_SIZE
+                elif isinstance(get_nullable_type(field_def.type), GraphQLList) and not parent_type.name.endswith("Connection"):
+                    # Edges are already counted by their connection's page size
+                    multiplier = _page_size(selection, field_def) or _setting("GRAPHQL_LIST_COST_SIZE", 10)
+                cost += 1 + multiplier * child_cost
+                depth = max(depth, 1 + child_depth)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = (
+                    self.context.schema.get_type(selection.type_condition.name.value)
+                    if selection.type_condition else parent_type
+                )
+                fragment_cost, fragment_depth = self.selection_set(
+                    fragment_type, selection.selection_set, level, fragments_seen
+                )
+                cost += fragment_cost
+                depth = max(depth, fragment_depth)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment_cost, fragment_depth = self.fragment(selection.name.value, level, fragments_seen)
+                cost += fragment_cost
+                depth = max(depth, fragment_depth)
+            # Costs only grow towards the root, so this one is already too much
+            self._check(cost, level + depth)
+        return cost, depth
+
+    def fragment(self, name, level, fragments_seen):
+        if name in self.fragments:
+            return self.fragments[name]
+        fragment = self.context.get_fragment(name)
+        if fragment is None or name in fragments_seen:
+            return 0, 0  # Cycles are reported by NoFragmentCyclesRule
+        fragment_type = self.context.schema.get_type(fragment.type_condition.name.value)
+        self.fragments[name] = self.selection_set(
+            fragment_type, fragment.selection_set, level, (*fragments_seen, name)
+        )
+        return self.fragments[name]
+
+
+class QueryLimitsRule(ValidationRule):
+    def __init__(self, context):
+        super().__init__(context)
+        self.measure = _Measure(
+            context, _setting("GRAPHQL_MAX_QUERY_COST", None), _setting("GRAPHQL_MAX_QUERY_DEPTH", None)
+        )
+
+    def enter_operation_definition(self, node, *_args):
+        root_type = self.context.schema.get_root_type(node.operation)
+        if root_type is None:
+            return
+        try:
+            self.measure.selection_set(root_type, node.selection_set)
+        except _LimitExceeded as e:
+            self.report_error(GraphQLError(str(e), node))
+
+
+VALIDATION_RULES = (*specified_rules, QueryLimitsRule)
@@ -0,0 +1,200 @@
+"""Archived months of parking sessions and payments.
+
+Old months are exported to gzip-compressed CSV files under
+``PARTITION_ARCHIVE_DIR/<table>/<YYYY-MM>/`` and removed from the live
+tables. On a partitioned PostgreSQL table (parkingApp/partitions.py) the
+month's partition is detached, copied out with ``COPY`` and dropped;
+elsewhere the month's rows are exported and deleted in chunks.
+
+Deletes go straight to SQL, so they neither cascade nor touch the rollups:
+archived revenue stays in the reports. ``archived_rows`` reads a month back
+as unsaved model instances.
+"""
+import csv
+import gzip
+import os
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from parkingApp.models import ParkingSession, Payment
+from parkingApp.partitions import (
+    PARTITION_COLUMNS, add_months, detach_partition, is_partitioned, partition_name, partitions,
+)
+
+DELETE_CHUNK_SIZE = 1000
+
+
+def archive_root():
+    return Path(getattr(settings, "PARTITION_ARCHIVE_DIR", settings.BASE_DIR / "archive"))
+
+
+def month_dir(model, month):
+    return archive_root() / model._meta.db_table / f"{month:%Y-%m}"
+
+
+def month_bounds(month):
+    # Partitions are bounded in UTC
+    start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+    end = datetime.combine(add_months(month, 1), datetime.min.time(), tzinfo=dt_timezone.utc)
+    return start, end
+
+
+def _new_archive_file(model, month):
+    # One file per archiving run, so a month can be archived in several goes
+    directory = month_dir(model, month)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{timezone.now():%Y%m%dT%H%M%S%f}.csv.gz"
+    return path, path.with_suffix(".tmp")
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"  # Same as PostgreSQL's COPY
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _copy_out(cursor, table, out):
+    sql = f"COPY {connection.ops.quote_name(table)} TO STDOUT WITH (FORMAT csv, HEADER)"
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, "copy_expert"):  # psycopg2
+        raw_cursor.copy_expert(sql, out)
+    else:  # psycopg 3
+        with raw_cursor.copy(sql) as copy:
+            for data in copy:
+                out.write(bytes(data).decode())
+
+
+def _has_open_sessions(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT 1 FROM {connection.ops.quote_name(table)} WHERE exit_time IS NULL LIMIT 1")
+        return cursor.fetchone() is not None
+
+
+def _has_live_payments(table):
+    # Payments of a newer month can point at a session of this one
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT 1 FROM {connection.ops.quote_name(Payment._meta.db_table)} p "
+            f"JOIN {connection.ops.quote_name(table)} s ON s.id = p.parking_session_id LIMIT 1"
+        )
+        return cursor.fetchone() is not None
+
+
+def _archive_partition(model, month, temporary):
+    name = partition_name(model, month)
+    # Like the row path: open sessions and sessions that live payments still
+    # point at keep the whole month live (archive payments first)
+    if model is ParkingSession and (_has_open_sessions(name) or _has_live_payments(name)):
+        return None
+    with transaction.atomic():
+        detach_partition(model, month)
+        with gzip.open(temporary, "wt", newline="") as out, connection.cursor() as cursor:
+            _copy_out(cursor, name, out)
+            cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(name)}")
+            count = cursor.fetchone()[0]
+            cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+    return count
+
+
+def _archive_rows(model, month, temporary):
+    start, end = month_bounds(month)
+    column = PARTITION_COLUMNS[model]
+    rows = model.objects.filter(**{f"{column}__gte": start, f"{column}__lt": end})
+    if model is ParkingSession:
+        # Open sessions stay live, and so do sessions that live payments
+        # still point at (archive payments first)
+        rows = rows.filter(exit_time__isnull=False, payment__isnull=True)
+    fields = model._meta.concrete_fields
+    table = connection.ops.quote_name(model._meta.db_table)
+
+    ids = []
+    with transaction.atomic():
+        with gzip.open(temporary, "wt", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow([field.column for field in fields])
+            for row in rows.order_by("pk").values_list(*[field.attname for field in fields]).iterator():
+                writer.writerow([_csv_value(value) for value in row])
+                ids.append(row[0])
+        with connection.cursor() as cursor:
+            for index in range(0, len(ids), DELETE_CHUNK_SIZE):
+                chunk = ids[index:index + DELETE_CHUNK_SIZE]
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+    return len(ids)
+
+
+def archive_month(model, month):
+    """Move ``model``'s rows for ``month`` to an archive file.
+
+    Returns the number of archived rows, or ``None`` when the month's partition
+    still has open sessions or sessions with live payments and was left alone.
+    """
+    partitioned = is_partitioned(model)
+    if partitioned and month not in partitions(model):
+        return 0
+    path, temporary = _new_archive_file(model, month)
+    try:
+        if partitioned:
+            count = _archive_partition(model, month, temporary)
+        else:
+            count = _archive_rows(model, month, temporary)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    if not count:
+        temporary.unlink(missing_ok=True)
+        try:
+            path.parent.rmdir()  # Only if nothing was archived for the month before
+        except OSError:
+            pass
+        return count
+    os.replace(temporary, path)
+    return count
+
+
+def live_months(model, before):
+    """Months before ``before`` that still have rows in ``model``'s live table."""
+    oldest = model.objects.aggregate(oldest=Min(PARTITION_COLUMNS[model]))["oldest"]
+    if oldest is None:
+        return []
+    oldest = oldest.astimezone(dt_timezone.utc)
+    month = oldest.date().replace(day=1)
+    months = []
+    while month < before:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def archived_months(model):
+    directory = archive_root() / model._meta.db_table
+    if not directory.is_dir():
+        return []
+    return sorted(datetime.strptime(entry.name, "%Y-%m").date() for entry in directory.iterdir() if entry.is_dir())
+
+
+def archived_rows(model, month, **filters):
+    """Yield ``model`` instances archived for ``month``, matching ``filters`` (attname=value)."""
+    directory = month_dir(model, month)
+    if not directory.is_dir():
+        return
+    fields = {field.column: field for field in model._meta.concrete_fields}
+    for path in sorted(directory.glob("*.csv.gz")):
+        with gzip.open(path, "rt", newline="") as archive:
+            for record in csv.DictReader(archive):
+                values = {}
+                for column, raw in record.items():
+                    field = fields.get(column)
+                    if field is None:
+                        continue  # Column dropped since the month was archived
+                    values[field.attname] = None if raw == "" and field.null else field.to_python(raw)
+                if all(values.get(name) == value for name, value in filters.items()):
+                    yield model(**values)
@@ -0,0 +1,189 @@
+"""Helpers shared by the ``bench_*`` management commands."""
+import asyncio
+import json
+import math
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+
+from parkingApp.employees import recorder
+from parkingApp.models import Car, IdempotencyKey, ParkingSession, Payment
+from parkingApp.occupancy import recount_occupancy
+from parkingApp.photos import pipeline
+from parkingApp.rollups import rebuild_occupancy, rebuild_revenue
+
+# Letters of generated plates (Cyrillic, as on real plates)
+PLATE_LETTERS = "АБВГДЕЖЗИКЛМНОӨПРСТУҮФХЦЧШЭЮЯ"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def latency_summary(latencies):
+    """Summarise a list of latencies in seconds as milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def synthetic_plate(index):
+    """The ``index``-th distinct plate: 4 digits and 3 letters, e.g. ``0042АБВ``."""
+    letters, digits = divmod(index, 10000)
+    base = len(PLATE_LETTERS)
+    return f"{digits:04d}" + "".join(
+        PLATE_LETTERS[letters // base ** power % base] for power in (2, 1, 0)
+    )
+
+
+def run_metadata():
+    """Where and on what a benchmark ran, for the result file."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": timezone.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "host": platform.node(),
+    }
+
+
+def write_results(path, results):
+    with open(path, "w") as result_file:
+        json.dump(results, result_file, indent=2, default=str)
+        result_file.write("\n")
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def bench_client():
+    # Lets the in-process test client through ALLOWED_HOSTS; benchmarks
+    # measure the endpoint, not the per-client rate limit
+    setup_test_environment()
+    override_settings(GRAPHQL_RATE_LIMIT_RATE=None).enable()
+    return Client()
+
+
+@contextmanager
+def discarded_writes():
+    """Let the block's requests commit, then delete the rows they created.
+
+    Requests run as they do in production, so commit cost and on-commit work
+    (photo processing, employee session recording) are part of the run.
+    Photos go to a temporary MEDIA_ROOT. Afterwards the photo queue is
+    drained, the employee recorder flushed, every row with a higher primary
+    key than before the block is deleted and the counters and rollups are
+    rebuilt from the day the block started.
+
+    Only rows the benchmarks create are removed; updates to older rows (say
+    an exit for a seeded session) stay.
+    """
+    models = (Payment, ParkingSession, Car, IdempotencyKey)
+    last_pks = {model: model.objects.aggregate(last=Max("pk"))["last"] or 0 for model in models}
+    started = timezone.localdate()
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        try:
+            yield
+        finally:
+            pipeline.queue.join()
+            recorder.flush()
+            for model in models:
+                model.objects.filter(pk__gt=last_pks[model]).delete()
+            recount_occupancy()
+            rebuild_occupancy(start=started)
+            rebuild_revenue(start=started)
+
+
+async def http_post(url, body, content_type, chunk_size=None, chunk_delay=0.0):
+    """POST ``body`` over a fresh HTTP/1.1 connection and return ``(status, seconds)``.
+
+    With ``chunk_size`` the body is trickled in chunks ``chunk_delay`` seconds
+    apart, like a kiosk on a slow uplink.
+    """
+    parts = urlsplit(url)
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        writer.write(
+            f"POST {parts.path or '/'} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+        )
+        chunk_size = chunk_size or len(body)
+        for offset in range(0, len(body), chunk_size):
+            writer.write(body[offset:offset + chunk_size])
+            await writer.drain()
+            if chunk_delay and offset + chunk_size < len(body):
+                await asyncio.sleep(chunk_delay)
+        status_line = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    status = int(status_line.split()[1]) if status_line else 0
+    return status, time.perf_counter() - start
+
+
+async def run_load(url, make_request, requests, concurrency, **post_options):
+    """Send ``requests`` POSTs with at most ``concurrency`` in flight.
+
+    ``make_request(index)`` returns ``(body, content_type)``.
+    """
+    latencies, errors = [], 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        nonlocal errors
+        body, content_type = make_request(index)
+        async with slots:
+            try:
+                status, seconds = await http_post(url, body, content_type, **post_options)
+            except OSError:
+                errors += 1
+                return
+        if status != 200:
+            errors += 1
+        latencies.append(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "errors": errors,
+        **latency_summary(latencies),
+    }
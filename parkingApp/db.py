@@ -0,0 +1,180 @@
+"""Per-operation database behaviour for GraphQL execution.
+
+Queries run in autocommit mode and, when a ``replica`` database is
+configured, read from it through ``ReadReplicaRouter``. Mutations read and
+write the primary and every top-level mutation field gets its own atomic
+block (``MutationAtomicMiddleware``). ``GRAPHQL_STATEMENT_TIMEOUTS`` sets a
+PostgreSQL statement timeout per operation type.
+
+An operation whose top-level field names a kiosk or a lot that has its own
+database (``LOT_DATABASES``, see parkingApp/lots.py) is sent there as a
+whole by ``LotRoutingMiddleware`` and ``LotRouter``. Code that opens a
+transaction or registers an on-commit hook for the current operation uses
+``current_database()``.
+
+``connection_stats`` reports, per database alias, the psycopg pool's
+counters (including the time requests waited for a connection) or, without
+a pool, how many connections this process has opened.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from graphql import OperationType
+
+from parkingApp.lots import kiosk_lot, lot_database
+
+REPLICA_ALIAS = "replica"
+
+_read_only = ContextVar("graphql_read_only", default=False)
+_lot_alias = ContextVar("graphql_lot_alias", default=None)
+
+_opened = Counter()  # alias -> connections opened by this process
+_opened_lock = threading.Lock()
+
+
+def current_database():
+    return _lot_alias.get() or DEFAULT_DB_ALIAS
+
+
+class LotRouter:
+    # List it before ReadReplicaRouter; outside a lot scope it has no opinion
+    def db_for_read(self, model, **hints):
+        return _lot_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return _lot_alias.get()
+
+
+@contextmanager
+def lot_scope(lot):
+    """Run the block against ``lot``'s database (if it has its own)."""
+    token = _lot_alias.set(lot_database(lot) if lot else None)
+    try:
+        yield
+    finally:
+        _lot_alias.reset(token)
+
+
+def route_to_lot(lot):
+    # For the rest of the operation; operation_scope resets it
+    alias = lot_database(lot)
+    if alias is None:
+        return
+    current = _lot_alias.get()
+    if current is not None and current != alias:
+        raise ValueError("An operation can only use one lot database.")
+    _lot_alias.set(alias)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_only.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA_ALIAS:
+            return False
+        return None
+
+
+@contextmanager
+def statement_timeout(alias, milliseconds):
+    connection = connections[alias]
+    if not milliseconds or connection.vendor != "postgresql":
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SET statement_timeout = %s", [int(milliseconds)])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SET statement_timeout TO DEFAULT")
+
+
+@contextmanager
+def operation_scope(operation):
+    """Run a GraphQL ``operation`` ("query", "mutation", ...) with its DB settings."""
+    read_only = operation == OperationType.QUERY.value
+    alias = REPLICA_ALIAS if read_only and REPLICA_ALIAS in settings.DATABASES else "default"
+    timeout = getattr(settings, "GRAPHQL_STATEMENT_TIMEOUTS", {}).get(operation)
+    token = _read_only.set(read_only)
+    lot_token = _lot_alias.set(None)
+    try:
+        with statement_timeout(alias, timeout):
+            yield
+    finally:
+        _lot_alias.reset(lot_token)
+        _read_only.reset(token)
+
+
+class MutationAtomicMiddleware:
+    def resolve(self, next, root, info, **args):
+        if info.operation.operation == OperationType.MUTATION and info.path.prev is None:
+            with transaction.atomic(using=current_database()):
+                return next(root, info, **args)
+        return next(root, info, **args)
+
+
+class LotRoutingMiddleware:
+    # List it after MutationAtomicMiddleware, so the mutation's transaction
+    # is opened on the lot's database
+    def resolve(self, next, root, info, **args):
+        if info.path.prev is None:
+            lot = args.get("lot")
+            kiosk_id = args.get("kiosk_id") or (args.get("input") or {}).get("kiosk_id")
+            if kiosk_id is not None:
+                lot = kiosk_lot(kiosk_id)
+            if lot:
+                route_to_lot(lot)
+        return next(root, info, **args)
+
+
+def count_connection(alias):
+    with _opened_lock:
+        _opened[alias] += 1
+
+
+def connection_stats():
+    stats = []
+    for alias in settings.DATABASES:
+        connection = connections[alias]
+        pool = getattr(connection, "pool", None)  # PostgreSQL with OPTIONS["pool"]
+        with _opened_lock:
+            opened = _opened[alias]
+        if pool is None:
+            max_age = connection.settings_dict.get("CONN_MAX_AGE", 0)
+            stats.append({
+                "alias": alias,
+                "mode": "persistent" if max_age is None or max_age > 0 else "per-request",
+                "connections_opened": opened,
+            })
+            continue
+        pool_stats = pool.get_stats()
+        requests = pool_stats.get("requests_num", 0)
+        wait_ms = pool_stats.get("requests_wait_ms", 0)
+        stats.append({
+            "alias": alias,
+            "mode": "pool",
+            "connections_opened": pool_stats.get("connections_num", 0),
+            "pool_size": pool_stats.get("pool_size", 0),
+            "pool_available": pool_stats.get("pool_available", 0),
+            "requests": requests,
+            "requests_waiting": pool_stats.get("requests_waiting", 0),
+            "wait_ms": wait_ms,
+            "average_wait_ms": wait_ms / requests if requests else 0.0,
+            "timeouts": pool_stats.get("requests_errors", 0),
+        })
+    return stats
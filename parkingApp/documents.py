@@ -0,0 +1,95 @@
+"""Parsed-document cache and Automatic Persisted Queries (APQ).
+
+Kiosks send the same few operations over and over, so the parsed and
+validated document is kept in a per-process LRU keyed by the SHA-256 of the
+query text. With APQ (https://www.apollographql.com/docs/apollo-server/performance/apq/)
+clients send only that hash; the query text is registered once and kept in
+the ``GRAPHQL_PERSISTED_QUERY_CACHE_ALIAS`` cache, which every worker has to
+share. When that cache fails, a hash is treated as unknown and Apollo clients
+retry with the full query.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import parse, validate
+
+logger = logging.getLogger("main")
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class DocumentCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._documents.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._documents[key] = entry
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+document_cache = DocumentCache(getattr(settings, "GRAPHQL_DOCUMENT_CACHE_SIZE", 256))
+
+
+def parse_and_validate(schema, query, validation_rules=None, max_errors=None, key=None):
+    """Return ``(document, validation_errors)`` for ``query``, cached by its hash.
+
+    Parse errors, including documents over ``GRAPHQL_MAX_TOKENS`` tokens, are
+    raised and never cached.
+    """
+    key = key or query_hash(query)
+    entry = document_cache.get(key)
+    if entry is None:
+        document = parse(query, max_tokens=getattr(settings, "GRAPHQL_MAX_TOKENS", None))
+        entry = (document, validate(schema, document, validation_rules, max_errors))
+        document_cache.put(key, entry)
+    return entry
+
+
+def _persisted_queries():
+    return caches[getattr(settings, "GRAPHQL_PERSISTED_QUERY_CACHE_ALIAS", "default")]
+
+
+def get_persisted_query(sha256_hash):
+    try:
+        return _persisted_queries().get(sha256_hash)
+    except Exception:
+        logger.exception("Reading persisted query %s failed", sha256_hash)
+        return None
+
+
+def persist_query(sha256_hash, query):
+    try:
+        _persisted_queries().set(
+            sha256_hash, query, timeout=getattr(settings, "GRAPHQL_PERSISTED_QUERY_TIMEOUT", None)
+        )
+    except Exception:
+        logger.exception("Registering persisted query %s failed", sha256_hash)
@@ -0,0 +1,171 @@
+"""Gate fast path for employee cars.
+
+``allowlist`` holds the normalized plates of employee cars (``Car.is_employee_car``
+or assigned to an ``Employee``, the rule the fee engine charges by, see
+``parkingApp.fees.employee_car_filter``) in process memory. It is loaded on first use,
+kept up to date by signals (parkingApp/signals.py) and reloaded every
+``EMPLOYEE_ALLOWLIST_TTL`` seconds to pick up changes made by other processes.
+
+For an allowlisted plate ``createEntryCar`` and ``exitCar`` open the gate
+without touching the database; ``recorder`` writes the entry or exit later,
+in batches per kiosk, through the ingest path (parkingApp/ingest.py) on the
+kiosk's lot database. The allowlist itself is read from the default
+database. Events still queued when a process dies are lost, so keep
+``EMPLOYEE_SESSION_FLUSH_INTERVAL`` short.
+"""
+import atexit
+import logging
+import threading
+import time
+from itertools import groupby
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+
+from parkingApp.db import current_database, lot_scope
+from parkingApp.fees import employee_car_filter
+from parkingApp.ingest import ingest_events
+from parkingApp.lots import kiosk_lot
+from parkingApp.models import Car
+from parkingApp.plates import normalize_plate
+
+logger = logging.getLogger("main")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class EmployeeAllowlist:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plates = None  # car pk -> normalized plate
+        self._assigned = set()  # pks of cars assigned to an Employee
+        self._members = frozenset()
+        self._loaded_at = 0.0
+
+    def _load(self):
+        self._plates, self._assigned = {}, set()
+        cars = (
+            Car.objects.using(DEFAULT_DB_ALIAS)
+            .filter(employee_car_filter())
+            .values_list("pk", "normalized_plate", "employee__id")
+        )
+        for pk, normalized_plate, employee_id in cars:
+            if employee_id is not None:
+                self._assigned.add(pk)
+            if normalized_plate:
+                self._plates[pk] = normalized_plate
+        self._members = frozenset(self._plates.values())
+        self._loaded_at = time.monotonic()
+
+    def __contains__(self, car_plate):
+        with self._lock:
+            if self._plates is None or time.monotonic() - self._loaded_at > _setting("EMPLOYEE_ALLOWLIST_TTL", 60):
+                self._load()
+            members = self._members
+        return bool(car_plate) and normalize_plate(car_plate) in members
+
+    def update(self, pk, normalized_plate, is_employee_car):
+        with self._lock:
+            if self._plates is None:
+                return
+            self._plates.pop(pk, None)
+            if (is_employee_car or pk in self._assigned) and normalized_plate:
+                self._plates[pk] = normalized_plate
+            self._members = frozenset(self._plates.values())
+
+    def remove(self, pk):
+        self.update(pk, None, False)
+
+    def reset(self):
+        # Employee assignments move between cars; reload on next use
+        with self._lock:
+            self._plates = None
+
+
+class SessionRecorder:
+    """Queues employee entries and exits and writes them in batches."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="employee-sessions", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(_setting("EMPLOYEE_SESSION_FLUSH_INTERVAL", 1.0))
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def record(self, event_type, car_plate, moment, kiosk_id=None):
+        event = {"type": event_type, "car_plate": car_plate, "time": moment, "kiosk_id": kiosk_id}
+
+        def enqueue():
+            if not _setting("EMPLOYEE_SESSION_ASYNC", True):
+                self._write([event])
+                return
+            self._ensure_started()
+            with self._lock:
+                self._pending.append(event)
+                full = len(self._pending) >= _setting("EMPLOYEE_SESSION_BATCH_SIZE", 200)
+            if full:
+                self._wakeup.set()
+
+        # Only what the gate actually did once the request commits
+        transaction.on_commit(enqueue, using=current_database())
+
+    def flush(self):
+        with self._lock:
+            events, self._pending = self._pending, []
+        batch_size = min(_setting("EMPLOYEE_SESSION_BATCH_SIZE", 200), _setting("INGEST_MAX_EVENTS", 5000))
+        # One batch per run of consecutive events from the same kiosk, so a
+        # car's entry and exit at different kiosks keep their order
+        for _, run in groupby(events, key=lambda event: event["kiosk_id"]):
+            run = list(run)
+            for start in range(0, len(run), batch_size):
+                self._write(run[start:start + batch_size])
+        return len(events)
+
+    def _write(self, events):
+        kiosk_id = events[0]["kiosk_id"]
+        try:
+            with lot_scope(kiosk_lot(kiosk_id) if kiosk_id is not None else None):
+                results = ingest_events(events, kiosk_id=kiosk_id)
+        except Exception:
+            with self._lock:
+                self.failed += len(events)
+            logger.exception("Recording %d employee gate events failed", len(events))
+            return
+        rejected = [(event, result) for event, result in zip(events, results) if not result["ok"]]
+        for event, result in rejected:
+            logger.warning("Employee %s for %s not recorded: %s", event["type"], event["car_plate"], result["message"])
+        with self._lock:
+            self.recorded += len(events) - len(rejected)
+            self.failed += len(rejected)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._pending), "recorded": self.recorded, "failed": self.failed}
+
+
+allowlist = EmployeeAllowlist()
+recorder = SessionRecorder()
+
+
+def on_fast_path(car_plate):
+    return _setting("EMPLOYEE_FAST_PATH", True) and car_plate in allowlist
@@ -0,0 +1,132 @@
+"""Publish/subscribe for live dashboard events (entries, exits, payments).
+
+``LocalBroker`` fans events out to subscribers in this process.
+``RedisBroker`` publishes through Redis (or anything speaking its pub/sub
+protocol) and keeps a single Redis subscription per process that feeds the
+local subscribers, so every worker sees every event. Pick one with the
+``EVENT_BROKER`` setting.
+"""
+import json
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("main")
+
+CHANNEL = "parking-events"
+
+
+class Subscription:
+    def __init__(self, broker, max_pending):
+        self.broker = broker
+        self.max_pending = max_pending
+        self.closed = False
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._loop = None
+        self._async_queue = None
+
+    def bind_loop(self, loop, async_queue):
+        # Deliver to an asyncio.Queue on ``loop`` instead (ASGI consumers)
+        self._loop, self._async_queue = loop, async_queue
+
+    def deliver(self, event):
+        if self._loop is not None:
+            if self._async_queue.qsize() >= self.max_pending:
+                self.close()
+            else:
+                self._loop.call_soon_threadsafe(self._async_queue.put_nowait, event)
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # A consumer that cannot keep up is dropped rather than buffered forever
+            self.close()
+
+    def get(self, timeout=None):
+        """Return the next event, or None after ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout=None):
+        import asyncio
+
+        try:
+            return await asyncio.wait_for(self._async_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.closed = True
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self, self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event):
+        self._fan_out(event)
+
+    def _fan_out(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+class RedisBroker(LocalBroker):
+    def __init__(self, url=None, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisBroker requires the 'redis' package.")
+        self._redis = redis.Redis.from_url(url or getattr(settings, "EVENT_BROKER_URL", "redis://localhost:6379/0"))
+        self._listener = None
+
+    def subscribe(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="event-listener", daemon=True)
+                self._listener.start()
+        return super().subscribe()
+
+    def publish(self, event):
+        self._redis.publish(CHANNEL, json.dumps(event))
+
+    def _listen(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANNEL)
+        for message in pubsub.listen():
+            try:
+                self._fan_out(json.loads(message["data"]))
+            except (TypeError, ValueError):
+                logger.warning("Ignoring malformed event %r", message)
+
+
+broker = import_string(getattr(settings, "EVENT_BROKER", "parkingApp.events.LocalBroker"))()
+
+
+def publish_event(event_type, **data):
+    broker.publish({"type": event_type, **data})
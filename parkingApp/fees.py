@@ -0,0 +1,112 @@
+"""Server-side parking fee calculation.
+
+The fee is computed from the session's entry time and the active tariff
+(the most recently created ``Tariff``): employee cars (``is_employee_car``
+or assigned to an ``Employee``) park for free, stays
+within ``free_duration`` minutes are free, and after that every started hour
+is charged at ``hourly_rate``.
+
+Tariffs are cached in process, so a quote does not query the tariff table.
+The Tariff save/delete signals drop the cache once the change is committed
+(see parkingApp/signals.py) and it is reloaded every ``TARIFF_CACHE_TTL``
+seconds to pick up changes made by other processes.
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from parkingApp.models import Tariff
+
+FeeQuote = namedtuple(
+    "FeeQuote", ["duration", "amount", "is_within_free_period", "is_employee_vehicle", "tariff_id"]
+)
+
+_tariffs = None
+_tariffs_loaded_at = 0.0
+_tariffs_lock = threading.Lock()
+
+
+def _expired():
+    return _tariffs is None or time.monotonic() - _tariffs_loaded_at > getattr(settings, "TARIFF_CACHE_TTL", 60)
+
+
+def get_tariffs():
+    global _tariffs, _tariffs_loaded_at
+    tariffs = _tariffs
+    if _expired():
+        with _tariffs_lock:
+            if _expired():
+                _tariffs = {tariff.pk: tariff for tariff in Tariff.objects.all()}
+                _tariffs_loaded_at = time.monotonic()
+            tariffs = _tariffs
+    return tariffs
+
+
+def invalidate_tariffs():
+    global _tariffs
+    with _tariffs_lock:
+        _tariffs = None
+
+
+def active_tariff():
+    tariffs = get_tariffs()
+    if not tariffs:
+        raise ValueError("Tariff is not configured.")
+    return tariffs[max(tariffs)]
+
+
+def employee_car_filter(prefix=""):
+    """``Q`` for employee cars, reached through ``prefix`` (e.g. ``"car__"``)."""
+    return Q(**{f"{prefix}is_employee_car": True}) | Q(**{f"{prefix}employee__isnull": False})
+
+
+def is_employee_car(car):
+    """Whether ``car`` parks for free; the same rule as ``employee_car_filter``.
+
+    The gate allowlist (parkingApp/employees.py) is built from that filter,
+    so a car the gate lets through for free is never asked to pay. Select
+    ``employee`` with the car to spare a query for cars without the flag.
+    """
+    return car.is_employee_car or hasattr(car, "employee")
+
+
+def duration_minutes(entry_time, end_time):
+    return max(0, math.ceil((end_time - entry_time).total_seconds() / 60))
+
+
+def _quote(duration, is_employee_car, tariff):
+    if is_employee_car:
+        return FeeQuote(duration, Decimal("0.00"), False, True, tariff.pk)
+    if duration <= tariff.free_duration:
+        return FeeQuote(duration, Decimal("0.00"), True, False, tariff.pk)
+    started_hours = math.ceil((duration - tariff.free_duration) / 60)
+    return FeeQuote(duration, tariff.hourly_rate * started_hours, False, False, tariff.pk)
+
+
+def quote_fee(session, end_time=None):
+    """Quote ``session`` (a ParkingSession with its car) up to ``end_time``.
+
+    ``end_time`` is the payment time; every path that records a payment
+    quotes up to it, so the stored amount and duration agree. Defaults to now.
+    """
+    end_time = end_time or timezone.now()
+    return _quote(duration_minutes(session.entry_time, end_time), is_employee_car(session.car), active_tariff())
+
+
+def quote_fees(entry_times, end_times, employee_flags, tariff=None):
+    """Batch version of ``quote_fee`` over parallel sequences (``end_times`` are payment times).
+
+    Used to recompute historical fees; the tariff is resolved once for the
+    whole batch instead of once per row.
+    """
+    tariff = tariff or active_tariff()
+    return [
+        _quote(duration_minutes(entry_time, end_time), is_employee_car, tariff)
+        for entry_time, end_time, is_employee_car in zip(entry_times, end_times, employee_flags)
+    ]
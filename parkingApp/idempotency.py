@@ -0,0 +1,57 @@
+"""Idempotency keys for kiosk and gate mutations.
+
+A mutation that receives a key claims it by inserting an ``IdempotencyKey``
+row inside its own transaction. A retry with the same key blocks on the
+unique index until the first call's transaction ends; if that call
+committed, its stored response is replayed, and if it rolled back (or
+released the key) the retry runs normally.
+
+The key is stored with a fingerprint of the request, so a key reused for a
+request with different contents is refused instead of replaying the first
+response.
+"""
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+
+from parkingApp.db import current_database
+from parkingApp.models import IdempotencyKey
+
+
+def fingerprint(request):
+    """SHA-256 of ``request``, the JSON-serialisable contents of a call."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim(operation, key, request=None):
+    """Reserve ``key`` for ``operation`` called with ``request``.
+
+    Returns ``None`` when the key is new, otherwise the response stored by
+    the call that used it first.
+    """
+    digest = fingerprint(request)
+    try:
+        with transaction.atomic(using=current_database()):
+            IdempotencyKey.objects.create(operation=operation, key=key, fingerprint=digest)
+        return None
+    except IntegrityError:
+        response, stored_digest = (
+            IdempotencyKey.objects.filter(operation=operation, key=key)
+            .values_list("response", "fingerprint")
+            .first()
+        ) or (None, "")
+        if stored_digest and stored_digest != digest:
+            raise ValueError("This idempotency key was already used for a different request.")
+        if response is None:
+            raise ValueError("A request with this idempotency key is already being processed.")
+        return response
+
+
+def record(operation, key, response):
+    IdempotencyKey.objects.filter(operation=operation, key=key).update(response=response)
+
+
+def release(operation, key):
+    # The call did not go through, so a retry with the same key may run again
+    IdempotencyKey.objects.filter(operation=operation, key=key, response__isnull=True).delete()
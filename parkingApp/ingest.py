@@ -0,0 +1,268 @@
+"""Bulk ingestion of gate and kiosk events buffered while offline.
+
+A batch is a list of ``{"type": "entry" | "payment" | "exit", "car_plate":
+..., "time": ...}`` events in the order they happened. The whole batch is
+applied in one transaction with a fixed number of queries: cars are
+resolved (and missing ones created) in one go, the cars' open sessions are
+locked with one ``SELECT ... FOR UPDATE``, the events are replayed in
+memory, and the results are written with ``bulk_create``/``bulk_update``.
+
+A bad event does not stop the batch; every event gets its own result.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from parkingApp import idempotency
+from parkingApp.db import current_database
+from parkingApp.events import publish_event
+from parkingApp.fees import quote_fee
+from parkingApp.lots import kiosk_lot_or_none
+from parkingApp.models import Car, ParkingSession, Payment
+from parkingApp.occupancy import adjust_occupancy
+from parkingApp.plate_search import plate_index
+from parkingApp.plates import INVALID_PLATE_MESSAGE, is_valid_plate, normalize_plate
+from parkingApp.resolver_cache import invalidate_car_details
+from parkingApp.rollups import add_occupancy, add_revenues, revenue_snapshot
+
+EVENT_TYPES = ("entry", "payment", "exit")
+
+
+class IngestError(ValueError):
+    pass
+
+
+def _event_time(value):
+    if value is None:
+        return timezone.now()
+    if not isinstance(value, datetime):
+        try:
+            value = parse_datetime(str(value))
+        except ValueError:
+            value = None
+        if value is None:
+            raise IngestError("Invalid time.")
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def _clean(event):
+    if not isinstance(event, dict):
+        raise IngestError("Event must be an object.")
+    event_type = event.get("type")
+    if event_type not in EVENT_TYPES:
+        raise IngestError(f"Unknown event type {event_type!r}.")
+    car_plate = event.get("car_plate")
+    if not isinstance(car_plate, str) or not car_plate:
+        raise IngestError("car_plate is required.")
+    if event_type == "entry" and not is_valid_plate(car_plate):
+        raise IngestError(INVALID_PLATE_MESSAGE)
+    return event_type, normalize_plate(car_plate), _event_time(event.get("time"))
+
+
+def _cars_by_plate(plates):
+    # Legacy rows can share a normalized plate; the oldest wins, like
+    # everywhere else a plate is looked up
+    cars = {}
+    for car in Car.objects.filter(normalized_plate__in=plates).select_related("employee").order_by("pk"):
+        cars.setdefault(car.normalized_plate, car)
+    return cars
+
+
+def _resolve_cars(plates):
+    # One query for the known cars, one insert and one query for new ones
+    # (``plates`` are normalized; bulk_create skips the pre_save that sets it)
+    cars = _cars_by_plate(plates)
+    missing = [plate for plate in plates if plate not in cars]
+    if missing:
+        Car.objects.bulk_create(
+            [Car(car_plate=plate, normalized_plate=plate) for plate in missing], ignore_conflicts=True
+        )
+        created = _cars_by_plate(missing)
+        cars.update(created)
+        for car in created.values():
+            plate_index.update(car.pk, car.car_plate)  # bulk_create sends no post_save
+        # A carDetails lookup may have cached these plates as unknown
+        using = current_database()
+        transaction.on_commit(lambda: invalidate_car_details(*missing, using=using), using=using)
+    return cars
+
+
+def _set_exit_times(sessions, batch_size=500):
+    # Every row gets a different exit time, so instead of bulk_update's
+    # CASE WHEN chain (slow to build for large batches) join a VALUES list
+    connection = connections[current_database()]
+    table = connection.ops.quote_name(ParkingSession._meta.db_table)
+    for start in range(0, len(sessions), batch_size):
+        batch = sessions[start:start + batch_size]
+        values = ", ".join(["(%s, %s)"] * len(batch))
+        params = []
+        for session in batch:
+            params += [session.pk, connection.ops.adapt_datetimefield_value(session.exit_time)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH closed (id, exit_time) AS (VALUES {values}) "
+                f"UPDATE {table} SET exit_time = (SELECT closed.exit_time FROM closed WHERE closed.id = {table}.id) "
+                f"WHERE id IN (SELECT id FROM closed)",
+                params,
+            )
+
+
+def _apply(events, kiosk_id=None):
+    results = [None] * len(events)
+    cleaned = []
+    for index, event in enumerate(events):
+        try:
+            cleaned.append((index, *_clean(event)))
+        except IngestError as e:
+            results[index] = {"index": index, "ok": False, "message": str(e)}
+
+    entry_plates = {plate for _, event_type, plate, _ in cleaned if event_type == "entry"}
+    cars = _resolve_cars(entry_plates) if entry_plates else {}
+    other_plates = {plate for _, _, plate, _ in cleaned if plate not in cars}
+    if other_plates:
+        cars.update(_cars_by_plate(other_plates))
+
+    cars_by_id = {car.pk: car for car in cars.values()}
+    active = {}  # car id -> its open session, replayed in memory
+    for session in ParkingSession.objects.select_for_update(of=("self",)).filter(
+        car_id__in=list(cars_by_id), exit_time__isnull=True
+    ):
+        session.car = cars_by_id[session.car_id]
+        active[session.car_id] = session
+
+    new_sessions, changed_sessions, new_payments = [], {}, []
+    outcomes = []  # (index, session, payment)
+    for index, event_type, plate, time in cleaned:
+        car = cars.get(plate)
+        session = active.get(car.pk) if car else None
+        try:
+            if car is None:
+                raise IngestError("Car not found.")
+            if event_type == "entry":
+                if session is not None:
+                    raise IngestError("This car already has an active session.")
+                session = ParkingSession(car=car, entry_time=time, kiosk_id=kiosk_id)
+                new_sessions.append(session)
+                active[car.pk] = session
+                outcomes.append((index, session, None))
+                continue
+
+            if session is None:
+                raise IngestError("No active parking session found.")
+            if event_type == "payment":
+                if session.paid_status:
+                    raise IngestError("This parking session is already paid.")
+                quote = quote_fee(session, time)
+                payment = Payment(
+                    car=car,
+                    parking_session=session,
+                    amount=quote.amount,
+                    payment_time=time,
+                    duration=quote.duration,
+                    status="paid",
+                    is_within_free_period=quote.is_within_free_period,
+                    is_employee_vehicle=quote.is_employee_vehicle,
+                    kiosk_id=kiosk_id or session.kiosk_id,
+                )
+                new_payments.append(payment)
+                session.paid_status = True
+                outcomes.append((index, session, payment))
+            else:
+                if not session.paid_status and quote_fee(session, time).amount > 0:
+                    raise IngestError("Payment required.")
+                session.exit_time = time
+                del active[car.pk]
+                outcomes.append((index, session, None))
+            if session.pk is not None:
+                changed_sessions[session.pk] = session
+        except IngestError as e:
+            results[index] = {"index": index, "ok": False, "message": str(e)}
+
+    # Close existing sessions before inserting the cars' next ones, so the
+    # one_active_session_per_car constraint holds at every statement
+    paid = [session.pk for session in changed_sessions.values() if session.paid_status]
+    if paid:
+        ParkingSession.objects.filter(pk__in=paid).update(paid_status=True)
+    _set_exit_times([session for session in changed_sessions.values() if session.exit_time is not None])
+    if new_sessions:
+        ParkingSession.objects.bulk_create(new_sessions)
+    if new_payments:
+        Payment.objects.bulk_create(new_payments)
+
+    for index, session, payment in outcomes:
+        results[index] = {
+            "index": index,
+            "ok": True,
+            "message": None,
+            "parking_session_id": session.pk,
+            "payment_id": payment.pk if payment else None,
+        }
+    _announce(new_sessions, changed_sessions.values(), new_payments)
+    return results
+
+
+def _announce(new_sessions, changed_sessions, new_payments):
+    # bulk_create/bulk_update skip the signals in parkingApp/signals.py, so
+    # keep the occupancy counter, the rollups and the live events in step here
+    lot_deltas = Counter()
+    for session in new_sessions:
+        if session.exit_time is None:
+            lot_deltas[kiosk_lot_or_none(session.kiosk_id)] += 1
+    for session in changed_sessions:
+        if session.exit_time is not None:
+            lot_deltas[kiosk_lot_or_none(session.kiosk_id)] -= 1
+    adjust_occupancy(sum(lot_deltas.values()), lot_deltas)
+
+    days = defaultdict(lambda: [0, 0])  # day -> [entries, exits]
+    for session in new_sessions:
+        days[timezone.localdate(session.entry_time)][0] += 1
+    for session in list(new_sessions) + list(changed_sessions):
+        if session.exit_time is not None:
+            days[timezone.localdate(session.exit_time)][1] += 1
+    for day, (entries, exits) in sorted(days.items()):
+        add_occupancy(day, entries=entries, exits=exits)
+    add_revenues([revenue_snapshot(payment) for payment in new_payments])
+
+    events = [
+        ("entry", {"session_id": s.pk, "car_id": s.car_id, "time": s.entry_time.isoformat(), "occupancy_delta": 1})
+        for s in new_sessions
+    ] + [
+        ("exit", {"session_id": s.pk, "car_id": s.car_id, "time": s.exit_time.isoformat(), "occupancy_delta": -1})
+        for s in list(new_sessions) + list(changed_sessions) if s.exit_time is not None
+    ] + [
+        ("payment", {"payment_id": p.pk, "session_id": p.parking_session_id, "car_id": p.car_id, "amount": str(p.amount)})
+        for p in new_payments
+    ]
+
+    def publish():
+        for event_type, data in events:
+            publish_event(event_type, **data)
+
+    transaction.on_commit(publish, using=current_database())
+
+
+def ingest_events(events, idempotency_key=None, kiosk_id=None):
+    """Apply a batch of events and return one result dict per event.
+
+    New sessions and payments are recorded as made at ``kiosk_id``
+    (payments default to their session's kiosk).
+    """
+    max_events = getattr(settings, "INGEST_MAX_EVENTS", 5000)
+    if len(events) > max_events:
+        raise ValueError(f"A batch can hold at most {max_events} events.")
+
+    with transaction.atomic(using=current_database()):
+        if idempotency_key:
+            stored = idempotency.claim("ingestEvents", idempotency_key, {"events": events, "kiosk_id": kiosk_id})
+            if stored is not None:
+                return stored
+        results = _apply(events, kiosk_id)
+        if idempotency_key:
+            idempotency.record("ingestEvents", idempotency_key, results)
+    return results
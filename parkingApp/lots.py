@@ -0,0 +1,75 @@
+"""Parking lots and the databases they live on.
+
+A lot is a kiosk ``location``; every session and payment records the kiosk
+it went through. Mutations and the kiosks' own lookups (``quoteFee``,
+``carDetails``, ``searchCarByPlate``, ``searchCarsByPlate``) name their kiosk
+(``kioskId``, or ``X-Kiosk-Id`` on the NDJSON ingest endpoint) and list
+queries and ``occupancy`` can be scoped to a lot (``lot``).
+
+``LOT_DATABASES`` maps lots to database aliases, so a lot group can live on
+its own server. An operation that names a lot with its own database runs
+there entirely (``LotRouter`` and ``LotRoutingMiddleware`` in
+parkingApp/db.py). Every lot database holds the full schema (``migrate
+--database <alias>``) and its own cars; kiosks, tariffs and payment methods
+are reference data and have to be copied to each one with the same ids.
+
+Occupancy counters and rollups are kept per database and reports add them
+up over ``all_databases()`` (parkingApp/occupancy.py, parkingApp/rollups.py).
+
+The kiosk directory is read from the default database and cached like the
+hot read queries (parkingApp/resolver_cache.py); the Kiosk signals drop it.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from parkingApp.models import Kiosk
+from parkingApp.resolver_cache import get_or_compute, invalidate
+
+DIRECTORY_KEY = "kioskDirectory"
+
+
+def kiosk_directory():
+    """kiosk id -> location"""
+    return get_or_compute(
+        DIRECTORY_KEY, None, lambda: dict(Kiosk.objects.using(DEFAULT_DB_ALIAS).values_list("pk", "location"))
+    )
+
+
+def invalidate_kiosks():
+    invalidate(DIRECTORY_KEY)
+
+
+def kiosk_lot(kiosk_id):
+    try:
+        return kiosk_directory()[int(kiosk_id)]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Kiosk not found.")
+
+
+def kiosk_lot_or_none(kiosk_id):
+    """Like ``kiosk_lot``, but None for sessions without a (known) kiosk."""
+    return kiosk_directory().get(kiosk_id) if kiosk_id is not None else None
+
+
+def lot_kiosks(lot):
+    return [kiosk_id for kiosk_id, location in kiosk_directory().items() if location == lot]
+
+
+def lot_database(lot):
+    """The lot's own database alias, or None when it lives on the default one."""
+    alias = getattr(settings, "LOT_DATABASES", {}).get(lot)
+    return None if alias == DEFAULT_DB_ALIAS else alias
+
+
+def all_databases():
+    """The default database and every lot database, each once."""
+    aliases = set(getattr(settings, "LOT_DATABASES", {}).values()) - {DEFAULT_DB_ALIAS}
+    return [DEFAULT_DB_ALIAS, *sorted(aliases)]
+
+
+def kiosk_pk(kiosk_id):
+    """``kiosk_id`` as a primary key, rejecting unknown kiosks; None stays None."""
+    if kiosk_id is None:
+        return None
+    kiosk_lot(kiosk_id)
+    return int(kiosk_id)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from parkingApp.archive import archive_month, archive_root, live_months
+from parkingApp.models import ParkingSession, Payment
+from parkingApp.partitions import add_months, is_partitioned, month_start, partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Move sessions and payments older than N months out of the live tables into "
+        "gzip-compressed CSV files under PARTITION_ARCHIVE_DIR."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-months", type=int, default=12)
+        parser.add_argument("--dry-run", action="store_true", help="List the months without archiving them.")
+
+    def handle(self, *args, **options):
+        if options["older_than_months"] < 1:
+            raise CommandError("--older-than-months must be at least 1.")
+        cutoff = add_months(month_start(timezone.now().date()), -options["older_than_months"])
+
+        # Payments first: a session is only archived once no live payment points at it
+        for model in (Payment, ParkingSession):
+            table = model._meta.db_table
+            if is_partitioned(model):
+                months = sorted(month for month in partitions(model) if month < cutoff)
+            else:
+                months = live_months(model, cutoff)
+            for month in months:
+                if options["dry_run"]:
+                    self.stdout.write(f"{table} {month:%Y-%m}: would archive")
+                    continue
+                count = archive_month(model, month)
+                if count is None:
+                    self.stdout.write(f"{table} {month:%Y-%m}: skipped, has open or still paid-for sessions")
+                elif count:
+                    self.stdout.write(f"{table} {month:%Y-%m}: archived {count} rows")
+        self.stdout.write(f"Archive: {archive_root()}")
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parkingApp.rollups import rebuild_occupancy, rebuild_revenue
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily revenue and occupancy rollups from payment and session history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", help="First day to rebuild (ISO date); defaults to the oldest data.")
+        parser.add_argument("--to", dest="end", help="Last day to rebuild (ISO date); defaults to today.")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options["start"]) if options["start"] else None
+            end = date.fromisoformat(options["end"]) if options["end"] else None
+        except ValueError as error:
+            raise CommandError(error)
+        if start and end and start > end:
+            raise CommandError("--from must not be after --to.")
+
+        self.stdout.write(f"Revenue rows: {rebuild_revenue(start, end)}")
+        self.stdout.write(f"Occupancy days: {rebuild_occupancy(start, end)}")
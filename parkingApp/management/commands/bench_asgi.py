@@ -0,0 +1,79 @@
+import asyncio
+import base64
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parkingApp.benchmarking import run_load
+
+SEARCH_CAR_BY_PLATE = "query($carPlate: String!) { searchCarByPlate(carPlate: $carPlate) { id carPlate } }"
+QUOTE_FEE = "query($carPlate: String!) { quoteFee(carPlate: $carPlate) { amount duration } }"
+CREATE_ENTRY_CAR = """
+mutation($input: CreateEntryCarInput!) { createEntryCar(input: $input) { parkingSession { id } } }
+"""
+
+
+def request_factory(operation, photo_kb):
+    photo = base64.b64encode(os.urandom(photo_kb * 1024)).decode() if operation == "entry" else None
+
+    def make_request(index):
+        plate = f"{index % 10000:04d}"
+        if operation == "entry":
+            payload = {"query": CREATE_ENTRY_CAR, "variables": {"input": {"carPlate": plate, "entryPhoto": photo}}}
+        else:
+            query = SEARCH_CAR_BY_PLATE if operation == "search" else QUOTE_FEE
+            payload = {"query": query, "variables": {"carPlate": plate}}
+        return json.dumps(payload).encode(), "application/json"
+
+    return make_request
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test running GraphQL servers with a bespoke asyncio client, e.g. compare "
+        "`gunicorn parkingpayBE.wsgi` on /graphql/ with `uvicorn parkingpayBE.asgi:application` "
+        "on /graphql/async/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target", action="append", required=True, metavar="NAME=URL",
+            help="Server to test, e.g. wsgi=http://127.0.0.1:8000/graphql/ (repeatable).",
+        )
+        parser.add_argument("--operation", choices=["search", "quote", "entry"], default="search")
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=200)
+        parser.add_argument("--photo-kb", type=int, default=256, help="Photo size for --operation entry.")
+        parser.add_argument("--chunk-kb", type=int, help="Trickle request bodies in chunks of this size.")
+        parser.add_argument("--chunk-delay-ms", type=float, default=0.0, help="Delay between trickled chunks.")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["target"]:
+            name, _, url = target.partition("=")
+            if not url:
+                raise CommandError(f"--target must look like NAME=URL, got {target!r}")
+            targets.append((name, url))
+
+        make_request = request_factory(options["operation"], options["photo_kb"])
+        post_options = {
+            "chunk_size": options["chunk_kb"] * 1024 if options["chunk_kb"] else None,
+            "chunk_delay": options["chunk_delay_ms"] / 1000,
+        }
+        results = {}
+        for name, url in targets:
+            results[name] = asyncio.run(
+                run_load(url, make_request, options["requests"], options["concurrency"], **post_options)
+            )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'target':<10} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<10} {result['throughput_rps']:>8} {result.get('p50_ms', '-'):>9} "
+                f"{result.get('p99_ms', '-'):>9} {result['errors']:>7}"
+            )
@@ -0,0 +1,116 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.client import BOUNDARY, encode_multipart
+
+from parkingApp.benchmarking import bench_client, discarded_writes, latency_summary, peak_rss_kb
+
+MODES = ("base64", "multipart")
+PLATE_TOKEN = "@@PLATE@@"
+
+CREATE_ENTRY_CAR = """
+mutation CreateEntryCar($input: CreateEntryCarInput!) {
+  createEntryCar(input: $input) { parkingSession { id } }
+}
+"""
+
+
+def build_body(mode, photo):
+    # The request body is built once per run; only the plate changes between
+    # requests, so client-side memory is the same for every iteration.
+    if mode == "base64":
+        payload = {
+            "query": CREATE_ENTRY_CAR,
+            "variables": {"input": {"carPlate": PLATE_TOKEN, "entryPhoto": base64.b64encode(photo).decode()}},
+        }
+        return json.dumps(payload).encode(), "application/json"
+
+    operations = {
+        "query": CREATE_ENTRY_CAR,
+        "variables": {"input": {"carPlate": PLATE_TOKEN, "entryPhotoFile": None}},
+    }
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as photo_file:
+        photo_file.write(photo)
+        photo_file.seek(0)
+        body = encode_multipart(BOUNDARY, {
+            "operations": json.dumps(operations),
+            "map": json.dumps({"0": ["variables.input.entryPhotoFile"]}),
+            "0": photo_file,
+        })
+    return body, f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def run_mode(mode, requests, photo_kb):
+    body, content_type = build_body(mode, os.urandom(photo_kb * 1024))
+    client = bench_client()
+    latencies = []
+    errors = 0
+    baseline_rss = peak_rss_kb()
+
+    # Requests commit, so the photos are stored and compressed as in
+    # production and the peak RSS includes the workers
+    with discarded_writes():
+        for i in range(requests):
+            request_body = body.replace(PLATE_TOKEN.encode(), f"{i % 10000:04d}".encode(), 1)
+            start = time.perf_counter()
+            response = client.post("/graphql/", data=request_body, content_type=content_type)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or "errors" in response.json():
+                errors += 1
+
+    return {
+        "mode": mode,
+        "photo_kb": photo_kb,
+        "errors": errors,
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": peak_rss_kb(),
+        **latency_summary(latencies),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare peak RSS and latency of base64 and multipart entry-photo uploads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        # Base64 bodies above DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB) are rejected by Django
+        parser.add_argument("--photo-kb", type=int, default=1024, help="Size of the synthetic photo.")
+        parser.add_argument("--mode", choices=MODES, help="Run only this mode in the current process.")
+
+    def handle(self, *args, **options):
+        if options["mode"]:
+            result = run_mode(options["mode"], options["requests"], options["photo_kb"])
+            self.stdout.write(json.dumps(result))
+            return
+
+        # Each mode runs in its own process because peak RSS is a high-water
+        # mark that never goes down.
+        results = []
+        for mode in MODES:
+            completed = subprocess.run(
+                [
+                    sys.executable, "manage.py", "bench_entry_photo",
+                    "--mode", mode,
+                    "--requests", str(options["requests"]),
+                    "--photo-kb", str(options["photo_kb"]),
+                ],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        self.stdout.write(f"{'mode':<10} {'peak RSS KB':>12} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<10} {result['peak_rss_kb'] - result['baseline_rss_kb']:>12} "
+                f"{result['p50_ms']:>9} {result['p99_ms']:>9} {result['errors']:>7}"
+            )
@@ -0,0 +1,200 @@
+import base64
+import json
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from parkingApp.benchmarking import (
+    bench_client, discarded_writes, latency_summary, run_metadata, synthetic_plate, write_results,
+)
+from parkingApp.models import Car, ParkingSession, Payment
+from parkingApp.photos import pipeline
+
+CREATE_ENTRY_CAR = """
+mutation CreateEntryCar($input: CreateEntryCarInput!) {
+  createEntryCar(input: $input) { gateOpen parkingSession { id entryTime } }
+}
+"""
+SEARCH_CAR_BY_PLATE = """
+query SearchCarByPlate($carPlate: String!) { searchCarByPlate(carPlate: $carPlate) { id carPlate } }
+"""
+SAVE_PAYMENT = """
+mutation SavePayment($input: SavePaymentInput!) { savePayment(input: $input) { success message payment { id amount } } }
+"""
+DASHBOARD = """
+query Dashboard {
+  occupancy
+  allParkingSessions(first: 50, active: true) {
+    edges { node { id entryTime car { carPlate } } }
+  }
+  allPayments(first: 50) {
+    edges { node { id amount paymentTime paymentMethod { methodName } car { carPlate } } }
+  }
+}
+"""
+
+# Gate and kiosk traffic of a busy day
+DEFAULT_MIX = "entry=25,search=35,payment=20,dashboard=20"
+FLOWS = ("entry", "search", "payment", "dashboard")
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in FLOWS or not weight.isdigit():
+            raise CommandError(f"--mix entries look like NAME=WEIGHT with NAME in {', '.join(FLOWS)}, got {part!r}")
+        weights[name] = int(weight)
+    return weights
+
+
+class TrafficMix:
+    """Builds the next request of a reproducible entry/search/payment/dashboard mix."""
+
+    def __init__(self, weights, seed, photo_kb, seeded_cars):
+        self.rng = random.Random(seed)
+        self.flows, self.weights = zip(*weights.items())
+        self.photo = base64.b64encode(random.Random(seed).randbytes(photo_kb * 1024)).decode() if photo_kb else None
+        self.next_index = seeded_cars  # seed_benchmark_data plates are synthetic_plate(0..n-1)
+        self.parked = []  # Plates entered during the run and not paid yet
+
+    def next_request(self):
+        flow = self.rng.choices(self.flows, self.weights)[0]
+        if flow == "payment" and not self.parked:
+            flow = "entry"  # Nothing to pay for yet
+        if flow == "entry":
+            plate = synthetic_plate(self.next_index)
+            self.next_index += 1
+            self.parked.append(plate)
+            return flow, CREATE_ENTRY_CAR, {"input": {"carPlate": plate, "entryPhoto": self.photo}}
+        if flow == "search":
+            plate = synthetic_plate(self.rng.randrange(max(self.next_index, 1)))
+            return flow, SEARCH_CAR_BY_PLATE, {"carPlate": plate[:4]}
+        if flow == "payment":
+            plate = self.parked.pop(self.rng.randrange(len(self.parked)))
+            return flow, SAVE_PAYMENT, {"input": {"carPlate": plate, "paymentTime": timezone.now().isoformat()}}
+        return flow, DASHBOARD, {}
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a gate/kiosk traffic mix (createEntryCar with photos, searchCarByPlate, savePayment, "
+        "dashboard lists) against /graphql/ in process and report throughput, latency percentiles and "
+        "query counts per flow. Seed data first with seed_benchmark_data. Requests commit as in production; "
+        "the rows they create are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--warmup", type=int, default=50, help="Requests sent before measuring.")
+        parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Flow weights, default {DEFAULT_MIX}.")
+        parser.add_argument("--photo-kb", type=int, default=64, help="Entry photo size (0 sends none).")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--baseline", help="Earlier --output file to compare against.")
+
+    def handle(self, *args, **options):
+        rows = {
+            "cars": Car.objects.count(),
+            "sessions": ParkingSession.objects.count(),
+            "payments": Payment.objects.count(),
+        }
+        mix = TrafficMix(parse_mix(options["mix"]), options["seed"], options["photo_kb"], rows["cars"])
+        client = bench_client()
+        latencies = {flow: [] for flow in FLOWS}
+        queries = {flow: [] for flow in FLOWS}
+        errors = {flow: 0 for flow in FLOWS}
+
+        photos_before = pipeline.stats()["processed"]
+        with discarded_writes():
+            for _ in range(options["warmup"]):
+                flow, query, variables = mix.next_request()
+                self.post(client, query, variables)
+            started = time.perf_counter()
+            for _ in range(options["requests"]):
+                flow, query, variables = mix.next_request()
+                with CaptureQueriesContext(connection) as captured:
+                    request_start = time.perf_counter()
+                    ok = self.post(client, query, variables)
+                    latencies[flow].append(time.perf_counter() - request_start)
+                queries[flow].append(len(captured))
+                errors[flow] += not ok
+            elapsed = time.perf_counter() - started
+        # Photos are encoded by the background workers after each commit, so
+        # their cost is not in the request latencies
+        photos = pipeline.stats()["processed"] - photos_before
+
+        flows = {}
+        for flow in FLOWS:
+            if not latencies[flow]:
+                continue
+            flows[flow] = {
+                **latency_summary(latencies[flow]),
+                "errors": errors[flow],
+                "queries_mean": round(sum(queries[flow]) / len(queries[flow]), 2),
+                "queries_max": max(queries[flow]),
+            }
+        total = sum(len(values) for values in latencies.values())
+        results = {
+            "benchmark": "bench_flows",
+            **run_metadata(),
+            "options": {name: options[name] for name in ("requests", "warmup", "mix", "photo_kb", "seed")},
+            "rows": rows,
+            "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "overall": latency_summary([value for values in latencies.values() for value in values]),
+            "flows": flows,
+            "photos_processed": photos,
+        }
+
+        self.report(results, self.load_baseline(options["baseline"]))
+        if options["output"]:
+            write_results(options["output"], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def post(self, client, query, variables):
+        response = client.post(
+            "/graphql/", json.dumps({"query": query, "variables": variables}), content_type="application/json"
+        )
+        if response.status_code != 200:
+            return False
+        body = response.json()
+        data = body.get("data") or {}
+        payment = data.get("savePayment")
+        return "errors" not in body and (payment is None or payment["success"])
+
+    def load_baseline(self, path):
+        if not path:
+            return None
+        if not os.path.exists(path):
+            raise CommandError(f"Baseline file {path} does not exist.")
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+
+    def report(self, results, baseline):
+        def change(flow, key):
+            if not baseline or flow not in baseline.get("flows", {}):
+                return ""
+            before = baseline["flows"][flow].get(key)
+            if not before:
+                return ""
+            return f" ({(results['flows'][flow][key] - before) / before:+.0%})"
+
+        self.stdout.write(
+            f"{results['rows']['cars']:,} cars, {results['rows']['sessions']:,} sessions, "
+            f"{results['rows']['payments']:,} payments on {results['database']}; "
+            f"{results['throughput_rps']} req/s overall, {results['photos_processed']} photos processed in the background"
+        )
+        self.stdout.write(
+            f"{'flow':<10} {'count':>6} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'queries':>8} {'errors':>7}"
+        )
+        for flow, stats in results["flows"].items():
+            self.stdout.write(
+                f"{flow:<10} {stats['count']:>6} {str(stats['p50_ms']) + change(flow, 'p50_ms'):>16} "
+                f"{str(stats['p95_ms']) + change(flow, 'p95_ms'):>16} {str(stats['p99_ms']) + change(flow, 'p99_ms'):>16} "
+                f"{stats['queries_mean']:>8} {stats['errors']:>7}"
+            )
@@ -0,0 +1,79 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from parkingApp.benchmarking import bench_client, latency_summary
+from parkingApp.documents import document_cache, query_hash
+
+# The kiosk operations, with inputs that do not write to the database
+KIOSK_OPERATIONS = [
+    (
+        """
+        query SearchCarByPlate($carPlate: String!) {
+          searchCarByPlate(carPlate: $carPlate) { id carPlate entryPhoto isEmployeeCar parkingSessions { id entryTime exitTime paidStatus } }
+        }
+        """,
+        {"carPlate": "0000"},
+    ),
+    (
+        """
+        mutation CreateEntryCar($input: CreateEntryCarInput!) {
+          createEntryCar(input: $input) { car { id carPlate } parkingSession { id entryTime } }
+        }
+        """,
+        {"input": {"carPlate": "invalid", "entryPhoto": ""}},
+    ),
+    (
+        """
+        mutation SavePayment($input: SavePaymentInput!) {
+          savePayment(input: $input) { success message payment { id amount duration } }
+        }
+        """,
+        {"input": {"carPlate": "bench-missing", "paymentTime": "2024-01-01T00:00:00Z"}},
+    ),
+]
+
+
+class Command(BaseCommand):
+    help = "Measure per-request CPU of kiosk operations with and without the parsed-document cache and APQ."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+
+    def run(self, client, mode, requests):
+        cpu_times, latencies = [], []
+        for index in range(requests):
+            query, variables = KIOSK_OPERATIONS[index % len(KIOSK_OPERATIONS)]
+            payload = {"variables": variables}
+            if mode == "apq":
+                payload["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+            else:
+                payload["query"] = query
+            if mode == "no-cache":
+                document_cache.clear()
+
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            client.post("/graphql/", json.dumps(payload), content_type="application/json")
+            cpu_times.append(time.process_time() - cpu_start)
+            latencies.append(time.perf_counter() - wall_start)
+
+        summary = latency_summary(latencies)
+        summary["cpu_us"] = round(sum(cpu_times) / len(cpu_times) * 1_000_000, 1)
+        return summary
+
+    def handle(self, *args, **options):
+        client = bench_client()
+        # Register every operation once so APQ requests can send only the hash
+        for query, variables in KIOSK_OPERATIONS:
+            client.post("/graphql/", json.dumps({
+                "query": query,
+                "variables": variables,
+                "extensions": {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}},
+            }), content_type="application/json")
+
+        self.stdout.write(f"{'mode':<10} {'CPU us/req':>11} {'p50 ms':>8} {'p99 ms':>8}")
+        for mode in ("no-cache", "cache", "apq"):
+            result = self.run(client, mode, options["requests"])
+            self.stdout.write(f"{mode:<10} {result['cpu_us']:>11} {result['p50_ms']:>8} {result['p99_ms']:>8}")
+        self.stdout.write(f"Document cache hits: {document_cache.hits}, misses: {document_cache.misses}")
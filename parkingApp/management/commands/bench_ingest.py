@@ -0,0 +1,59 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from parkingApp.benchmarking import bench_client, latency_summary
+from parkingApp.models import Tariff
+
+
+def backlog(cars, start):
+    # entry, payment and exit for every car, in the order a gate would see them
+    events = []
+    for step, event_type in enumerate(("entry", "payment", "exit")):
+        time = (start + timedelta(minutes=45 * step)).isoformat()
+        events += [{"type": event_type, "car_plate": f"{index:04d}", "time": time} for index in range(cars)]
+    return events
+
+
+class Command(BaseCommand):
+    help = "Measure events/sec of the NDJSON bulk ingestion endpoint (the database is rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cars", type=int, default=5000, help="Cars per run, at most 10000 (3 events each)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--runs", type=int, default=3)
+
+    def handle(self, *args, **options):
+        cars = min(options["cars"], 10000)
+        batch_size = options["batch_size"]
+        client = bench_client()
+        events = backlog(cars, timezone.now() - timedelta(hours=3))
+        batches = [
+            "".join(json.dumps(event) + "\n" for event in events[start:start + batch_size])
+            for start in range(0, len(events), batch_size)
+        ]
+
+        for run in range(options["runs"]):
+            latencies, failed = [], 0
+            with transaction.atomic():
+                if not Tariff.objects.exists():
+                    Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+                started = time.perf_counter()
+                for body in batches:
+                    batch_start = time.perf_counter()
+                    response = client.post("/ingest/", data=body, content_type="application/x-ndjson")
+                    latencies.append(time.perf_counter() - batch_start)
+                    failed += sum(not json.loads(line)["ok"] for line in response.content.splitlines())
+                elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+
+            summary = latency_summary(latencies)
+            self.stdout.write(
+                f"run {run + 1}: {len(events)} events in {elapsed:.2f}s = {len(events) / elapsed:,.0f} events/s, "
+                f"batch p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms, failed {failed}"
+            )
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, CharField, OuterRef, Q, Subquery, Value, When
+
+from parkingApp.models import Car, ParkingSession
+from parkingApp.photos import content_name
+
+# Every field that points at a car photo
+PHOTO_FIELDS = [
+    (Car, "entry_photo"),
+    (ParkingSession, "entry_photo"),
+    (ParkingSession, "exit_photo"),
+]
+PHOTO_DIRS = ["car_photos/entry", "car_photos/exit"]
+CONTENT_NAME_RE = re.compile(r"^[0-9a-f]{64}(_thumb)?\.\w+$")
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_NAME_RE.match(os.path.basename(name)))
+
+
+def file_digest(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name, "rb") as photo:
+        for chunk in photo.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk(directory):
+    if not default_storage.exists(directory):
+        return
+    subdirectories, files = default_storage.listdir(directory)
+    for filename in files:
+        yield f"{directory}/{filename}"
+    for subdirectory in subdirectories:
+        yield from walk(f"{directory}/{subdirectory}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy car entry photos onto their latest parking session and move every "
+        "car photo to its content-addressed, sharded location."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing.")
+        parser.add_argument("--delete-orphans", action="store_true", help="Delete photos no row refers to.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        batch_size = options["batch_size"]
+
+        backfilled = self.backfill_sessions(dry_run, batch_size)
+        self.stdout.write(f"Sessions given their car's entry photo: {backfilled}")
+
+        referenced = set()
+        for model, field_name in PHOTO_FIELDS:
+            referenced.update(
+                model.objects.exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .values_list(field_name, flat=True)
+                .distinct()
+            )
+
+        renames = {}
+        duplicates = 0
+        for name in sorted(referenced):
+            if is_content_addressed(name) or not default_storage.exists(name):
+                continue
+            new_name = content_name(os.path.dirname(name), file_digest(name), os.path.splitext(name)[1].lower())
+            renames[name] = new_name
+            if dry_run:
+                continue
+            if default_storage.exists(new_name):
+                duplicates += 1
+            else:
+                with default_storage.open(name, "rb") as photo:
+                    default_storage.save(new_name, photo)
+
+        if not dry_run:
+            with transaction.atomic():
+                for model, field_name in PHOTO_FIELDS:
+                    self.rewrite(model, field_name, renames, batch_size)
+            for name in renames:
+                default_storage.delete(name)
+        self.stdout.write(f"Photos moved: {len(renames) - duplicates}, merged duplicates: {duplicates}")
+
+        kept = set(renames.values()) | (referenced - set(renames))
+        orphans = [
+            name
+            for directory in PHOTO_DIRS
+            for name in walk(directory)
+            if name not in kept and name not in renames and not is_content_addressed(name)
+        ]
+        if options["delete_orphans"] and not dry_run:
+            for name in orphans:
+                default_storage.delete(name)
+            self.stdout.write(f"Orphaned photos deleted: {len(orphans)}")
+        else:
+            self.stdout.write(f"Orphaned photos found: {len(orphans)} (use --delete-orphans to remove)")
+
+    def backfill_sessions(self, dry_run, batch_size):
+        # Only the latest photo per car survived, so it goes to the car's latest session
+        latest_session = (
+            ParkingSession.objects.filter(car=OuterRef("pk")).order_by("-entry_time").values("pk")[:1]
+        )
+        pairs = (
+            Car.objects.exclude(entry_photo="")
+            .exclude(entry_photo__isnull=True)
+            .annotate(session_id=Subquery(latest_session))
+            .filter(session_id__isnull=False)
+            .order_by("pk")
+            .values_list("session_id", "entry_photo")
+        )
+        backfilled = 0
+        for start in range(0, pairs.count(), batch_size):
+            photos = dict(pairs[start:start + batch_size])
+            sessions = [
+                ParkingSession(pk=session_id, entry_photo=photos[session_id])
+                for session_id in ParkingSession.objects.filter(pk__in=photos)
+                .filter(Q(entry_photo="") | Q(entry_photo__isnull=True))
+                .values_list("pk", flat=True)
+            ]
+            if not dry_run:
+                ParkingSession.objects.bulk_update(sessions, ["entry_photo"], batch_size=batch_size)
+            backfilled += len(sessions)
+        return backfilled
+
+    def rewrite(self, model, field_name, renames, batch_size):
+        items = list(renames.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            model.objects.filter(**{f"{field_name}__in": [old for old, _ in batch]}).update(**{
+                field_name: Case(
+                    *[When(**{field_name: old}, then=Value(new)) for old, new in batch],
+                    output_field=CharField(),
+                )
+            })
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from parkingApp.partitions import PARTITION_COLUMNS, convert_table, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming monthly partitions of the session and payment tables (PostgreSQL). "
+        "With --convert, first rebuild unpartitioned tables as partitioned ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3)
+        parser.add_argument(
+            "--convert", action="store_true",
+            help="Rebuild the tables as partitioned tables; locks them while rows are copied.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Table partitioning is only supported on PostgreSQL.")
+        for model, column in PARTITION_COLUMNS.items():
+            table = model._meta.db_table
+            if options["convert"] and convert_table(model, options["months_ahead"]):
+                self.stdout.write(f"{table}: converted to monthly partitions on {column}")
+            if not is_partitioned(model):
+                self.stdout.write(f"{table}: not partitioned, run with --convert first")
+                continue
+            ensure_partitions(model, options["months_ahead"])
+            self.stdout.write(f"{table}: partitions ready {options['months_ahead']} months ahead")
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper
+from django.utils import timezone
+
+from parkingApp.fees import active_tariff, employee_car_filter, get_tariffs, quote_fees
+from parkingApp.models import Payment
+from parkingApp.rollups import rebuild_revenue
+
+
+class Command(BaseCommand):
+    help = "Recompute amount, duration and free/employee flags of historical payments with the fee engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tariff-id", type=int, help="Tariff to apply (defaults to the active tariff).")
+        parser.add_argument(
+            "--since", help="Only payments made on or after this ISO date or time (in TIME_ZONE unless it has an offset)."
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--dry-run", action="store_true", help="Count the changes without saving them.")
+
+    def handle(self, *args, **options):
+        try:
+            tariff = get_tariffs()[options["tariff_id"]] if options["tariff_id"] else active_tariff()
+        except (KeyError, ValueError) as error:
+            raise CommandError(f"Unknown tariff: {error}")
+
+        since = None
+        if options["since"]:
+            try:
+                since = datetime.fromisoformat(options["since"])
+            except ValueError:
+                raise CommandError(f"--since is not an ISO date or time: {options['since']!r}")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        payments = Payment.objects.order_by("pk")
+        if since:
+            payments = payments.filter(payment_time__gte=since)
+        rows = payments.annotate(
+            is_employee_car=ExpressionWrapper(employee_car_filter("car__"), output_field=BooleanField()),
+        ).values_list(
+            "pk", "parking_session__entry_time", "payment_time", "is_employee_car",
+            "amount", "duration", "is_within_free_period", "is_employee_vehicle",
+        )
+
+        batch_size = options["batch_size"]
+        changed = total = 0
+        last_pk = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            quotes = quote_fees(
+                [row[1] for row in batch],
+                # Charged up to the payment time, like savePayment and ingest
+                [row[2] for row in batch],
+                [row[3] for row in batch],
+                tariff=tariff,
+            )
+            updates = [
+                Payment(
+                    pk=row[0],
+                    amount=quote.amount,
+                    duration=quote.duration,
+                    is_within_free_period=quote.is_within_free_period,
+                    is_employee_vehicle=quote.is_employee_vehicle,
+                )
+                for row, quote in zip(batch, quotes)
+                # Also when only the flags changed, e.g. a car became an employee's
+                if row[4:] != (quote.amount, quote.duration, quote.is_within_free_period, quote.is_employee_vehicle)
+            ]
+            total += len(batch)
+            changed += len(updates)
+            if updates and not options["dry_run"]:
+                with transaction.atomic():
+                    Payment.objects.bulk_update(
+                        updates,
+                        ["amount", "duration", "is_within_free_period", "is_employee_vehicle"],
+                        batch_size=batch_size,
+                    )
+
+        if changed and not options["dry_run"]:
+            # bulk_update skips the signals that maintain the revenue rollups
+            rebuild_revenue(start=timezone.localdate(since) if since else None)
+
+        verb = "would change" if options["dry_run"] else "changed"
+        self.stdout.write(f"Payments checked: {total}, {verb}: {changed}")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from parkingApp.occupancy import recount_occupancy
+
+
+class Command(BaseCommand):
+    help = "Rebuild the occupancy counter from open parking sessions (e.g. after bulk edits that skip signals)."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Active sessions: {recount_occupancy()}")
@@ -0,0 +1,135 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from parkingApp.benchmarking import synthetic_plate
+from parkingApp.fees import quote_fees
+from parkingApp.models import Car, ParkingSession, Payment, PaymentMethod, Tariff
+from parkingApp.occupancy import recount_occupancy
+from parkingApp.rollups import rebuild_occupancy, rebuild_revenue
+
+PAYMENT_METHODS = ("QPay", "SocialPay", "Card", "Cash")
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill a local database with synthetic cars, parking sessions and payments for bench_flows. "
+        "Rows are written with bulk inserts, then the occupancy counter and rollups are rebuilt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000, help="Approximate cars + sessions + payments (1k to 10M).")
+        parser.add_argument("--sessions-per-car", type=int, default=3)
+        parser.add_argument("--paid-share", type=float, default=0.9, help="Share of closed sessions with a payment.")
+        parser.add_argument("--active-share", type=float, default=0.05, help="Share of cars parked right now.")
+        parser.add_argument("--employee-share", type=float, default=0.02)
+        parser.add_argument("--days", type=int, default=90, help="History the sessions are spread over.")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Cars written per transaction.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--append", action="store_true", help="Add to a database that already has cars.")
+
+    def handle(self, *args, **options):
+        if Car.objects.exists() and not options["append"]:
+            raise CommandError("The database already has cars; use a fresh database or pass --append.")
+        sessions_per_car = max(options["sessions_per_car"], 1)
+        rows_per_car = 1 + sessions_per_car * (1 + options["paid_share"])
+        cars = max(int(options["rows"] / rows_per_car), 1)
+        rng = random.Random(options["seed"])
+
+        tariff = Tariff.objects.order_by("-pk").first() or Tariff.objects.create(
+            free_duration=30, hourly_rate=Decimal("1000")
+        )
+        methods = list(PaymentMethod.objects.all()) or [
+            PaymentMethod.objects.create(method_name=name) for name in PAYMENT_METHODS
+        ]
+        first_index = Car.objects.count()
+        now = timezone.now()
+        history = timedelta(days=options["days"])
+
+        started = time.perf_counter()
+        totals = {"cars": 0, "sessions": 0, "payments": 0}
+        for chunk_start in range(0, cars, options["chunk_size"]):
+            chunk = range(chunk_start, min(chunk_start + options["chunk_size"], cars))
+            with transaction.atomic():
+                written = self.write_chunk(
+                    [first_index + index for index in chunk], sessions_per_car, options, rng, tariff, methods, now, history
+                )
+            for name, count in written.items():
+                totals[name] += count
+            self.stdout.write(
+                f"{totals['cars']:,}/{cars:,} cars, {totals['sessions']:,} sessions, {totals['payments']:,} payments "
+                f"({time.perf_counter() - started:.0f}s)"
+            )
+
+        # bulk_create skips the signals that maintain these
+        recount_occupancy()
+        rebuild_revenue()
+        rebuild_occupancy()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {sum(totals.values()):,} rows in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def write_chunk(self, indexes, sessions_per_car, options, rng, tariff, methods, now, history):
+        cars = Car.objects.bulk_create([
+            Car(
+                car_plate=synthetic_plate(index),
+                normalized_plate=synthetic_plate(index),
+                is_employee_car=rng.random() < options["employee_share"],
+            )
+            for index in indexes
+        ])
+
+        sessions = []
+        for car in cars:
+            # Back-to-back stays, oldest first; only the last one can be open
+            moment = now - history * rng.random()
+            for number in range(sessions_per_car):
+                entry_time = moment
+                if entry_time >= now:
+                    break
+                stay = timedelta(minutes=rng.randint(5, 600))
+                moment = entry_time + stay + timedelta(minutes=rng.randint(10, 3000))
+                last = number == sessions_per_car - 1
+                is_open = (last and rng.random() < options["active_share"]) or entry_time + stay >= now
+                sessions.append(ParkingSession(
+                    car=car, entry_time=entry_time, exit_time=None if is_open else entry_time + stay,
+                ))
+                if is_open:
+                    break
+        paid = [session for session in sessions if session.exit_time is not None and rng.random() < options["paid_share"]]
+        for session in paid:
+            session.paid_status = True
+        ParkingSession.objects.bulk_create(sessions)
+
+        # Paid up to ten minutes before leaving, and quoted up to the payment
+        payment_times = [
+            session.exit_time - min(timedelta(minutes=rng.randint(0, 10)), session.exit_time - session.entry_time)
+            for session in paid
+        ]
+        quotes = quote_fees(
+            [session.entry_time for session in paid],
+            payment_times,
+            [session.car.is_employee_car for session in paid],
+            tariff,
+        )
+        payments = [
+            Payment(
+                car=session.car,
+                parking_session=session,
+                amount=quote.amount,
+                payment_time=payment_time,
+                duration=quote.duration,
+                status="paid",
+                payment_method=rng.choice(methods),
+                is_within_free_period=quote.is_within_free_period,
+                is_employee_vehicle=quote.is_employee_vehicle,
+            )
+            for session, payment_time, quote in zip(paid, payment_times, quotes)
+        ]
+        Payment.objects.bulk_create(payments)
+        return {"cars": len(cars), "sessions": len(sessions), "payments": len(payments)}
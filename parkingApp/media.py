@@ -0,0 +1,114 @@
+"""Serving uploaded media: payment QR codes and logos, and car photos.
+
+``versioned_url`` appends the first characters of the file's SHA-256 to its
+URL (``/media/payment_qrs/qpay.png?v=3f2a...``). ``serve_media`` answers
+such URLs with a one-year ``immutable`` Cache-Control, so kiosks and a CDN
+keep the bytes until the file changes and with it the URL; unversioned URLs
+get ``MEDIA_CACHE_MAX_AGE``. Every response carries an ETag and
+Last-Modified and conditional requests get a 304.
+
+Files under ``MEDIA_PUBLIC_DIRS`` are served to everyone. Anything else (the
+car photos) only to staff users logged in through the admin, with a
+``private`` Cache-Control so shared caches keep no copy; everyone else gets
+a 404.
+
+With ``MEDIA_SENDFILE`` set to ``"x-sendfile"`` (Apache, lighttpd) or
+``"x-accel-redirect"`` (nginx, with ``MEDIA_ACCEL_REDIRECT_PREFIX`` mapped
+to MEDIA_ROOT as an ``internal`` location) Django only sets the headers and
+the front proxy sends the file.
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+VERSION_LENGTH = 12
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_digests = {}  # path -> (mtime_ns, size, sha256 hex)
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """SHA-256 of the file at ``path``, recomputed only when it changes."""
+    stat = os.stat(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as media_file:
+        for chunk in iter(lambda: media_file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    with _digests_lock:
+        _digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def versioned_url(field_file):
+    """URL of ``field_file`` with its content hash, or ``None`` when empty."""
+    if not field_file:
+        return None
+    try:
+        digest = file_digest(field_file.path)
+    except (OSError, NotImplementedError):
+        return field_file.url  # Missing file or remote storage
+    return f"{field_file.url}?v={digest[:VERSION_LENGTH]}"
+
+
+def _sendfile_response(path, relative_path, content_type):
+    mode = getattr(settings, "MEDIA_SENDFILE", None)
+    response = HttpResponse(content_type=content_type)
+    if mode == "x-sendfile":
+        response["X-Sendfile"] = path
+    elif mode == "x-accel-redirect":
+        prefix = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+        response["X-Accel-Redirect"] = prefix + quote(relative_path)
+    else:
+        raise ImproperlyConfigured(f"Unknown MEDIA_SENDFILE mode {mode!r}.")
+    return response
+
+
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("File not found.")
+    # Checked on the joined path, so "payment_qrs/../car_photos/..." is caught
+    relative_path = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, "/")
+    public = relative_path.startswith(tuple(getattr(settings, "MEDIA_PUBLIC_DIRS", ("payment_qrs/", "payment_logos/"))))
+    if not (public or request.user.is_staff) or not os.path.isfile(full_path):
+        raise Http404("File not found.")
+
+    stat = os.stat(full_path)
+    digest = file_digest(full_path)
+    etag = f'"{digest[:32]}"'
+    last_modified = http_date(stat.st_mtime)
+    if request.GET.get("v") == digest[:VERSION_LENGTH]:
+        cache_control = IMMUTABLE
+    else:
+        cache_control = f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 300)}"
+    if not public:
+        cache_control = cache_control.replace("public", "private")
+
+    # 304 (or 412) for conditional requests, None otherwise
+    response = get_conditional_response(request, etag=etag, last_modified=stat.st_mtime)
+    if response is None:
+        content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        if getattr(settings, "MEDIA_SENDFILE", None):
+            response = _sendfile_response(full_path, relative_path, content_type)
+        else:
+            response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    response["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,302 @@
+"""Per-operation and per-field GraphQL metrics.
+
+``trace_operation`` wraps one GraphQL operation: it times it and counts the
+SQL statements it runs, and their time, on every database connection.
+``InstrumentationMiddleware`` attributes wall time, statements and input
+bytes (base64 photos and uploads included) to each resolved field. Totals
+are kept per process and rendered in the Prometheus text format for the
+``/metrics`` endpoint (parkingApp/views.py).
+
+SQL statements slower than ``GRAPHQL_SLOW_QUERY_MS`` and operations slower
+than ``GRAPHQL_SLOW_OPERATION_MS`` are logged for a
+``GRAPHQL_SLOW_LOG_SAMPLE_RATE`` share of occurrences.
+
+With ``GRAPHQL_TRACING`` on, requests sent with ``X-GraphQL-Tracing: 1`` get
+an Apollo-style ``extensions.tracing`` block listing every resolver.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+
+from parkingApp.admission import admission
+from parkingApp.db import connection_stats
+from parkingApp.photos import pipeline
+
+logger = logging.getLogger("main")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_OPERATION_NAMES = 200  # Client-chosen names beyond this are counted as "other"
+OPERATION_NAME_RE = re.compile(r"^[_A-Za-z][_0-9A-Za-z]{0,63}$")
+
+_current = ContextVar("graphql_trace", default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _sampled():
+    return random.random() < _setting("GRAPHQL_SLOW_LOG_SAMPLE_RATE", 0.1)
+
+
+def payload_size(value):
+    """Bytes in resolver arguments: strings (base64 photos), uploads, nested inputs."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(payload_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    return getattr(value, "size", None) or 0  # UploadedFile
+
+
+class OperationTrace:
+    def __init__(self, operation, name, tracing=False):
+        self.operation = operation or "unknown"
+        self.name = name
+        self.tracing = tracing
+        self.started_at = datetime.now(dt_timezone.utc)
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.failed = False
+        self.request_bytes = 0
+        self.fields = {}  # (parent type, field) -> [calls, seconds, queries, db seconds, input bytes]
+        self.resolvers = []  # Apollo tracing entries, only when tracing
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            if elapsed * 1000 >= _setting("GRAPHQL_SLOW_QUERY_MS", 200) and _sampled():
+                logger.warning(
+                    "Slow SQL (%.1f ms) in %s %s: %s",
+                    elapsed * 1000, self.operation, self.name or "anonymous", sql,
+                )
+
+    def add_field(self, info, start, elapsed, queries, db_seconds, input_bytes):
+        key = (str(info.parent_type), info.field_name)
+        stats = self.fields.get(key)
+        if stats is None:
+            stats = self.fields[key] = [0, 0.0, 0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += queries
+        stats[3] += db_seconds
+        stats[4] += input_bytes
+        if self.tracing:
+            self.resolvers.append({
+                "path": info.path.as_list(),
+                "parentType": str(info.parent_type),
+                "fieldName": info.field_name,
+                "returnType": str(info.return_type),
+                "startOffset": int((start - self.start) * 1e9),
+                "duration": int(elapsed * 1e9),
+            })
+
+    def tracing_extension(self):
+        return {
+            "version": 1,
+            "startTime": self.started_at.isoformat(),
+            "endTime": datetime.now(dt_timezone.utc).isoformat(),
+            "duration": int(self.duration * 1e9),
+            "sql": {"count": self.queries, "duration": int(self.db_seconds * 1e9)},
+            "execution": {"resolvers": self.resolvers},
+        }
+
+
+class InstrumentationMiddleware:
+    # List it last in GRAPHENE["MIDDLEWARE"] so it is the outermost and also
+    # times the others (e.g. the mutation's commit)
+    def resolve(self, next, root, info, **args):
+        trace = _current.get()
+        if trace is None:
+            return next(root, info, **args)
+        queries, db_seconds = trace.queries, trace.db_seconds
+        start = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            trace.add_field(
+                info, start, time.perf_counter() - start,
+                trace.queries - queries, trace.db_seconds - db_seconds,
+                payload_size(args) if args else 0,
+            )
+
+
+class _OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}  # (operation type, name) -> _OperationStats
+        self._fields = {}  # (parent type, field) -> [calls, seconds, queries, db seconds, input bytes]
+
+    def _operation_stats(self, trace):
+        name = trace.name if trace.name and OPERATION_NAME_RE.match(trace.name) else "anonymous"
+        key = (trace.operation, name)
+        if key not in self._operations and len(self._operations) >= MAX_OPERATION_NAMES:
+            key = (trace.operation, "other")
+        return self._operations.setdefault(key, _OperationStats())
+
+    def record(self, trace):
+        with self._lock:
+            stats = self._operation_stats(trace)
+            stats.count += 1
+            stats.errors += trace.failed
+            stats.seconds += trace.duration
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if trace.duration <= bound:
+                    stats.buckets[index] += 1
+            stats.queries += trace.queries
+            stats.db_seconds += trace.db_seconds
+            stats.request_bytes += trace.request_bytes
+            for key, values in trace.fields.items():
+                totals = self._fields.setdefault(key, [0, 0.0, 0, 0.0, 0])
+                for index, value in enumerate(values):
+                    totals[index] += value
+
+    def add_response_bytes(self, trace, size):
+        with self._lock:
+            self._operation_stats(trace).response_bytes += size
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._fields.clear()
+
+    def render(self):
+        with self._lock:
+            operations = sorted(self._operations.items())
+            fields = sorted((key, list(values)) for key, values in self._fields.items())
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+        def per_operation(attribute):
+            return [(_labels(operation=op, name=name), getattr(stats, attribute)) for (op, name), stats in operations]
+
+        histogram = []
+        for (op, name), stats in operations:
+            for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                histogram.append((_labels(operation=op, name=name, le=bound), count))
+            histogram.append((_labels(operation=op, name=name, le="+Inf"), stats.count))
+        lines.append("# HELP parkingpay_graphql_operation_duration_seconds GraphQL operation wall time.")
+        lines.append("# TYPE parkingpay_graphql_operation_duration_seconds histogram")
+        lines.extend(f"parkingpay_graphql_operation_duration_seconds_bucket{labels} {value}" for labels, value in histogram)
+        lines.extend(
+            f"parkingpay_graphql_operation_duration_seconds_sum{labels} {value}" for labels, value in per_operation("seconds")
+        )
+        lines.extend(
+            f"parkingpay_graphql_operation_duration_seconds_count{labels} {value}" for labels, value in per_operation("count")
+        )
+        metric("parkingpay_graphql_operation_errors_total", "counter", "Operations that returned errors.", per_operation("errors"))
+        metric("parkingpay_graphql_operation_db_queries_total", "counter", "SQL statements run by operations.", per_operation("queries"))
+        metric("parkingpay_graphql_operation_db_seconds_total", "counter", "Time spent in SQL by operations.", per_operation("db_seconds"))
+        metric("parkingpay_graphql_request_bytes_total", "counter", "Request body bytes.", per_operation("request_bytes"))
+        metric("parkingpay_graphql_response_bytes_total", "counter", "Response body bytes.", per_operation("response_bytes"))
+
+        def per_field(index):
+            return [(_labels(type=parent, field=field), values[index]) for (parent, field), values in fields]
+
+        metric("parkingpay_graphql_field_calls_total", "counter", "Resolver calls.", per_field(0))
+        metric("parkingpay_graphql_field_seconds_total", "counter", "Resolver wall time, not counting its child fields.", per_field(1))
+        metric("parkingpay_graphql_field_db_queries_total", "counter", "SQL statements run while resolving the field.", per_field(2))
+        metric("parkingpay_graphql_field_db_seconds_total", "counter", "Time spent in SQL while resolving the field.", per_field(3))
+        metric("parkingpay_graphql_field_input_bytes_total", "counter", "Argument bytes, including base64 and uploaded photos.", per_field(4))
+
+        admission_stats = admission.stats()
+        metric("parkingpay_graphql_in_flight", "gauge", "GraphQL requests in progress.", [("", admission_stats["in_flight"])])
+        metric(
+            "parkingpay_graphql_rejected_total", "counter", "Requests turned away by admission control.",
+            [(_labels(reason=reason), admission_stats[reason]) for reason in ("too_large", "length_required", "rate_limited", "overloaded")],
+        )
+
+        photo_stats = pipeline.stats()
+        metric("parkingpay_photo_queue_depth", "gauge", "Photos waiting for the background pipeline.", [("", photo_stats["depth"])])
+        metric("parkingpay_photo_jobs_failed_total", "counter", "Photo jobs that failed.", [("", photo_stats["failed"])])
+
+        databases = connection_stats()
+        metric(
+            "parkingpay_db_connections_opened_total", "counter", "Database connections opened.",
+            [(_labels(alias=stats["alias"], mode=stats["mode"]), stats["connections_opened"]) for stats in databases],
+        )
+        pools = [stats for stats in databases if stats["mode"] == "pool"]
+        metric(
+            "parkingpay_db_pool_wait_seconds_total", "counter", "Time requests waited for a pooled connection.",
+            [(_labels(alias=stats["alias"]), stats["wait_ms"] / 1000) for stats in pools],
+        )
+        metric(
+            "parkingpay_db_pool_requests_waiting", "gauge", "Requests waiting for a pooled connection.",
+            [(_labels(alias=stats["alias"]), stats["requests_waiting"]) for stats in pools],
+        )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def tracing_requested(request):
+    return bool(_setting("GRAPHQL_TRACING", False)) and request.headers.get("X-GraphQL-Tracing") == "1"
+
+
+@contextmanager
+def trace_operation(operation, name=None, tracing=False):
+    """Measure the GraphQL operation run inside the block; yields its ``OperationTrace``."""
+    trace = OperationTrace(operation, name, tracing)
+    token = _current.set(trace)
+    try:
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(trace))
+            yield trace
+    except Exception:
+        trace.failed = True
+        raise
+    finally:
+        _current.reset(token)
+        trace.duration = time.perf_counter() - trace.start
+        registry.record(trace)
+        if trace.duration * 1000 >= _setting("GRAPHQL_SLOW_OPERATION_MS", 1000) and _sampled():
+            slowest = sorted(trace.fields.items(), key=lambda item: -item[1][1])[:5]
+            logger.warning(
+                "Slow GraphQL %s %s: %.1f ms, %d SQL statements (%.1f ms); slowest fields: %s",
+                trace.operation, trace.name or "anonymous", trace.duration * 1000,
+                trace.queries, trace.db_seconds * 1000,
+                ", ".join(f"{parent}.{field} {values[1] * 1000:.1f} ms" for (parent, field), values in slowest),
+            )
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0003_rename_session_payment_parking_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingsession',
+            name='entry_photo',
+            field=models.ImageField(blank=True, null=True, upload_to='car_photos/entry/'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0004_parkingsession_entry_photo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['entry_time', 'id'], name='session_entry_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['car', 'entry_time', 'id'], name='session_car_entry_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_time', 'id'], name='payment_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['car', 'payment_time', 'id'], name='payment_car_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'payment_time', 'id'], name='payment_status_time_idx'),
+        ),
+    ]
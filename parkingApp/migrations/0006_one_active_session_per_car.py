@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:52
+
+from django.db import migrations, models
+
+
+def close_duplicate_active_sessions(apps, schema_editor):
+    # The constraint below cannot be created while a car has several open
+    # sessions; keep the newest one open and close the others at its entry time.
+    ParkingSession = apps.get_model('parkingApp', 'ParkingSession')
+    db = schema_editor.connection.alias
+    duplicated_cars = (
+        ParkingSession.objects.using(db).filter(exit_time__isnull=True)
+        .values('car')
+        .annotate(open_sessions=models.Count('id'))
+        .filter(open_sessions__gt=1)
+        .values_list('car', flat=True)
+    )
+    for car_id in duplicated_cars:
+        latest, *older = ParkingSession.objects.using(db).filter(car_id=car_id, exit_time__isnull=True).order_by('-entry_time', '-id')
+        ParkingSession.objects.using(db).filter(pk__in=[session.pk for session in older]).update(exit_time=latest.entry_time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0005_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_active_sessions, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='parkingsession',
+            name='session_car_entry_time_idx',
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['car', '-entry_time', '-id'], name='session_car_latest_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='parkingsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('exit_time__isnull', True)), fields=('car',), name='one_active_session_per_car'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:05
+
+from django.db import migrations
+
+CREATE_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    # LIKE 'prefix%' can only use a btree index with the pattern operator class
+    'CREATE INDEX IF NOT EXISTS car_plate_prefix_idx ON "parkingApp_car" (car_plate varchar_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS car_plate_trgm_idx ON "parkingApp_car" USING gin (car_plate gin_trgm_ops)',
+]
+DROP_INDEXES = [
+    'DROP INDEX IF EXISTS car_plate_trgm_idx',
+    'DROP INDEX IF EXISTS car_plate_prefix_idx',
+]
+
+
+def run_on_postgresql(statements):
+    def operation(apps, schema_editor):
+        # Both index types are PostgreSQL-only; other backends use the
+        # in-memory fallback in parkingApp.plate_search
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0006_one_active_session_per_car'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEXES), run_on_postgresql(DROP_INDEXES)),
+    ]
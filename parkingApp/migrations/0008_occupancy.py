@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:59
+
+from django.db import migrations, models
+
+
+def count_active_sessions(apps, schema_editor):
+    Occupancy = apps.get_model('parkingApp', 'Occupancy')
+    ParkingSession = apps.get_model('parkingApp', 'ParkingSession')
+    db = schema_editor.connection.alias
+    Occupancy.objects.using(db).create(pk=1, active_sessions=ParkingSession.objects.using(db).filter(exit_time__isnull=True).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0007_plate_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Occupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('active_sessions', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_active_sessions, migrations.RunPython.noop),
+    ]
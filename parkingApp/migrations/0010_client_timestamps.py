@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:04
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0009_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parkingsession',
+            name='entry_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
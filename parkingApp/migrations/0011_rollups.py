@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0010_client_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('entries', models.IntegerField(default=0)),
+                ('exits', models.IntegerField(default=0)),
+                ('peak_occupancy', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('is_employee_vehicle', models.BooleanField(default=False)),
+                ('payments', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_duration', models.BigIntegerField(default=0)),
+                ('timed_payments', models.IntegerField(default=0)),
+                ('payment_method', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='parkingApp.paymentmethod')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'payment_method', 'is_employee_vehicle'), name='unique_daily_revenue')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:13
+
+import re
+
+from django.db import migrations, models
+
+# A copy of parkingApp.plates.mongolian_plate as of this migration, so later
+# changes to the normalizer (or PLATE_NORMALIZER) don't change what it does
+PLATE_RE = re.compile(r"^\d{4}[А-ЯЁӨҮ]{0,3}$")
+SEPARATORS_RE = re.compile(r"[\s\-_.]+")
+DIGIT_LOOKALIKES = str.maketrans({
+    "O": "0", "О": "0", "Q": "0", "D": "0",
+    "I": "1", "L": "1", "|": "1",
+    "Z": "2", "З": "3", "S": "5", "G": "6",
+    "B": "8", "В": "8",
+})
+LETTER_LOOKALIKES = str.maketrans({
+    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К", "M": "М",
+    "O": "О", "P": "Р", "T": "Т", "X": "Х", "Y": "У",
+    "0": "О", "3": "З", "8": "В",
+})
+
+
+def normalize_plate(raw):
+    cleaned = SEPARATORS_RE.sub("", raw).upper()
+    mapped = cleaned[:4].translate(DIGIT_LOOKALIKES) + cleaned[4:].translate(LETTER_LOOKALIKES)
+    return mapped if PLATE_RE.match(mapped) else cleaned
+
+
+def normalize_plates(apps, schema_editor):
+    Car = apps.get_model('parkingApp', 'Car')
+    db = schema_editor.connection.alias
+    cars = list(Car.objects.using(db).exclude(car_plate__isnull=True).only('pk', 'car_plate'))
+    for car in cars:
+        car.normalized_plate = normalize_plate(car.car_plate)
+    Car.objects.using(db).bulk_update(cars, ['normalized_plate'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0011_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='normalized_plate',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16, null=True),
+        ),
+        migrations.RunPython(normalize_plates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0012_car_normalized_plate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingsession',
+            name='kiosk',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='parkingApp.kiosk'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='kiosk',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='parkingApp.kiosk'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(fields=['kiosk', 'entry_time', 'id'], name='session_kiosk_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingsession',
+            index=models.Index(condition=models.Q(('exit_time__isnull', True)), fields=['kiosk'], name='session_kiosk_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['kiosk', 'payment_time', 'id'], name='payment_kiosk_time_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:40
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def merge_rows_without_method(apps, schema_editor):
+    DailyRevenue = apps.get_model('parkingApp', 'DailyRevenue')
+    db = schema_editor.connection.alias
+    kept = {}
+    duplicates = []
+    for row in DailyRevenue.objects.using(db).filter(payment_method__isnull=True).order_by('pk'):
+        key = (row.day, row.is_employee_vehicle)
+        first = kept.setdefault(key, row)
+        if first is row:
+            continue
+        first.payments += row.payments
+        first.amount += row.amount
+        first.total_duration += row.total_duration
+        first.timed_payments += row.timed_payments
+        duplicates.append(row.pk)
+    DailyRevenue.objects.using(db).filter(pk__in=duplicates).delete()
+    DailyRevenue.objects.using(db).bulk_update(
+        kept.values(), ['payments', 'amount', 'total_duration', 'timed_payments'], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0013_lot_scoping'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dailyrevenue',
+            name='unique_daily_revenue',
+        ),
+        migrations.RunPython(merge_rows_without_method, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyrevenue',
+            constraint=models.UniqueConstraint(models.F('day'), django.db.models.functions.comparison.Coalesce('payment_method', 0), models.F('is_employee_vehicle'), name='unique_daily_revenue'),
+        ),
+    ]
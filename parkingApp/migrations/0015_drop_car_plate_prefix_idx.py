@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def run_on_postgresql(statement):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+    # car_plate is unique, so Django already keeps a varchar_pattern_ops
+    # index on it (parkingApp_car_car_plate_..._like) for LIKE 'prefix%';
+    # the one added by 0007 was a duplicate
+
+    dependencies = [
+        ('parkingApp', '0014_unique_daily_revenue_without_method'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgresql('DROP INDEX IF EXISTS car_plate_prefix_idx'),
+            run_on_postgresql(
+                'CREATE INDEX IF NOT EXISTS car_plate_prefix_idx ON "parkingApp_car" (car_plate varchar_pattern_ops)'
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:47
+
+from django.db import migrations, models
+
+
+def count_lot_sessions(apps, schema_editor):
+    LotOccupancy = apps.get_model('parkingApp', 'LotOccupancy')
+    ParkingSession = apps.get_model('parkingApp', 'ParkingSession')
+    db = schema_editor.connection.alias
+    rows = (
+        ParkingSession.objects.using(db).filter(exit_time__isnull=True, kiosk__isnull=False)
+        .values('kiosk__location').annotate(count=models.Count('id')).order_by()
+    )
+    LotOccupancy.objects.using(db).bulk_create(
+        [LotOccupancy(lot=row['kiosk__location'], active_sessions=row['count']) for row in rows]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parkingApp', '0015_drop_car_plate_prefix_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LotOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot', models.CharField(max_length=100, unique=True)),
+                ('active_sessions', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_lot_sessions, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 class Car(models.Model):
     car_plate = models.CharField(max_length=7, unique=True, null=True, blank=True)  # License plate number
-    entry_photo = models.ImageField(upload_to='car_photos/entry/', null=True, blank=True)  # Entry photo
+    normalized_plate = models.CharField(max_length=16, null=True, blank=True, db_index=True, editable=False)  # Canonical plate for lookups, see parkingApp/plates.py
+    entry_photo = models.ImageField(upload_to='car_photos/entry/', null=True, blank=True)  # Latest entry photo (shared with its session)
     is_employee_car = models.BooleanField(default=False)  # Whether the car belongs to an employee
     def __str__(self):
         return self.car_plate
@@ -17,10 +20,32 @@ class PaymentMethod(models.Model):
     
 class ParkingSession(models.Model):
     car = models.ForeignKey(Car, on_delete=models.CASCADE)  # Related car
-    entry_time = models.DateTimeField(auto_now_add=True)  # Entry time
+    entry_time = models.DateTimeField(default=timezone.now)  # Entry time (the gate's clock for replayed events)
+    entry_photo = models.ImageField(upload_to='car_photos/entry/', null=True, blank=True)  # Entry photo, stored under its content hash
     paid_status = models.BooleanField(default=False)  # Payment status
     exit_time = models.DateTimeField(null=True, blank=True)  # Exit time
     exit_photo = models.ImageField(upload_to='car_photos/exit/', null=True, blank=True)  # Exit photo
+    kiosk = models.ForeignKey('Kiosk', on_delete=models.SET_NULL, null=True, blank=True, db_index=False)  # Kiosk the car entered at; its location is the lot
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of allParkingSessions, optionally per car
+            models.Index(fields=['entry_time', 'id'], name='session_entry_time_id_idx'),
+            # Latest session per car; also serves per-car pagination
+            models.Index(fields=['car', '-entry_time', '-id'], name='session_car_latest_idx'),
+            # Pagination per lot; also the kiosk foreign key's index
+            models.Index(fields=['kiosk', 'entry_time', 'id'], name='session_kiosk_time_idx'),
+            # Occupancy per lot
+            models.Index(fields=['kiosk'], condition=models.Q(exit_time__isnull=True), name='session_kiosk_active_idx'),
+        ]
+        constraints = [
+            # A car can only be parked once; also the index for active-session lookups
+            models.UniqueConstraint(
+                fields=['car'],
+                condition=models.Q(exit_time__isnull=True),
+                name='one_active_session_per_car',
+            ),
+        ]
 
     def __str__(self):
         return f"Session {self.id} - {self.car.car_plate}"
@@ -45,12 +70,22 @@ class Payment(models.Model):
     car = models.ForeignKey(Car, on_delete=models.CASCADE, default=1)  # Related car
     parking_session = models.ForeignKey(ParkingSession, on_delete=models.CASCADE)  # Related parking session
     amount = models.DecimalField(max_digits=8, decimal_places=2)  # Payment amount
-    payment_time = models.DateTimeField(auto_now_add=True)  # Payment timestamp
+    payment_time = models.DateTimeField(default=timezone.now)  # Payment timestamp
     duration = models.IntegerField(null=True, blank=True)  # Parking duration in minutes
     status = models.CharField(max_length=20, default='pending')  # Payment status
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True)  # Payment method
     is_within_free_period = models.BooleanField(default=False)  # Free period flag
     is_employee_vehicle = models.BooleanField(default=False)  # Employee vehicle flag
+    kiosk = models.ForeignKey('Kiosk', on_delete=models.SET_NULL, null=True, blank=True, db_index=False)  # Kiosk the payment was made at
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of allPayments, optionally per car, status or lot
+            models.Index(fields=['payment_time', 'id'], name='payment_time_id_idx'),
+            models.Index(fields=['car', 'payment_time', 'id'], name='payment_car_time_idx'),
+            models.Index(fields=['status', 'payment_time', 'id'], name='payment_status_time_idx'),
+            models.Index(fields=['kiosk', 'payment_time', 'id'], name='payment_kiosk_time_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.id} - {self.amount}"
@@ -72,4 +107,70 @@ class Kiosk(models.Model):
     managed_by = models.ForeignKey(Admin, on_delete=models.SET_NULL, null=True, blank=True)  # Associated admin
 
     def __str__(self):
-        return f"Kiosk {self.id} at {self.location}"
\ No newline at end of file
+        return f"Kiosk {self.id} at {self.location}"
+
+class Occupancy(models.Model):
+    active_sessions = models.IntegerField(default=0)  # Parked cars, kept up to date by parkingApp/signals.py
+
+    def __str__(self):
+        return f"Occupancy: {self.active_sessions}"
+
+
+class LotOccupancy(models.Model):
+    lot = models.CharField(max_length=100, unique=True)  # Kiosk location
+    active_sessions = models.IntegerField(default=0)  # Parked cars that entered at the lot's kiosks
+
+    def __str__(self):
+        return f"{self.lot}: {self.active_sessions}"
+
+
+class IdempotencyKey(models.Model):
+    operation = models.CharField(max_length=30)  # Mutation name, e.g. savePayment
+    key = models.CharField(max_length=64)  # Client-generated key, reused on retries
+    response = models.JSONField(null=True, blank=True)  # What the first successful call returned
+    fingerprint = models.CharField(max_length=64, blank=True, default='')  # SHA-256 of the request; empty on old rows
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['operation', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),  # Purging old keys
+        ]
+
+    def __str__(self):
+        return f"{self.operation} {self.key}"
+
+
+class DailyRevenue(models.Model):
+    day = models.DateField()  # Payment date in TIME_ZONE
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True)
+    is_employee_vehicle = models.BooleanField(default=False)
+    payments = models.IntegerField(default=0)  # Number of payments
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Sum of payment amounts
+    total_duration = models.BigIntegerField(default=0)  # Sum of parking minutes
+    timed_payments = models.IntegerField(default=0)  # Payments with a duration, for the average
+
+    class Meta:
+        constraints = [
+            # Coalesced, so the rows without a payment method (NULLs would be
+            # distinct) are unique too and parkingApp.rollups._bump never
+            # updates two rows for one payment
+            models.UniqueConstraint(
+                'day', Coalesce('payment_method', 0), 'is_employee_vehicle', name='unique_daily_revenue',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.amount}"
+
+
+class DailyOccupancy(models.Model):
+    day = models.DateField(unique=True)
+    entries = models.IntegerField(default=0)
+    exits = models.IntegerField(default=0)
+    peak_occupancy = models.IntegerField(default=0)  # Highest number of parked cars that day
+
+    def __str__(self):
+        return f"{self.day}: peak {self.peak_occupancy}"
@@ -0,0 +1,77 @@
+"""Maintained occupancy counters.
+
+``Occupancy`` holds the number of open parking sessions and ``LotOccupancy``
+the number per lot (sessions that entered at one of the lot's kiosks). They
+are changed by one-row ``F()`` updates when a session opens, closes or moves
+to another lot (see parkingApp/signals.py), so nobody has to ``COUNT(*)``
+the sessions table.
+
+Every database keeps counters for the sessions it holds; a lot with its own
+database (``LOT_DATABASES``) is counted there, and ``total_occupancy`` adds
+up the databases.
+"""
+from django.db.models import Count, F
+
+from parkingApp.lots import all_databases, kiosk_lot_or_none, lot_kiosks
+from parkingApp.models import LotOccupancy, Occupancy, ParkingSession
+
+COUNTER_ID = 1
+
+
+def adjust_occupancy(delta, lot_deltas=None):
+    """Move the counter by ``delta`` and each lot's by ``lot_deltas[lot]``."""
+    if delta:
+        updated = Occupancy.objects.filter(pk=COUNTER_ID).update(active_sessions=F("active_sessions") + delta)
+        if not updated:
+            recount_occupancy()
+            return
+    for lot, lot_delta in (lot_deltas or {}).items():
+        if not lot or not lot_delta:
+            continue
+        updated = LotOccupancy.objects.filter(lot=lot).update(active_sessions=F("active_sessions") + lot_delta)
+        if not updated:
+            recount_lot_occupancy(lot)
+
+
+def current_occupancy(lot=None):
+    """Open sessions in the current database, or in ``lot``."""
+    if lot:
+        return LotOccupancy.objects.filter(lot=lot).values_list("active_sessions", flat=True).first() or 0
+    return Occupancy.objects.filter(pk=COUNTER_ID).values_list("active_sessions", flat=True).first() or 0
+
+
+def total_occupancy():
+    """Open sessions in every database."""
+    return sum(
+        Occupancy.objects.using(alias).filter(pk=COUNTER_ID).values_list("active_sessions", flat=True).first() or 0
+        for alias in all_databases()
+    )
+
+
+def _lot_counts():
+    counts = {}
+    sessions = (
+        ParkingSession.objects.filter(exit_time__isnull=True, kiosk__isnull=False)
+        .values_list("kiosk_id").annotate(count=Count("id")).order_by()
+    )
+    for kiosk_id, count in sessions:
+        lot = kiosk_lot_or_none(kiosk_id)
+        if lot:
+            counts[lot] = counts.get(lot, 0) + count
+    return counts
+
+
+def recount_lot_occupancy(lot):
+    active_sessions = ParkingSession.objects.filter(exit_time__isnull=True, kiosk_id__in=lot_kiosks(lot)).count()
+    LotOccupancy.objects.update_or_create(lot=lot, defaults={"active_sessions": active_sessions})
+
+
+def recount_occupancy():
+    """Rebuild the counters from the sessions table, e.g. after bulk updates."""
+    active_sessions = ParkingSession.objects.filter(exit_time__isnull=True).count()
+    Occupancy.objects.update_or_create(pk=COUNTER_ID, defaults={"active_sessions": active_sessions})
+    counts = _lot_counts()
+    LotOccupancy.objects.exclude(lot__in=list(counts)).delete()
+    for lot, count in counts.items():
+        LotOccupancy.objects.update_or_create(lot=lot, defaults={"active_sessions": count})
+    return active_sessions
@@ -0,0 +1,87 @@
+"""Derive select_related/prefetch_related from a GraphQL selection set.
+
+Root resolvers pass their queryset through ``optimize_queryset`` so that every
+relation the client asked for is loaded up front: forward foreign keys and
+one-to-ones are joined, reverse and many-to-many relations are prefetched.
+The number of SQL queries then depends on the shape of the query, not on the
+number of rows returned.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+from parkingApp.models import Car
+
+# Fields whose resolver reads a relation under a different name
+FIELD_RELATIONS = {
+    (Car, "parking_sessions"): "parkingsession_set",
+}
+
+
+def _selected_fields(selection_set, fragments):
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _selected_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            yield from _selected_fields(fragments[selection.name.value].selection_set, fragments)
+
+
+def _relation(model, name):
+    name = FIELD_RELATIONS.get((model, name), name)
+    try:
+        field = model._meta.get_field(name)
+        if field.is_relation and not field.auto_created:
+            return name, field
+    except FieldDoesNotExist:
+        pass
+    # Reverse relations are exposed under their accessor, e.g. parkingsession_set
+    for related in model._meta.related_objects:
+        if related.get_accessor_name() == name:
+            return name, related
+    return None, None
+
+
+def _collect(model, selection_set, fragments, prefix, prefetching, select_related, prefetch_related):
+    for node in _selected_fields(selection_set, fragments):
+        if node.selection_set is None:
+            continue
+        name, field = _relation(model, to_snake_case(node.name.value))
+        if field is None:
+            continue
+        path = prefix + name
+        nested_prefetching = prefetching or field.one_to_many or field.many_to_many
+        if nested_prefetching:
+            prefetch_related.add(path)
+        else:
+            select_related.add(path)
+        _collect(
+            field.related_model, node.selection_set, fragments, path + "__",
+            nested_prefetching, select_related, prefetch_related,
+        )
+
+
+def optimize_queryset(queryset, info, path=()):
+    """Apply the relations selected under ``path`` (e.g. ``("edges", "node")``)."""
+    field_nodes = info.field_nodes
+    for name in path:
+        field_nodes = [
+            child
+            for node in field_nodes if node.selection_set is not None
+            for child in _selected_fields(node.selection_set, info.fragments)
+            if child.name.value == name
+        ]
+
+    select_related, prefetch_related = set(), set()
+    for field_node in field_nodes:
+        if field_node.selection_set is not None:
+            _collect(
+                queryset.model, field_node.selection_set, info.fragments, "",
+                False, select_related, prefetch_related,
+            )
+    if select_related:
+        queryset = queryset.select_related(*sorted(select_related))
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*sorted(prefetch_related))
+    return queryset
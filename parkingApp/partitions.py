@@ -0,0 +1,211 @@
+"""Monthly range partitioning of the session and payment tables (PostgreSQL).
+
+``convert_table`` rebuilds an existing table as one partitioned by month on
+its time column, ``ensure_partitions`` creates the coming months (run it from
+cron, e.g. ``manage_partitions --months-ahead 3``) and ``detach_partition``
+takes an old month out of the table for archiving (parkingApp/archive.py).
+
+PostgreSQL requires the partition key in every unique index, so after
+conversion:
+
+* the primary key is ``(id, <time column>)``; ids still come from the
+  table's own identity sequence;
+* ``one_active_session_per_car`` becomes a plain partial index and the rule
+  is enforced by a trigger that raises ``unique_violation``, so callers still
+  see an ``IntegrityError``;
+* the database-level foreign key from payments to sessions is dropped,
+  because it would need a unique key on the session id alone.
+
+The conversion is raw SQL run by ``manage_partitions --convert``, not a
+migration, and Django's migration state is left as it was on purpose: the
+models keep their single-column primary key, the unique constraint and the
+foreign key, which is how the ORM should treat the tables. ``makemigrations``
+therefore sees no change, and a later migration touching these tables (a new
+unique constraint, a changed ``id`` or time column) has to be checked against
+the partitioned layout by hand. Other databases keep plain tables; the
+functions below refuse to run on them.
+"""
+from datetime import date
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from parkingApp.models import ParkingSession, Payment
+
+PARTITION_COLUMNS = {
+    ParkingSession: "entry_time",
+    Payment: "payment_time",
+}
+
+ACTIVE_SESSION_TRIGGER = """
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    IF NEW.exit_time IS NULL THEN
+        -- Serialise open sessions per car; the check below then sees any
+        -- session committed by a concurrent transaction
+        PERFORM pg_advisory_xact_lock(hashtext('{function}'), (NEW.car_id % 2147483647)::int);
+        IF EXISTS (
+            SELECT 1 FROM {table} WHERE car_id = NEW.car_id AND exit_time IS NULL AND id <> NEW.id
+        ) THEN
+            RAISE EXCEPTION 'Car % already has an active session', NEW.car_id
+                USING ERRCODE = 'unique_violation', CONSTRAINT = 'one_active_session_per_car';
+        END IF;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS one_active_session_per_car ON {table};
+CREATE TRIGGER one_active_session_per_car BEFORE INSERT OR UPDATE OF car_id, exit_time ON {table}
+    FOR EACH ROW EXECUTE FUNCTION {function}();
+"""
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(model, month):
+    return f"{model._meta.db_table}_p{month:%Y%m}"
+
+
+def _check_postgresql():
+    if connection.vendor != "postgresql":
+        raise NotImplementedError("Table partitioning is only supported on PostgreSQL.")
+
+
+def is_partitioned(model):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [connection.ops.quote_name(model._meta.db_table)],
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(model):
+    """Return ``{month: partition table}`` for the monthly partitions of ``model``."""
+    _check_postgresql()
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [connection.ops.quote_name(table)],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f"{table}_p"
+    return {
+        date(int(name[-6:-2]), int(name[-2:]), 1): name
+        for name in names
+        if name.startswith(prefix) and name[len(prefix):].isdigit()
+    }
+
+
+def _create_partition(cursor, model, month):
+    quote = connection.ops.quote_name
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {quote(partition_name(model, month))} "
+        f"PARTITION OF {quote(model._meta.db_table)} FOR VALUES FROM (%s) TO (%s)",
+        [f"{month:%Y-%m-%d} 00:00:00+00", f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00"],
+    )
+
+
+def ensure_partitions(model, months_ahead=3):
+    """Create the partitions for this month and the next ``months_ahead`` months."""
+    _check_postgresql()
+    first = month_start(timezone.now().date())
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            _create_partition(cursor, model, add_months(first, offset))
+
+
+def convert_table(model, months_ahead=3):
+    """Rebuild ``model``'s table as a monthly range-partitioned table.
+
+    Runs in one transaction and holds an exclusive lock on the table while
+    the rows are copied, so schedule it in a maintenance window.
+    """
+    _check_postgresql()
+    if is_partitioned(model):
+        return False
+    table = model._meta.db_table
+    column = PARTITION_COLUMNS[model]
+    quote = connection.ops.quote_name
+    old_table = f"{table}_unpartitioned"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+            [table, quote(table)],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [quote(table)],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE confrelid = to_regclass(%s) AND contype = 'f'",
+            [quote(table)],
+        )
+        for referencing_table, name in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {referencing_table} DROP CONSTRAINT {quote(name)}")
+        cursor.execute(f"SELECT min({quote(column)}) FROM {quote(table)}")
+        oldest = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(old_table)} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+            f"PARTITION BY RANGE ({quote(column)})"
+        )
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, {quote(column)})")
+        month = month_start(oldest.date() if oldest else timezone.now().date())  # Bounds are in UTC
+        last = add_months(month_start(timezone.now().date()), months_ahead)
+        while month <= last:
+            _create_partition(cursor, model, month)
+            month = add_months(month, 1)
+        # Anything outside the monthly partitions, e.g. a gate with a bad clock
+        cursor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+
+        cursor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}")
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(max(id), 0) + 1, false) FROM {quote(table)}",
+            [quote(table)],
+        )
+        cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+        for name, definition in indexes:
+            if definition.startswith("CREATE UNIQUE INDEX") and column not in definition:
+                # Unique indexes must include the partition key
+                definition = definition.replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+        if model is ParkingSession:
+            # Row triggers on partitioned tables need PostgreSQL 13+
+            cursor.execute(ACTIVE_SESSION_TRIGGER.format(
+                table=quote(table), function=quote(f"{table}_one_active_session"),
+            ))
+    return True
+
+
+def detach_partition(model, month):
+    """Detach ``month``'s partition; returns the name of the now standalone table."""
+    _check_postgresql()
+    name = partition_name(model, month)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {quote(model._meta.db_table)} DETACH PARTITION {quote(name)}")
+    return name
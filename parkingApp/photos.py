@@ -0,0 +1,229 @@
+"""Background photo pipeline.
+
+Gate mutations hand the raw photo to ``submit_photo`` and return straight
+away. Worker threads re-encode it as JPEG, store it with a thumbnail and then
+attach the stored name to the model fields (``ParkingSession.entry_photo``,
+``Car.entry_photo``, ``ParkingSession.exit_photo``).
+
+Photos are content addressed: the name is the SHA-256 of the uploaded bytes,
+sharded two levels deep (``car_photos/entry/ab/cd/abcd....jpg``), so identical
+uploads share one file and no directory grows without bound.
+"""
+import hashlib
+import logging
+import os
+import queue
+import tempfile
+import threading
+from collections import namedtuple
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+
+from parkingApp.resolver_cache import invalidate_car_details
+
+logger = logging.getLogger("main")
+
+# targets is a tuple of (model, pk, field_name) that all receive the photo;
+# using is the database alias the rows live on
+PhotoJob = namedtuple("PhotoJob", ["targets", "data", "spool_path", "using"])
+CHUNK_SIZE = 1024 * 1024  # Bytes hashed at a time
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def content_name(upload_to, digest, extension=".jpg"):
+    return os.path.join(upload_to, digest[:2], digest[2:4], digest + extension)
+
+
+def thumbnail_name(name):
+    root, extension = os.path.splitext(name)
+    return f"{root}_thumb{extension}"
+
+
+def save_content(name, content):
+    """Save ``content`` under ``name`` unless that content is already stored."""
+    if default_storage.exists(name):
+        return name
+    saved = default_storage.save(name, content)
+    if saved != name:
+        # Another worker stored the same content first; keep a single copy
+        default_storage.delete(saved)
+    return name
+
+
+def _digest(source):
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    source.seek(0)
+    return sha256.hexdigest()
+
+
+def _jpeg(image, quality, **options):
+    encoded = BytesIO()
+    image.save(encoded, "JPEG", quality=quality, **options)
+    return File(encoded)
+
+
+def _store(name, source):
+    # Re-encodes the upload (a file object) as JPEG with a thumbnail next to
+    # it; an upload Pillow cannot decode is stored as it is. Pillow reads the
+    # file itself and only one encoded copy is held at a time.
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+    except (UnidentifiedImageError, OSError):
+        source.seek(0)
+        save_content(name, File(source))
+        return
+    save_content(name, _jpeg(image, _setting("PHOTO_JPEG_QUALITY", 80), optimize=True))
+    image.thumbnail(_setting("PHOTO_THUMBNAIL_SIZE", (320, 240)))
+    save_content(thumbnail_name(name), _jpeg(image, 70))
+
+
+def _open_source(job):
+    return open(job.spool_path, "rb") if job.spool_path else BytesIO(job.data)
+
+
+def process_job(job):
+    model, _, field_name = job.targets[0]
+    upload_to = model._meta.get_field(field_name).upload_to
+    try:
+        with _open_source(job) as source:
+            name = content_name(upload_to, _digest(source))
+            if not default_storage.exists(name):
+                _store(name, source)
+    finally:
+        if job.spool_path:
+            os.remove(job.spool_path)
+
+    for model, pk, field_name in job.targets:
+        rows = model.objects.using(job.using).filter(pk=pk)
+        rows.update(**{field_name: name})
+        if model._meta.model_name == "car":
+            # update() sends no post_save; drop the cached carDetails row
+            invalidate_car_details(*rows.values_list("normalized_plate", flat=True), using=job.using)
+    return name
+
+
+class PhotoPipeline:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.failed = 0
+        self.overflowed = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"photo-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._process(job)
+            finally:
+                self.queue.task_done()
+                close_old_connections()
+
+    def _process(self, job):
+        try:
+            process_job(job)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            logger.exception("Photo job failed for %s", job.targets)
+        else:
+            with self._lock:
+                self.processed += 1
+
+    def submit(self, job):
+        self._ensure_started()
+        try:
+            self.queue.put(job, timeout=_setting("PHOTO_QUEUE_PUT_TIMEOUT", 0.05))
+        except queue.Full:
+            # Back-pressure: the workers are saturated, so this request pays
+            # for its own photo instead of growing the queue without bound.
+            with self._lock:
+                self.overflowed += 1
+            self._process(job)
+            return
+        with self._lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self.queue.qsize(),
+                "capacity": self.queue.maxsize,
+                "max_depth": self.max_depth,
+                "processed": self.processed,
+                "failed": self.failed,
+                "overflowed": self.overflowed,
+            }
+
+
+pipeline = PhotoPipeline(
+    workers=_setting("PHOTO_PIPELINE_WORKERS", 2),
+    queue_size=_setting("PHOTO_QUEUE_SIZE", 200),
+)
+
+
+def _spool(photo):
+    # Uploads that Django already spooled to disk are moved, not copied, so
+    # the request never reads them into memory.
+    if hasattr(photo, "temporary_file_path"):
+        fd, path = tempfile.mkstemp(prefix="photo-", dir=_setting("PHOTO_SPOOL_DIR", None))
+        os.close(fd)
+        file_move_safe(photo.temporary_file_path(), path, allow_overwrite=True)
+        return None, path
+    if isinstance(photo, bytes):
+        return photo, None
+    photo.seek(0)
+    return photo.read(), None
+
+
+def submit_photo(targets, photo):
+    """Queue ``photo`` (bytes or an uploaded file) for ``targets``.
+
+    ``targets`` is a list of ``(instance, field_name)`` pairs that all end up
+    pointing at the same stored file.
+
+    Nothing happens until the surrounding transaction commits, so the worker
+    never sees a row that does not exist and rolled back entries leave no
+    spooled files behind.
+    """
+    job_targets = tuple((type(instance), instance.pk, field_name) for instance, field_name in targets)
+    using = targets[0][0]._state.db or DEFAULT_DB_ALIAS
+    if not isinstance(photo, bytes) and not hasattr(photo, "temporary_file_path"):
+        # Already in memory; read it now in case the commit comes after the
+        # request has closed its uploads (an outer transaction)
+        photo = _spool(photo)[0]
+
+    def enqueue():
+        data, spool_path = _spool(photo)
+        job = PhotoJob(job_targets, data, spool_path, using)
+        if _setting("PHOTO_PIPELINE_ASYNC", True):
+            pipeline.submit(job)
+        else:
+            process_job(job)
+
+    transaction.on_commit(enqueue, using=using)
@@ -0,0 +1,112 @@
+"""Plate search for the kiosk: ranked prefix matches and fuzzy ANPR matches.
+
+Prefix search relies on the varchar_pattern_ops (``_like``) index Django
+creates on PostgreSQL for the unique ``car_plate``. Fuzzy search uses
+pg_trgm's ``%`` operator backed by the ``car_plate_trgm_idx`` GIN index;
+other databases fall back to an in-memory trigram index over all plates.
+"""
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Length
+
+from parkingApp.models import Car
+from parkingApp.plates import DIGIT_LOOKALIKES
+
+MAX_RESULTS = 50
+SIMILARITY_THRESHOLD = 0.3  # Same default as pg_trgm.similarity_threshold
+
+
+def confusion_key(plate):
+    plate = plate.strip().upper()
+    return plate[:4].translate(DIGIT_LOOKALIKES) + plate[4:]
+
+
+def trigrams(value):
+    # Padded like pg_trgm so short plates still produce several trigrams
+    padded = f"  {value.lower()} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class PlateTrigramIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plates = None  # car pk -> trigrams of its confusion key
+        self._postings = defaultdict(set)  # trigram -> car pks
+
+    def _ensure_loaded(self):
+        if self._plates is not None:
+            return
+        self._plates = {}
+        for pk, plate in Car.objects.exclude(car_plate__isnull=True).values_list("pk", "car_plate").iterator():
+            self._add(pk, plate)
+
+    def _add(self, pk, plate):
+        grams = trigrams(confusion_key(plate))
+        self._plates[pk] = grams
+        for gram in grams:
+            self._postings[gram].add(pk)
+
+    def _discard(self, pk):
+        for gram in self._plates.pop(pk, ()):
+            self._postings[gram].discard(pk)
+
+    def update(self, pk, plate):
+        with self._lock:
+            if self._plates is None:
+                return
+            self._discard(pk)
+            if plate:
+                self._add(pk, plate)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._plates is not None:
+                self._discard(pk)
+
+    def search(self, query, limit):
+        """Return ``[(car_pk, similarity)]``, best match first."""
+        query_grams = trigrams(confusion_key(query))
+        with self._lock:
+            self._ensure_loaded()
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for pk in self._postings.get(gram, ()):
+                    shared[pk] += 1
+            scored = [
+                (pk, count / (len(query_grams) + len(self._plates[pk]) - count))
+                for pk, count in shared.items()
+            ]
+        scored = [item for item in scored if item[1] >= SIMILARITY_THRESHOLD]
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+
+
+plate_index = PlateTrigramIndex()
+
+
+def search_by_prefix(queryset, prefix, limit):
+    # Exact match first, then the shortest and alphabetically first plates
+    return list(
+        queryset.filter(car_plate__startswith=prefix)
+        .order_by(Length("car_plate"), "car_plate")[:min(limit, MAX_RESULTS)]
+    )
+
+
+def search_fuzzy(queryset, query, limit):
+    limit = min(limit, MAX_RESULTS)
+    key = confusion_key(query)
+    if connection.vendor == "postgresql":
+        return list(
+            queryset.filter(TrigramSimilar(F("car_plate"), Value(key)))
+            .annotate(similarity=Greatest(TrigramSimilarity("car_plate", key), TrigramSimilarity("car_plate", query)))
+            .order_by("-similarity", "car_plate")[:limit]
+        )
+
+    scores = dict(plate_index.search(query, limit))
+    cars = queryset.in_bulk(list(scores))
+    return sorted(cars.values(), key=lambda car: (-scores[car.pk], car.car_plate))
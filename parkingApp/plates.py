@@ -0,0 +1,79 @@
+"""Licence plate normalization and validation.
+
+Mongolian plates are four digits followed by up to three Cyrillic letters
+(``1234УБА``). Cameras and kiosk keyboards send the same plate in several
+spellings: lower case, with spaces or dashes, with Latin letters that look
+like the Cyrillic ones (``A``/``А``) or with letters read in the digit part
+(``O`` for ``0``). ``normalize_plate`` maps them all to one canonical form,
+which is stored in ``Car.normalized_plate`` and used for every equality
+lookup.
+
+The normalizer can be replaced with the ``PLATE_NORMALIZER`` setting (dotted
+path to a function from the raw text to the canonical plate); its results
+are memoized.
+"""
+import functools
+import re
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+PLATE_RE = re.compile(r"^\d{4}[А-ЯЁӨҮ]{0,3}$")
+PLATE_PREFIX_RE = re.compile(r"^\d{4}$")  # What the kiosk keypad sends
+PLATE_QUERY_RE = re.compile(r"^[0-9A-Za-zА-Яа-яЁёӨөҮү|]{1,7}$")  # Raw ANPR text for fuzzy search
+SEPARATORS_RE = re.compile(r"[\s\-_.]+")
+INVALID_PLATE_MESSAGE = (
+    "Машины дугаарын формат буруу байна. 4 оронтой тоо, дараа нь 3 хүртэл кирилл үсэг байх ёстой (жишээ нь 1234УБА)."
+)
+
+# Letters read in the digit part are ANPR misreads of the digit they resemble
+DIGIT_LOOKALIKES = str.maketrans({
+    "O": "0", "О": "0", "Q": "0", "D": "0",
+    "I": "1", "L": "1", "|": "1",
+    "Z": "2", "З": "3", "S": "5", "G": "6",
+    "B": "8", "В": "8",
+})
+# Latin letters (and digits) read in the letter part stand for Cyrillic ones
+LETTER_LOOKALIKES = str.maketrans({
+    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К", "M": "М",
+    "O": "О", "P": "Р", "T": "Т", "X": "Х", "Y": "У",
+    "0": "О", "3": "З", "8": "В",
+})
+
+
+def mongolian_plate(raw):
+    cleaned = SEPARATORS_RE.sub("", raw).upper()
+    mapped = cleaned[:4].translate(DIGIT_LOOKALIKES) + cleaned[4:].translate(LETTER_LOOKALIKES)
+    # Text that is no plate even after mapping is only cleaned, so legacy
+    # rows can still be found by what was stored
+    return mapped if PLATE_RE.match(mapped) else cleaned
+
+
+@functools.lru_cache(maxsize=None)
+def _normalizer():
+    return import_string(getattr(settings, "PLATE_NORMALIZER", "parkingApp.plates.mongolian_plate"))
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_plate(raw):
+    return _normalizer()(raw)
+
+
+def is_valid_plate(raw):
+    return bool(raw) and PLATE_RE.match(normalize_plate(raw)) is not None
+
+
+def is_plate_prefix(raw):
+    return PLATE_PREFIX_RE.match(raw) is not None
+
+
+def is_plate_query(raw):
+    return PLATE_QUERY_RE.match(raw) is not None
+
+
+def plate_filter(raw, prefix=""):
+    """``Q`` matching rows whose car has plate ``raw`` (``prefix`` e.g. ``"car__"``)."""
+    if not raw:
+        return Q(pk__in=[])
+    return Q(**{f"{prefix}normalized_plate": normalize_plate(raw)})
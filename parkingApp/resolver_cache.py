@@ -0,0 +1,127 @@
+"""Cache for hot read-only Query fields (tariffs, payment methods, car details).
+
+``cached_resolver(field)`` keeps a resolver's result in Django's cache
+(``RESOLVER_CACHE_ALIAS``; LocMemCache by default, RedisCache when
+``REDIS_URL`` is set) under a key made of the field name and its arguments.
+The model signals in parkingApp/signals.py call ``invalidate`` after commit;
+``RESOLVER_CACHE_TIMEOUTS`` bounds how stale another worker's copy can get
+with a per-process backend.
+
+On a miss only one caller per key computes the value: it takes a short-lived
+lock key with ``cache.add`` and the others wait up to
+``RESOLVER_CACHE_LOCK_WAIT`` seconds for the result before computing it
+themselves.
+
+Invalidating does not delete the value but gives its key a new random version.
+A value is stored with the version read before computing it, so one computed
+from rows read before an invalidation never matches and is recomputed.
+"""
+import functools
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from parkingApp.plates import normalize_plate
+
+_MISSING = object()
+LOCK_TIMEOUT = 10  # Seconds before a crashed computation's lock expires
+POLL_INTERVAL = 0.02
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _cache():
+    return caches[_setting("RESOLVER_CACHE_ALIAS", "default")]
+
+
+def cache_key(field, args=None):
+    if not args:
+        return f"resolver:{field}"
+    digest = hashlib.md5(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+    return f"resolver:{field}:{digest}"
+
+
+def _version_key(key):
+    return f"{key}:version"
+
+
+def _lookup(cache, key):
+    """Return ``(value, version)``; value is ``_MISSING`` unless stored under the current version."""
+    version_key = _version_key(key)
+    found = cache.get_many([key, version_key])
+    version = found.get(version_key)
+    # Values are stored as (value, version), so a cached None is still a hit
+    cached = found.get(key)
+    if cached is None or cached[1] != version:
+        return _MISSING, version
+    return cached[0], version
+
+
+def get_or_compute(field, args, compute):
+    cache = _cache()
+    key = cache_key(field, args)
+    cached, version = _lookup(cache, key)
+    if cached is not _MISSING:
+        return cached
+
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + _setting("RESOLVER_CACHE_LOCK_WAIT", 2.0)
+    locked = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+    while not locked and time.monotonic() < deadline:
+        # Somebody else is computing this key; wait for their value
+        time.sleep(POLL_INTERVAL)
+        cached, version = _lookup(cache, key)
+        if cached is not _MISSING:
+            return cached
+        locked = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+    try:
+        # version was read before compute() reads the database
+        value = compute()
+        timeout = _setting("RESOLVER_CACHE_TIMEOUTS", {}).get(field, _setting("RESOLVER_CACHE_TIMEOUT", 300))
+        cache.set(key, (value, version), timeout=timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+def cached_resolver(field, key=None):
+    """Cache a Query resolver; ``key(**args)`` maps its arguments to the cache key arguments."""
+    def decorator(resolve):
+        @functools.wraps(resolve)
+        def wrapper(root, info, **args):
+            if not _setting("RESOLVER_CACHE_ENABLED", True):
+                return resolve(root, info, **args)
+            return get_or_compute(field, key(**args) if key else args, lambda: resolve(root, info, **args))
+        return wrapper
+    return decorator
+
+
+def _invalidate_keys(keys):
+    # A fresh token rather than a counter, so an evicted version can't come back
+    _cache().set_many({_version_key(key): uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+def invalidate(field, args=None):
+    _invalidate_keys([cache_key(field, args)])
+
+
+def car_details_key(car_plate, database=DEFAULT_DB_ALIAS):
+    # Every lot database holds its own cars
+    args = {"car_plate": normalize_plate(car_plate)}
+    if database != DEFAULT_DB_ALIAS:
+        args["database"] = database
+    return args
+
+
+def invalidate_car_details(*normalized_plates, using=DEFAULT_DB_ALIAS):
+    _invalidate_keys([
+        cache_key("carDetails", car_details_key(plate, using)) for plate in normalized_plates if plate
+    ])
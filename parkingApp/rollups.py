@@ -0,0 +1,292 @@
+"""Daily revenue and occupancy rollups for finance reports.
+
+``DailyRevenue`` holds one row per day, payment method and employee flag;
+``DailyOccupancy`` one row per day. Both are kept up to date as payments and
+sessions are written (parkingApp/signals.py, parkingApp/ingest.py), so a
+report reads a few hundred rollup rows instead of every payment. Each
+database keeps the rollups of its own sessions and payments and reports add
+up all databases (``LOT_DATABASES``).
+
+The incremental peak occupancy is sampled from the live counter, so for
+replayed backlogs it is an approximation; ``backfill_rollups`` recomputes
+both tables exactly from history.
+"""
+import heapq
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncDate, TruncMonth
+from django.utils import timezone
+
+from parkingApp.db import current_database
+from parkingApp.lots import all_databases
+from parkingApp.models import DailyOccupancy, DailyRevenue, Occupancy, ParkingSession, Payment
+from parkingApp.occupancy import COUNTER_ID, current_occupancy
+
+PERIODS = {"day": None, "month": TruncMonth}
+CENTS = Decimal("0.01")
+
+
+def _bump(model, key, created_values, **updates):
+    # UPDATE first (the common case), INSERT when the day has no row yet
+    if model.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic(using=current_database()):
+            model.objects.create(**key, **created_values)
+    except IntegrityError:
+        # Someone else created it in between
+        model.objects.filter(**key).update(**updates)
+
+
+def revenue_snapshot(payment):
+    """What ``payment`` contributes to its ``DailyRevenue`` row."""
+    return (
+        timezone.localdate(payment.payment_time),
+        payment.payment_method_id,
+        payment.is_employee_vehicle,
+        payment.amount,
+        payment.duration,
+    )
+
+
+def add_revenue(snapshot, sign=1):
+    day, payment_method_id, is_employee_vehicle, amount, duration = snapshot
+    values = {
+        "payments": sign,
+        "amount": amount * sign,
+        "total_duration": (duration or 0) * sign,
+        "timed_payments": (duration is not None) * sign,
+    }
+    _bump(
+        DailyRevenue,
+        {"day": day, "payment_method_id": payment_method_id, "is_employee_vehicle": is_employee_vehicle},
+        values,
+        **{field: F(field) + value for field, value in values.items()},
+    )
+
+
+def add_revenues(snapshots):
+    """``add_revenue`` for many payments, one query per rollup row."""
+    totals = {}
+    for day, payment_method_id, is_employee_vehicle, amount, duration in snapshots:
+        key = (day, payment_method_id, is_employee_vehicle)
+        payments, amount_sum, duration_sum, timed = totals.get(key, (0, 0, 0, 0))
+        totals[key] = (payments + 1, amount_sum + amount, duration_sum + (duration or 0), timed + (duration is not None))
+    for (day, payment_method_id, is_employee_vehicle), (payments, amount, duration, timed) in totals.items():
+        values = {"payments": payments, "amount": amount, "total_duration": duration, "timed_payments": timed}
+        _bump(
+            DailyRevenue,
+            {"day": day, "payment_method_id": payment_method_id, "is_employee_vehicle": is_employee_vehicle},
+            values,
+            **{field: F(field) + value for field, value in values.items()},
+        )
+
+
+def fold_payment_method(payment_method_id):
+    """Move a payment method's rows onto the rows without one, before it is deleted.
+
+    ``DailyRevenue.payment_method`` is SET_NULL, which would otherwise leave
+    two rows for the same day and employee flag.
+    """
+    rows = DailyRevenue.objects.filter(payment_method_id=payment_method_id)
+    for row in rows:
+        values = {
+            "payments": row.payments,
+            "amount": row.amount,
+            "total_duration": row.total_duration,
+            "timed_payments": row.timed_payments,
+        }
+        row.delete()
+        _bump(
+            DailyRevenue,
+            {"day": row.day, "payment_method_id": None, "is_employee_vehicle": row.is_employee_vehicle},
+            values,
+            **{field: F(field) + value for field, value in values.items()},
+        )
+
+
+def add_occupancy(day, entries=0, exits=0):
+    # Called after the counter has moved; before an exit it was higher
+    counter = Subquery(Occupancy.objects.filter(pk=COUNTER_ID).values("active_sessions")[:1])
+    _bump(
+        DailyOccupancy,
+        {"day": day},
+        {"entries": entries, "exits": exits, "peak_occupancy": current_occupancy() + exits},
+        entries=F("entries") + entries,
+        exits=F("exits") + exits,
+        peak_occupancy=Greatest(F("peak_occupancy"), counter + exits),
+    )
+
+
+def _day_bounds(start, end):
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(start, time.min, tzinfo=tz) if start else None,
+        datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz) if end else None,
+    )
+
+
+def rebuild_revenue(start=None, end=None):
+    """Recompute ``DailyRevenue`` for the days ``start``..``end`` (inclusive)."""
+    since, until = _day_bounds(start, end)
+    payments = Payment.objects.all()
+    rollups = DailyRevenue.objects.all()
+    if since:
+        payments = payments.filter(payment_time__gte=since)
+        rollups = rollups.filter(day__gte=start)
+    if until:
+        payments = payments.filter(payment_time__lt=until)
+        rollups = rollups.filter(day__lte=end)
+
+    rows = (
+        payments.annotate(day=TruncDate("payment_time"))
+        .values("day", "payment_method_id", "is_employee_vehicle")
+        .annotate(
+            payments_count=Count("id"),
+            amount_sum=Sum("amount"),
+            duration_sum=Coalesce(Sum("duration"), 0),
+            timed=Count("duration"),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        rollups.delete()
+        created = DailyRevenue.objects.bulk_create(
+            [
+                DailyRevenue(
+                    day=row["day"],
+                    payment_method_id=row["payment_method_id"],
+                    is_employee_vehicle=row["is_employee_vehicle"],
+                    payments=row["payments_count"],
+                    amount=row["amount_sum"],
+                    total_duration=row["duration_sum"],
+                    timed_payments=row["timed"],
+                )
+                for row in rows.iterator()
+            ],
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def rebuild_occupancy(start=None, end=None):
+    """Recompute ``DailyOccupancy`` for ``start``..``end`` by replaying entries and exits."""
+    sessions = ParkingSession.objects.all()
+    if start is None:
+        first = sessions.order_by("entry_time").values_list("entry_time", flat=True).first()
+        if first is None:
+            DailyOccupancy.objects.all().delete()
+            return 0
+        start = timezone.localdate(first)
+    end = end or timezone.localdate()
+    since, until = _day_bounds(start, end)
+
+    # Cars already parked when the range starts
+    level = sessions.filter(
+        Q(exit_time__isnull=True) | Q(exit_time__gte=since), entry_time__lt=since
+    ).count()
+    entries = (
+        sessions.filter(entry_time__gte=since, entry_time__lt=until)
+        .order_by("entry_time").values_list("entry_time", flat=True).iterator()
+    )
+    exits = (
+        sessions.filter(exit_time__gte=since, exit_time__lt=until)
+        .order_by("exit_time").values_list("exit_time", flat=True).iterator()
+    )
+    # Exits sort before entries at the same instant
+    changes = heapq.merge(((moment, 0, -1) for moment in exits), ((moment, 1, 1) for moment in entries))
+
+    days = {}
+    day = start
+    while day <= end:
+        days[day] = DailyOccupancy(day=day, peak_occupancy=level)
+        day += timedelta(days=1)
+    current_day = start
+    for moment, _, delta in changes:
+        day = timezone.localdate(moment)
+        if day != current_day:
+            # Days without events keep the level they started with
+            while current_day < day:
+                current_day += timedelta(days=1)
+                days[current_day].peak_occupancy = level
+        level += delta
+        rollup = days[day]
+        if delta > 0:
+            rollup.entries += 1
+            rollup.peak_occupancy = max(rollup.peak_occupancy, level)
+        else:
+            rollup.exits += 1
+    while current_day < end:
+        current_day += timedelta(days=1)
+        days[current_day].peak_occupancy = level
+
+    with transaction.atomic():
+        DailyOccupancy.objects.filter(day__gte=start, day__lte=end).delete()
+        DailyOccupancy.objects.bulk_create(days.values(), batch_size=1000)
+    return len(days)
+
+
+def _grouped_rows(rollups, group_by, **aggregates):
+    """``rollups`` grouped and aggregated in every database, then added up."""
+    totals = {}
+    for alias in all_databases():
+        for row in rollups.using(alias).values(*group_by).annotate(**aggregates).order_by():
+            key = tuple(row[name] for name in group_by)
+            total = totals.setdefault(key, row)
+            if total is not row:
+                for name in aggregates:
+                    total[name] += row[name]
+    # NULL payment methods first
+    return [totals[key] for key in sorted(totals, key=lambda key: [(value is not None, value) for value in key])]
+
+
+def revenue_report(start, end, period="day", by_payment_method=False, by_employee=False):
+    rollups = DailyRevenue.objects.filter(day__gte=start, day__lte=end)
+    period_expression = PERIODS[period]
+    rollups = rollups.annotate(period=period_expression("day") if period_expression else F("day"))
+    group_by = ["period"]
+    if by_payment_method:
+        group_by.append("payment_method_id")
+    if by_employee:
+        group_by.append("is_employee_vehicle")
+    rows = _grouped_rows(
+        rollups,
+        group_by,
+        payments_count=Sum("payments"),
+        amount_sum=Sum("amount"),
+        duration_sum=Sum("total_duration"),
+        timed=Sum("timed_payments"),
+    )
+    return [
+        {
+            "period": row["period"],
+            "payment_method_id": row.get("payment_method_id"),
+            "is_employee_vehicle": row.get("is_employee_vehicle"),
+            "payments": row["payments_count"],
+            "amount": row["amount_sum"].quantize(CENTS),
+            "average_duration": row["duration_sum"] / row["timed"] if row["timed"] else None,
+        }
+        for row in rows
+        if row["payments_count"]
+    ]
+
+
+def occupancy_report(start, end, period="day"):
+    rollups = DailyOccupancy.objects.filter(day__gte=start, day__lte=end)
+    period_expression = PERIODS[period]
+    # With lot databases the peak is the sum of each database's peak, an
+    # upper bound: the lots need not peak at the same time
+    rows = _grouped_rows(
+        rollups.annotate(period=period_expression("day") if period_expression else F("day")),
+        ["period"],
+        entries_sum=Sum("entries"),
+        exits_sum=Sum("exits"),
+        peak=Max("peak_occupancy"),
+    )
+    return [
+        {"period": row["period"], "entries": row["entries_sum"], "exits": row["exits_sum"], "peak_occupancy": row["peak"]}
+        for row in rows
+    ]
@@ -0,0 +1,193 @@
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .db import count_connection
+from .employees import allowlist
+from .events import publish_event
+from .fees import invalidate_tariffs
+from .lots import invalidate_kiosks, kiosk_lot_or_none
+from .models import Car, Employee, Kiosk, ParkingSession, Payment, PaymentMethod, Tariff
+from .occupancy import adjust_occupancy
+from .plate_search import plate_index
+from .plates import normalize_plate
+from .resolver_cache import invalidate, invalidate_car_details
+from .rollups import add_occupancy, add_revenue, fold_payment_method, revenue_snapshot
+
+
+@receiver(connection_created)
+def track_connection(sender, connection, **kwargs):
+    count_connection(connection.alias)
+
+
+@receiver(post_init, sender=Car)
+def remember_plate(sender, instance, **kwargs):
+    instance._saved_plate = instance.__dict__.get("normalized_plate", DEFERRED)
+
+
+@receiver(pre_save, sender=Car)
+def set_normalized_plate(sender, instance, **kwargs):
+    instance.normalized_plate = normalize_plate(instance.car_plate) if instance.car_plate else None
+
+
+@receiver(post_save, sender=Car)
+def index_car_plate(sender, instance, **kwargs):
+    plate_index.update(instance.pk, instance.car_plate)
+
+
+@receiver(post_delete, sender=Car)
+def unindex_car_plate(sender, instance, **kwargs):
+    plate_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def reset_car_details_cache(sender, instance, using, **kwargs):
+    # Both the old and the new plate, in case the plate itself changed
+    plates = {instance.normalized_plate}
+    if instance._saved_plate is not DEFERRED:
+        plates.add(instance._saved_plate)
+    instance._saved_plate = instance.normalized_plate
+    transaction.on_commit(lambda: invalidate_car_details(*plates, using=using), using=using)
+
+
+@receiver(post_save, sender=Car)
+def track_employee_car(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return  # The allowlist only holds the default database's cars
+    update = (instance.pk, instance.normalized_plate, instance.is_employee_car)
+    transaction.on_commit(lambda: allowlist.update(*update), using=using)
+
+
+@receiver(post_delete, sender=Car)
+def untrack_employee_car(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: allowlist.remove(pk), using=using)
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def reset_employee_allowlist(sender, using, **kwargs):
+    transaction.on_commit(allowlist.reset, using=using)
+
+
+@receiver(post_save, sender=Tariff)
+@receiver(post_delete, sender=Tariff)
+def reset_tariff_cache(sender, using, **kwargs):
+    transaction.on_commit(invalidate_tariffs, using=using)
+    transaction.on_commit(lambda: invalidate("allTariffs"), using=using)
+
+
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_delete, sender=PaymentMethod)
+def reset_payment_methods_cache(sender, using, **kwargs):
+    # After commit, so no request can cache the old rows again in between
+    transaction.on_commit(lambda: invalidate("allPaymentMethods"), using=using)
+
+
+@receiver(pre_delete, sender=PaymentMethod)
+def fold_payment_method_revenue(sender, instance, **kwargs):
+    fold_payment_method(instance.pk)
+
+
+@receiver(post_save, sender=Kiosk)
+@receiver(post_delete, sender=Kiosk)
+def reset_kiosk_directory(sender, using, **kwargs):
+    transaction.on_commit(invalidate_kiosks, using=using)
+
+
+@receiver(post_init, sender=ParkingSession)
+def remember_exit_time(sender, instance, **kwargs):
+    instance._saved_exit_time = instance.__dict__.get("exit_time", DEFERRED)
+    instance._saved_kiosk_id = instance.__dict__.get("kiosk_id", DEFERRED)
+
+
+def _session_event(event_type, session, delta):
+    return lambda: publish_event(
+        event_type,
+        session_id=session.pk,
+        car_id=session.car_id,
+        time=(session.exit_time or session.entry_time).isoformat(),
+        occupancy_delta=delta,
+    )
+
+
+@receiver(post_save, sender=ParkingSession)
+def track_session_occupancy(sender, instance, created, using, **kwargs):
+    if instance._saved_exit_time is DEFERRED and not created:
+        return  # Loaded without exit_time, so we cannot tell whether it changed
+    was_open = not created and instance._saved_exit_time is None
+    is_open = instance.exit_time is None
+    saved_kiosk_id = instance._saved_kiosk_id
+    if created or saved_kiosk_id is DEFERRED:
+        saved_kiosk_id = instance.kiosk_id
+    instance._saved_exit_time = instance.exit_time
+    instance._saved_kiosk_id = instance.kiosk_id
+    if created:
+        delta = 1 if is_open else 0
+    else:
+        delta = int(is_open) - int(was_open)
+    # An open session moved to another lot's kiosk changes both lots
+    lot_deltas = Counter()
+    lot_deltas[kiosk_lot_or_none(saved_kiosk_id)] -= was_open
+    lot_deltas[kiosk_lot_or_none(instance.kiosk_id)] += is_open
+    adjust_occupancy(delta, lot_deltas)
+    if not delta:
+        return
+    if delta > 0:
+        add_occupancy(timezone.localdate(instance.entry_time), entries=1)
+    else:
+        add_occupancy(timezone.localdate(instance.exit_time), exits=1)
+    transaction.on_commit(_session_event("entry" if delta > 0 else "exit", instance, delta), using=using)
+
+
+@receiver(post_delete, sender=ParkingSession)
+def release_deleted_session(sender, instance, using, **kwargs):
+    if instance.exit_time is None:
+        adjust_occupancy(-1, {kiosk_lot_or_none(instance.kiosk_id): -1})
+        transaction.on_commit(_session_event("exit", instance, -1), using=using)
+
+
+_REVENUE_FIELDS = ("payment_time", "payment_method_id", "is_employee_vehicle", "amount", "duration")
+
+
+@receiver(post_init, sender=Payment)
+def remember_revenue(sender, instance, **kwargs):
+    loaded = instance.pk is not None and all(field in instance.__dict__ for field in _REVENUE_FIELDS)
+    instance._saved_revenue = revenue_snapshot(instance) if loaded else DEFERRED
+
+
+@receiver(post_save, sender=Payment)
+def track_revenue(sender, instance, created, **kwargs):
+    snapshot = revenue_snapshot(instance)
+    if created:
+        add_revenue(snapshot)
+    elif instance._saved_revenue is not DEFERRED and instance._saved_revenue != snapshot:
+        add_revenue(instance._saved_revenue, sign=-1)
+        add_revenue(snapshot)
+    instance._saved_revenue = snapshot
+
+
+@receiver(post_delete, sender=Payment)
+def untrack_revenue(sender, instance, **kwargs):
+    if instance._saved_revenue is not DEFERRED:
+        add_revenue(instance._saved_revenue, sign=-1)
+
+
+@receiver(post_save, sender=Payment)
+def announce_payment(sender, instance, created, using, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_event(
+            "payment",
+            payment_id=instance.pk,
+            session_id=instance.parking_session_id,
+            car_id=instance.car_id,
+            amount=str(instance.amount),
+        ), using=using)
@@ -1,3 +1,1274 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+import graphene
+
+from schema import schema
+
+from .admission import admission
+from .archive import _has_live_payments
+from .db import LotRouter, MutationAtomicMiddleware, current_database, lot_scope
+from .employees import SessionRecorder, allowlist
+from .fees import _quote, active_tariff, invalidate_tariffs, quote_fees
+from .lots import all_databases
+from .metrics import registry
+from .models import Car, DailyOccupancy, DailyRevenue, Employee, IdempotencyKey, Kiosk, LotOccupancy, Occupancy, ParkingSession, Payment, PaymentMethod, Tariff
+from .occupancy import recount_occupancy
+from .partitions import add_months, convert_table, ensure_partitions, is_partitioned, month_start, partitions
+from .photos import PhotoJob, PhotoPipeline, content_name, process_job, submit_photo, thumbnail_name
+from .plates import is_valid_plate, normalize_plate
+from .resolver_cache import car_details_key, get_or_compute, invalidate_car_details
+
+
+class GraphQLTestCase(TestCase):
+    def setUp(self):
+        # Cached resolver results, tariffs and rate limits outlive each test's
+        # rolled back transaction
+        cache.clear()
+        invalidate_tariffs()
+        admission.reset()
+
+    def graphql(self, query, variables=None):
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query, "variables": variables or {}}),
+            content_type="application/json",
+        )
+        return response.json()
+
+
+class QueryCountTests(GraphQLTestCase):
+    payments_query = """
+    {
+      allPayments(first: 100) {
+        edges {
+          node {
+            amount
+            paymentMethod { methodName }
+            car { carPlate parkingSessions { id } }
+            parkingSession { entryTime car { carPlate } }
+          }
+        }
+      }
+    }
+    """
+    sessions_query = """
+    {
+      allParkingSessions(first: 100) {
+        edges {
+          node {
+            entryTime
+            car { carPlate paymentSet { amount } }
+            paymentSet { amount paymentMethod { methodName } }
+          }
+        }
+      }
+    }
+    """
+
+    def create_rows(self, count):
+        method = PaymentMethod.objects.create(method_name="QPay")
+        start = Car.objects.count()
+        for index in range(start, start + count):
+            car = Car.objects.create(car_plate=f"{index:04d}")
+            session = ParkingSession.objects.create(car=car)
+            Payment.objects.create(
+                car=car, parking_session=session, amount=Decimal("1000"), payment_method=method
+            )
+
+    def count_queries(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.graphql(query)
+        self.assertNotIn("errors", result)
+        return len(queries)
+
+    def assertConstantQueryCount(self, query):
+        self.create_rows(3)
+        few_rows = self.count_queries(query)
+        self.create_rows(30)
+        many_rows = self.count_queries(query)
+        self.assertEqual(few_rows, many_rows)
+
+    def test_all_payments_query_count_is_constant(self):
+        self.assertConstantQueryCount(self.payments_query)
+
+    def test_all_parking_sessions_query_count_is_constant(self):
+        self.assertConstantQueryCount(self.sessions_query)
+
+
+class AddCar(graphene.Mutation):
+    class Arguments:
+        plate = graphene.String(required=True)
+        fail = graphene.Boolean(default_value=False)
+
+    ok = graphene.Boolean()
+
+    def mutate(self, info, plate, fail):
+        Car.objects.create(car_plate=plate)
+        if fail:
+            raise ValueError("Failed after writing.")
+        return AddCar(ok=True)
+
+
+class MutationAtomicityTests(GraphQLTestCase):
+    schema = graphene.Schema(
+        query=type("Query", (graphene.ObjectType,), {"ping": graphene.Boolean()}),
+        mutation=type("Mutation", (graphene.ObjectType,), {"add_car": AddCar.Field()}),
+    )
+
+    def test_failing_field_rolls_back_only_its_own_writes(self):
+        result = self.schema.execute(
+            'mutation { a: addCar(plate: "1111") { ok } b: addCar(plate: "2222", fail: true) { ok } c: addCar(plate: "3333") { ok } }',
+            middleware=[MutationAtomicMiddleware()],
+        )
+        self.assertEqual([error.message for error in result.errors], ["Failed after writing."])
+        self.assertEqual(result.data, {"a": {"ok": True}, "b": None, "c": {"ok": True}})
+        self.assertEqual(sorted(Car.objects.values_list("car_plate", flat=True)), ["1111", "3333"])
+
+
+class PaginationTests(GraphQLTestCase):
+    query = """
+    query Payments($after: String, $carPlate: String) {
+      allPayments(first: 4, after: $after, carPlate: $carPlate) {
+        edges { node { id } }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        for index in range(10):
+            car = Car.objects.create(car_plate=f"{index:04d}")
+            session = ParkingSession.objects.create(car=car)
+            Payment.objects.create(car=car, parking_session=session, amount=Decimal("500"))
+
+    def test_pages_walk_newest_first_without_gaps(self):
+        seen, after = [], None
+        while True:
+            page = self.graphql(self.query, {"after": after})["data"]["allPayments"]
+            seen += [int(edge["node"]["id"]) for edge in page["edges"]]
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+        self.assertEqual(seen, list(Payment.objects.order_by("-payment_time", "-id").values_list("id", flat=True)))
+
+    def test_cursor_is_a_range_on_the_time_field(self):
+        # Rows sharing a timestamp are split across pages by id
+        Payment.objects.filter(pk__in=Payment.objects.order_by("pk").values("pk")[:6]).update(payment_time=timezone.now())
+        self.test_pages_walk_newest_first_without_gaps()
+
+        after = self.graphql(self.query)["data"]["allPayments"]["pageInfo"]["endCursor"]
+        with CaptureQueriesContext(connection) as queries:
+            self.graphql(self.query, {"after": after})
+        page_sql = next(query["sql"] for query in queries.captured_queries if "ORDER BY" in query["sql"])
+        self.assertIn('"payment_time" <= ', page_sql)
+
+    def test_plate_filter(self):
+        page = self.graphql(self.query, {"carPlate": "0003"})["data"]["allPayments"]
+        self.assertEqual(len(page["edges"]), 1)
+        self.assertFalse(page["pageInfo"]["hasNextPage"])
+
+
+class ActiveSessionIndexTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.car = Car.objects.create(car_plate="1234")
+        ParkingSession.objects.create(car=self.car, exit_time=timezone.now())
+        ParkingSession.objects.create(car=self.car)
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # The test tables are tiny, so the planner would pick a seq scan
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
+
+    def test_active_session_lookup_uses_partial_unique_index(self):
+        plan = self.explain(ParkingSession.objects.filter(car=self.car, exit_time__isnull=True))
+        self.assertIn("one_active_session_per_car", plan)
+
+    def test_latest_session_lookup_uses_car_entry_time_index(self):
+        plan = self.explain(self.car.parkingsession_set.order_by("-entry_time", "-id")[:1])
+        self.assertIn("session_car_latest_idx", plan)
+
+    def test_second_active_session_is_rejected_by_the_database(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ParkingSession.objects.create(car=self.car)
+
+    def test_create_entry_car_reports_active_session(self):
+        result = self.graphql(
+            'mutation { createEntryCar(input: {carPlate: "1234", entryPhoto: "AAAA"}) { parkingSession { id } } }'
+        )
+        self.assertEqual(result["errors"][0]["message"], "This car already has an active session.")
+
+
+class OccupancyCounterTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+
+    def counter(self):
+        return Occupancy.objects.get().active_sessions
+
+    def test_counter_follows_entry_exit_delete_and_edits(self):
+        enter = 'mutation($plate: String!) { createEntryCar(input: {carPlate: $plate, entryPhoto: "AAAA"}) { gateOpen } }'
+        for plate in ("1111", "2222"):
+            self.graphql(enter, {"plate": plate})
+        self.assertEqual(self.counter(), 2)
+        result = self.graphql('mutation { exitCar(input: {carPlate: "1111"}) { gateOpen } }')
+        self.assertTrue(result["data"]["exitCar"]["gateOpen"])
+        self.assertEqual(self.counter(), 1)
+        ParkingSession.objects.get(exit_time__isnull=True).delete()
+        self.assertEqual(self.counter(), 0)
+
+        # Edits as the admin makes them: a plain save of the whole row
+        session = ParkingSession.objects.get()
+        session.entry_time -= timedelta(minutes=5)
+        session.save()
+        self.assertEqual(self.counter(), 0)
+        session.exit_time = None
+        session.save()
+        self.assertEqual(self.counter(), 1)
+        self.assertEqual(self.graphql("{ occupancy }")["data"]["occupancy"], 1)
+
+    def test_event_stream_starts_with_the_occupancy(self):
+        ParkingSession.objects.create(car=Car.objects.create(car_plate="1234"))
+        response = self.client.get("/events/")
+        try:
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            self.assertEqual(next(iter(response.streaming_content)), b'event: occupancy\ndata: {"occupancy": 1}\n\n')
+        finally:
+            response.close()
+
+
+class PlateNormalizationTests(GraphQLTestCase):
+    def test_spellings_normalize_to_one_plate(self):
+        # Latin lookalikes, lower case, separators and an O read for a zero
+        for raw in ("1234УНА", "1234 уна", "1234-yha", "12 34 УНA"):
+            self.assertEqual(normalize_plate(raw), "1234УНА")
+        self.assertEqual(normalize_plate("1O34"), "1034")
+        self.assertTrue(is_valid_plate("1234 уна"))
+        self.assertFalse(is_valid_plate("12345"))
+
+    def test_entry_and_lookup_use_normalized_plate(self):
+        create = 'mutation($plate: String!) { createEntryCar(input: {carPlate: $plate, entryPhoto: "AAAA"}) { car { carPlate } } }'
+        result = self.graphql(create, {"plate": "1234 yha"})
+        self.assertEqual(result["data"]["createEntryCar"]["car"]["carPlate"], "1234УНА")
+        result = self.graphql(create, {"plate": "1234УНА"})
+        self.assertEqual(result["errors"][0]["message"], "This car already has an active session.")
+        self.assertEqual(Car.objects.count(), 1)
+
+        result = self.graphql('{ carDetails(carPlate: "1234-уна") { carPlate } }')
+        self.assertEqual(result["data"]["carDetails"]["carPlate"], "1234УНА")
+
+        result = self.graphql(create, {"plate": "12345"})
+        self.assertIn("4 оронтой тоо, дараа нь 3 хүртэл кирилл үсэг", result["errors"][0]["message"])
+
+    def test_legacy_duplicates_use_the_oldest_car(self):
+        # Rows from before normalization can share a normalized plate
+        oldest = Car.objects.create(car_plate="1234уна")
+        Car.objects.create(car_plate="1234yha")
+        Car.objects.update(normalized_plate="1234УНА")
+        create = 'mutation { createEntryCar(input: {carPlate: "1234УНА", entryPhoto: "AAAA"}) { parkingSession { id } } }'
+        result = self.graphql(create)
+        self.assertNotIn("errors", result)
+        session = ParkingSession.objects.get(pk=result["data"]["createEntryCar"]["parkingSession"]["id"])
+        self.assertEqual(session.car_id, oldest.pk)
+
+        session.delete()
+        response = self.client.post(
+            "/ingest/", json.dumps({"type": "entry", "car_plate": "1234уна"}) + "\n",
+            content_type="application/x-ndjson",
+        )
+        self.assertTrue(json.loads(response.content)["ok"])
+        self.assertEqual(ParkingSession.objects.get().car_id, oldest.pk)
+
+
+class FeeTests(GraphQLTestCase):
+    tariff = Tariff(pk=1, free_duration=30, hourly_rate=Decimal("1000"))
+
+    def test_quote(self):
+        free = _quote(30, False, self.tariff)
+        self.assertEqual((free.amount, free.is_within_free_period), (Decimal("0.00"), True))
+        # Every started hour after the free period is charged
+        self.assertEqual(_quote(31, False, self.tariff).amount, Decimal("1000"))
+        self.assertEqual(_quote(90, False, self.tariff).amount, Decimal("1000"))
+        self.assertEqual(_quote(91, False, self.tariff).amount, Decimal("2000"))
+        employee = _quote(600, True, self.tariff)
+        self.assertEqual((employee.amount, employee.is_employee_vehicle, employee.duration), (Decimal("0.00"), True, 600))
+
+    def test_quote_fees(self):
+        entry = timezone.now()
+        quotes = quote_fees(
+            [entry] * 3,
+            [entry + timedelta(minutes=20), entry + timedelta(minutes=150, seconds=1), entry - timedelta(minutes=5)],
+            [False, False, False],
+            tariff=self.tariff,
+        )
+        self.assertEqual([(quote.duration, quote.amount) for quote in quotes], [
+            (20, Decimal("0.00")), (151, Decimal("3000")), (0, Decimal("0.00")),
+        ])
+
+    def test_no_tariff(self):
+        with self.assertRaisesMessage(ValueError, "Tariff is not configured."):
+            quote_fees([timezone.now()], [timezone.now()], [False])
+
+    def test_payment_is_quoted_at_its_payment_time(self):
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        entry = timezone.now() - timedelta(hours=5)
+        car = Car.objects.create(car_plate="1234")
+        session = ParkingSession.objects.create(car=car)
+        ParkingSession.objects.filter(pk=session.pk).update(entry_time=entry)
+        paid_at = entry + timedelta(minutes=100)
+        result = self.graphql(
+            'mutation($time: DateTime!) { savePayment(input: {carPlate: "1234", paymentTime: $time}) { success } }',
+            {"time": paid_at.isoformat()},
+        )
+        self.assertTrue(result["data"]["savePayment"]["success"])
+        payment = Payment.objects.get()
+        self.assertEqual((payment.duration, payment.amount), (100, Decimal("2000.00")))
+
+        # Leaving later does not change what was charged
+        ParkingSession.objects.filter(pk=session.pk).update(exit_time=entry + timedelta(hours=3))
+        call_command("recompute_fees", stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual((payment.duration, payment.amount), (100, Decimal("2000.00")))
+
+    def test_recompute_picks_up_employee_cars(self):
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        entry = timezone.now() - timedelta(hours=5)
+        car = Car.objects.create(car_plate="1234")
+        session = ParkingSession.objects.create(car=car)
+        ParkingSession.objects.filter(pk=session.pk).update(entry_time=entry)
+        payment = Payment.objects.create(
+            car=car, parking_session=session, payment_time=entry + timedelta(minutes=100),
+            duration=100, amount=Decimal("0.00"),
+        )
+        Car.objects.filter(pk=car.pk).update(is_employee_car=True)
+
+        call_command("recompute_fees", since=timezone.localdate(entry).isoformat(), stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertTrue(payment.is_employee_vehicle)
+
+    def test_recompute_rejects_a_bad_since(self):
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        with self.assertRaisesMessage(CommandError, "--since is not an ISO date or time"):
+            call_command("recompute_fees", since="yesterday", stdout=StringIO())
+
+
+class PlateSearchTests(GraphQLTestCase):
+    query = "query($plate: String!, $fuzzy: Boolean) { searchCarsByPlate(carPlate: $plate, fuzzy: $fuzzy) { carPlate } }"
+
+    def search(self, plate, fuzzy=False):
+        result = self.graphql(self.query, {"plate": plate, "fuzzy": fuzzy})["data"]["searchCarsByPlate"]
+        return [car["carPlate"] for car in result]
+
+    def test_prefix_matches_rank_exact_then_shortest(self):
+        for plate in ("1234УНА", "1234У", "1234", "1234АА", "5678"):
+            Car.objects.create(car_plate=plate)
+        self.assertEqual(self.search("1234"), ["1234", "1234У", "1234АА", "1234УНА"])
+        result = self.graphql('{ searchCarByPlate(carPlate: "1234") { carPlate } }')
+        self.assertEqual(result["data"]["searchCarByPlate"], {"carPlate": "1234"})
+
+    def test_fuzzy_search_tolerates_misread_digits(self):
+        for plate in ("1030УБА", "8888УБА", "4567ХХХ"):
+            Car.objects.create(car_plate=plate)
+        # O read for 0 and B for 8
+        self.assertEqual(self.search("1O3OУБА", fuzzy=True)[0], "1030УБА")
+        self.assertEqual(self.search("B8B8УБА", fuzzy=True)[0], "8888УБА")
+        self.assertNotIn("4567ХХХ", self.search("B8B8УБА", fuzzy=True))
+
+
+class ExitFlowTests(GraphQLTestCase):
+    pay = """
+    mutation($key: String) {
+      savePayment(input: {carPlate: "1234", paymentTime: "2024-01-01T10:00:00+00:00", idempotencyKey: $key}) {
+        success message payment { id }
+      }
+    }
+    """
+    exit = """
+    mutation($key: String) {
+      exitCar(input: {carPlate: "1234", idempotencyKey: $key}) {
+        gateOpen message parkingSession { id exitTime }
+      }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        self.car = Car.objects.create(car_plate="1234")
+        self.session = ParkingSession.objects.create(car=self.car)
+        ParkingSession.objects.filter(pk=self.session.pk).update(entry_time=timezone.now() - timedelta(hours=2))
+
+    def test_unpaid_exit_keeps_gate_closed(self):
+        result = self.graphql(self.exit, {"key": "exit-1"})["data"]["exitCar"]
+        self.assertFalse(result["gateOpen"])
+        self.assertIsNone(ParkingSession.objects.get(pk=self.session.pk).exit_time)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_payment_retry_is_not_charged_twice(self):
+        first = self.graphql(self.pay, {"key": "pay-1"})["data"]["savePayment"]
+        retry = self.graphql(self.pay, {"key": "pay-1"})["data"]["savePayment"]
+        self.assertTrue(first["success"])
+        self.assertEqual(first, retry)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertTrue(ParkingSession.objects.get(pk=self.session.pk).paid_status)
+
+        again = self.graphql(self.pay, {"key": "pay-2"})["data"]["savePayment"]
+        self.assertFalse(again["success"])
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.assertTrue(self.graphql(self.pay, {"key": "pay-1"})["data"]["savePayment"]["success"])
+        other = self.pay.replace("2024-01-01T10:00:00", "2024-01-01T11:00:00")
+        result = self.graphql(other, {"key": "pay-1"})["data"]["savePayment"]
+        self.assertEqual(
+            result, {"success": False, "message": "This idempotency key was already used for a different request.", "payment": None}
+        )
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_paid_exit_closes_session_once(self):
+        self.graphql(self.pay, {"key": "pay-1"})
+        first = self.graphql(self.exit, {"key": "exit-1"})["data"]["exitCar"]
+        retry = self.graphql(self.exit, {"key": "exit-1"})["data"]["exitCar"]
+        self.assertTrue(first["gateOpen"])
+        self.assertEqual(first, retry)
+        self.assertIsNotNone(ParkingSession.objects.get(pk=self.session.pk).exit_time)
+        self.assertEqual(Occupancy.objects.get().active_sessions, 0)
+
+
+class IngestTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        self.start = timezone.now() - timedelta(hours=3)
+
+    def ndjson(self, events, **headers):
+        body = "".join(json.dumps(event) + "\n" for event in events)
+        response = self.client.post("/ingest/", body, content_type="application/x-ndjson", headers=headers)
+        return [json.loads(line) for line in response.content.splitlines()]
+
+    def at(self, minutes):
+        return (self.start + timedelta(minutes=minutes)).isoformat()
+
+    def test_backlog_is_replayed_with_client_timestamps(self):
+        results = self.ndjson([
+            {"type": "entry", "car_plate": "1111", "time": self.at(0)},
+            {"type": "entry", "car_plate": "2222", "time": self.at(5)},
+            {"type": "exit", "car_plate": "2222", "time": self.at(100)},  # Not paid yet
+            {"type": "payment", "car_plate": "1111", "time": self.at(90)},
+            {"type": "exit", "car_plate": "1111", "time": self.at(95)},
+            {"type": "entry", "car_plate": "1111", "time": self.at(120)},
+            {"type": "entry", "car_plate": "bad"},
+        ])
+        self.assertEqual([result["ok"] for result in results], [True, True, False, True, True, True, False])
+        self.assertEqual(results[2]["message"], "Payment required.")
+
+        first = ParkingSession.objects.get(pk=results[0]["parking_session_id"])
+        self.assertEqual(first.entry_time.isoformat(), self.at(0))
+        self.assertEqual(first.exit_time.isoformat(), self.at(95))
+        self.assertTrue(first.paid_status)
+        payment = Payment.objects.get(pk=results[3]["payment_id"])
+        self.assertEqual((payment.duration, payment.amount, payment.status), (90, Decimal("1000"), "paid"))
+        self.assertEqual(ParkingSession.objects.filter(exit_time__isnull=True).count(), 2)
+        self.assertEqual(Occupancy.objects.get().active_sessions, 2)
+
+    def test_batch_retry_is_replayed(self):
+        events = [{"type": "entry", "car_plate": "1111", "time": self.at(0)}]
+        first = self.ndjson(events, **{"Idempotency-Key": "batch-1"})
+        retry = self.ndjson(events, **{"Idempotency-Key": "batch-1"})
+        self.assertEqual(first, retry)
+        self.assertEqual(ParkingSession.objects.count(), 1)
+
+    def test_mutation(self):
+        result = self.graphql("""
+        mutation($events: [GateEventInput!]!) {
+          ingestEvents(events: $events) { results { index ok message parkingSessionId } }
+        }
+        """, {"events": [
+            {"type": "entry", "carPlate": "1111", "time": self.at(0)},
+            {"type": "exit", "carPlate": "3333", "time": self.at(10)},
+        ]})
+        results = result["data"]["ingestEvents"]["results"]
+        self.assertTrue(results[0]["ok"])
+        self.assertEqual(results[1]["message"], "Car not found.")
+
+
+@override_settings(EMPLOYEE_SESSION_ASYNC=False)
+class EmployeeFastPathTests(GraphQLTestCase):
+    entry = 'mutation { createEntryCar(input: {carPlate: "5555"}) { gateOpen car { id } } }'
+    exit = 'mutation { exitCar(input: {carPlate: "5555"}) { gateOpen message } }'
+
+    def setUp(self):
+        super().setUp()
+        # The allowlist outlives each test's rolled back transaction
+        allowlist.reset()
+        self.addCleanup(allowlist.reset)
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        self.car = Car.objects.create(car_plate="5555")
+        Employee.objects.create(name="Bat", car=self.car)
+
+    def test_gate_opens_from_memory_and_session_is_recorded(self):
+        self.assertIn("5555", allowlist)
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            entry = self.graphql(self.entry)["data"]["createEntryCar"]
+            count = len(queries)  # Before the recording callback runs
+        self.assertEqual(entry, {"gateOpen": True, "car": None})
+        self.assertFalse([query for query in queries[:count] if "parkingApp" in query["sql"]])
+        session = ParkingSession.objects.get(car=self.car, exit_time__isnull=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.graphql(self.exit)["data"]["exitCar"]
+        self.assertTrue(result["gateOpen"])
+        self.assertIsNotNone(ParkingSession.objects.get(pk=session.pk).exit_time)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_flush_keeps_the_order_across_kiosks(self):
+        entry_kiosk, exit_kiosk = Kiosk.objects.create(location="Central"), Kiosk.objects.create(location="Central")
+        now = timezone.now()
+        recorder = SessionRecorder()
+        # What record() queues once the gate requests commit
+        recorder._pending = [
+            {"type": "entry", "car_plate": "5555", "time": now - timedelta(hours=2), "kiosk_id": entry_kiosk.pk},
+            {"type": "exit", "car_plate": "5555", "time": now - timedelta(hours=1), "kiosk_id": exit_kiosk.pk},
+            {"type": "entry", "car_plate": "5555", "time": now, "kiosk_id": entry_kiosk.pk},
+        ]
+        self.assertEqual(recorder.flush(), 3)
+        self.assertEqual(recorder.stats(), {"pending": 0, "recorded": 3, "failed": 0})
+        self.assertEqual(
+            list(ParkingSession.objects.order_by("entry_time").values_list("exit_time", flat=True)),
+            [now - timedelta(hours=1), None],
+        )
+
+    def test_assigned_car_without_the_flag_parks_for_free(self):
+        # Allowlisted through its Employee only; the fee engine must agree
+        self.assertFalse(self.car.is_employee_car)
+        ParkingSession.objects.create(car=self.car, entry_time=timezone.now() - timedelta(hours=3))
+        quote = self.graphql('{ quoteFee(carPlate: "5555") { amount isEmployeeVehicle } }')["data"]["quoteFee"]
+        self.assertEqual(quote, {"amount": "0.00", "isEmployeeVehicle": True})
+        with override_settings(EMPLOYEE_FAST_PATH=False):
+            result = self.graphql(self.exit)["data"]["exitCar"]
+        self.assertEqual(result, {"gateOpen": True, "message": "Gate opened."})
+
+    def test_allowlist_follows_car_changes(self):
+        self.assertIn("5555", allowlist)
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Car.objects.create(car_plate="6666")
+        self.assertNotIn("6666", allowlist)
+        other.is_employee_car = True
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        self.assertIn("6666", allowlist)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertNotIn("6666", allowlist)
+
+
+class RollupTests(GraphQLTestCase):
+    report = """
+    query($from: Date!, $to: Date!, $period: ReportPeriod) {
+      revenueReport(fromDate: $from, toDate: $to, period: $period, byEmployee: true) {
+        period isEmployeeVehicle payments amount averageDuration
+      }
+      occupancyReport(fromDate: $from, toDate: $to, period: $period) { period entries exits peakOccupancy }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.day = timezone.localdate()
+        now = timezone.now()
+        for index, (amount, duration) in enumerate([(1000, 60), (3000, 150)]):
+            car = Car.objects.create(car_plate=f"{index:04d}")
+            session = ParkingSession.objects.create(car=car)
+            Payment.objects.create(
+                car=car, parking_session=session, amount=Decimal(amount), duration=duration, payment_time=now
+            )
+        session.exit_time = now
+        session.save()
+        employee_car = Car.objects.create(car_plate="9999", is_employee_car=True)
+        session = ParkingSession.objects.create(car=employee_car)
+        Payment.objects.create(
+            car=employee_car, parking_session=session, amount=0, duration=30, is_employee_vehicle=True, payment_time=now
+        )
+
+    def fetch(self, period="DAY"):
+        variables = {"from": str(self.day), "to": str(self.day), "period": period}
+        return self.graphql(self.report, variables)["data"]
+
+    def test_rollups_follow_writes(self):
+        data = self.fetch()
+        self.assertEqual(data["revenueReport"], [
+            {"period": str(self.day), "isEmployeeVehicle": False, "payments": 2, "amount": "4000.00", "averageDuration": 105.0},
+            {"period": str(self.day), "isEmployeeVehicle": True, "payments": 1, "amount": "0.00", "averageDuration": 30.0},
+        ])
+        self.assertEqual(data["occupancyReport"], [{"period": str(self.day), "entries": 3, "exits": 1, "peakOccupancy": 2}])
+
+        payment = Payment.objects.get(amount=3000)
+        payment.amount = Decimal(2000)
+        payment.save()
+        Payment.objects.filter(is_employee_vehicle=True).get().delete()
+        self.assertEqual(self.fetch("MONTH")["revenueReport"], [
+            {"period": str(self.day.replace(day=1)), "isEmployeeVehicle": False, "payments": 2, "amount": "3000.00", "averageDuration": 105.0},
+        ])
+
+    def test_backfill_matches_incremental_rollups(self):
+        before = self.fetch()
+        DailyRevenue.objects.all().delete()
+        DailyOccupancy.objects.all().delete()
+        call_command("backfill_rollups", stdout=StringIO())
+        self.assertEqual(self.fetch(), before)
+
+    def test_one_row_without_payment_method(self):
+        # What a concurrent first payment of the day would insert
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyRevenue.objects.create(day=self.day, payment_method=None, is_employee_vehicle=False)
+        self.assertEqual(self.fetch()["revenueReport"][0]["amount"], "4000.00")
+
+    def test_deleting_payment_method_merges_its_rows(self):
+        method = PaymentMethod.objects.create(method_name="Card")
+        car = Car.objects.create(car_plate="1234")
+        session = ParkingSession.objects.create(car=car)
+        Payment.objects.create(
+            car=car, parking_session=session, amount=Decimal(500), duration=30, payment_method=method,
+            payment_time=timezone.now(),
+        )
+        method.delete()
+        self.assertEqual(DailyRevenue.objects.filter(day=self.day, is_employee_vehicle=False).count(), 1)
+        self.assertEqual(self.fetch()["revenueReport"][0]["amount"], "4500.00")
+
+
+class ArchiveTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        override = override_settings(PARTITION_ARCHIVE_DIR=self.archive_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        old = timezone.now() - timedelta(days=800)
+        self.car = Car.objects.create(car_plate="1234")
+        self.session = ParkingSession.objects.create(car=self.car, entry_time=old, exit_time=old + timedelta(hours=1))
+        Payment.objects.create(car=self.car, parking_session=self.session, amount=Decimal("1000"), payment_time=old)
+        ParkingSession.objects.create(car=Car.objects.create(car_plate="5678"), entry_time=old)  # Never left
+        ParkingSession.objects.create(car=self.car)
+
+    def test_old_months_are_archived_and_readable(self):
+        revenue = list(DailyRevenue.objects.values_list("amount", flat=True))
+        call_command("archive_partitions", "--older-than-months", "12", stdout=StringIO())
+
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(ParkingSession.objects.filter(pk=self.session.pk).exists())
+        self.assertEqual(ParkingSession.objects.count(), 2)  # The open and the recent session stay
+        self.assertEqual(list(DailyRevenue.objects.values_list("amount", flat=True)), revenue)
+
+        month = str(self.session.entry_time.date().replace(day=1))
+        data = self.graphql("""
+        query($month: Date!) {
+          archivedMonths
+          archivedParkingSessions(month: $month, carPlate: "1234") { id exitTime paidStatus car { carPlate } }
+          archivedPayments(month: $month) { amount }
+        }
+        """, {"month": month})["data"]
+        self.assertEqual(data["archivedMonths"], [month])
+        self.assertEqual(data["archivedParkingSessions"], [{
+            "id": str(self.session.pk),
+            "exitTime": self.session.exit_time.isoformat(),
+            "paidStatus": False,
+            "car": {"carPlate": "1234"},
+        }])
+        self.assertEqual(data["archivedPayments"], [{"amount": "1000.00"}])
+
+    def test_paid_sessions_stay_live(self):
+        # A payment made in a newer month keeps its session's month live,
+        # on the partition path too
+        Payment.objects.update(payment_time=timezone.now())
+        self.assertTrue(_has_live_payments(ParkingSession._meta.db_table))
+        call_command("archive_partitions", "--older-than-months", "12", stdout=StringIO())
+        self.assertTrue(ParkingSession.objects.filter(pk=self.session.pk).exists())
+        Payment.objects.all().delete()
+        self.assertFalse(_has_live_payments(ParkingSession._meta.db_table))
+
+
+class PartitionTests(GraphQLTestCase):
+    def test_other_databases_are_refused(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("Partitioning is supported on PostgreSQL.")
+        self.assertFalse(is_partitioned(ParkingSession))
+        with self.assertRaisesMessage(NotImplementedError, "only supported on PostgreSQL"):
+            convert_table(ParkingSession)
+        with self.assertRaisesMessage(CommandError, "only supported on PostgreSQL"):
+            call_command("manage_partitions", "--convert", stdout=StringIO())
+
+    @skipUnless(connection.vendor == "postgresql", "Table partitioning needs PostgreSQL.")
+    def test_tables_are_converted_to_monthly_partitions(self):
+        old = timezone.now() - timedelta(days=70)
+        car = Car.objects.create(car_plate="1234")
+        session = ParkingSession.objects.create(car=car, entry_time=old, exit_time=old + timedelta(hours=1))
+        Payment.objects.create(car=car, parking_session=session, amount=Decimal("1000"), payment_time=old)
+        ParkingSession.objects.create(car=car)
+
+        call_command("manage_partitions", "--convert", "--months-ahead", "1", stdout=StringIO())
+        this_month = month_start(timezone.now().date())
+        for model in (ParkingSession, Payment):
+            self.assertTrue(is_partitioned(model))
+            self.assertIn(month_start(old.date()), partitions(model))
+            self.assertIn(add_months(this_month, 1), partitions(model))
+        self.assertFalse(convert_table(Payment))
+        self.assertEqual((ParkingSession.objects.count(), Payment.objects.get().parking_session), (2, session))
+
+        # The trigger stands in for the partial unique constraint
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ParkingSession.objects.create(car=car)
+        ensure_partitions(Payment, months_ahead=2)
+        self.assertIn(add_months(this_month, 2), partitions(Payment))
+
+
+class PaymentMethodMediaTests(GraphQLTestCase):
+    query = "{ allPaymentMethods { methodName qr qrUrl } }"
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.method = PaymentMethod.objects.create(method_name="QPay")
+            self.method.qr.save("qpay.png", ContentFile(b"qr-v1"))
+
+    def test_payment_methods_are_cached_until_saved(self):
+        first = self.graphql(self.query)["data"]["allPaymentMethods"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.graphql(self.query)["data"]["allPaymentMethods"], first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.method.method_name = "SocialPay"
+            self.method.save()
+        self.assertEqual(self.graphql(self.query)["data"]["allPaymentMethods"][0]["methodName"], "SocialPay")
+
+    def test_versioned_media_url_is_immutable(self):
+        url = self.graphql(self.query)["data"]["allPaymentMethods"][0]["qrUrl"]
+        self.assertRegex(url, r"^/media/payment_qrs/qpay[^?]*\.png\?v=[0-9a-f]{12}$")
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), b"qr-v1")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        not_modified = self.client.get(url, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+
+        unversioned = self.client.get(url.split("?")[0])
+        self.assertEqual(unversioned["Cache-Control"], "public, max-age=300")
+        self.assertEqual(self.client.get("/media/../settings.py").status_code, 404)
+
+    def test_car_photos_are_served_to_staff_only(self):
+        default_storage.save("car_photos/entry/ab/photo.jpg", ContentFile(b"photo"))
+        self.assertEqual(self.client.get("/media/car_photos/entry/ab/photo.jpg").status_code, 404)
+        self.assertEqual(self.client.get("/media/payment_qrs/../car_photos/entry/ab/photo.jpg").status_code, 404)
+        self.assertEqual(self.client.get(f"/media/{self.method.qr.name}").status_code, 200)
+
+        self.client.force_login(User.objects.create_user("operator", is_staff=True))
+        response = self.client.get("/media/car_photos/entry/ab/photo.jpg")
+        self.assertEqual(b"".join(response.streaming_content), b"photo")
+        self.assertEqual(response["Cache-Control"], "private, max-age=300")
+
+    def test_only_the_full_version_is_immutable(self):
+        url = self.graphql(self.query)["data"]["allPaymentMethods"][0]["qrUrl"]
+        self.assertEqual(self.client.get(url[:-6])["Cache-Control"], "public, max-age=300")
+
+    @override_settings(MEDIA_SENDFILE="x-accel-redirect")
+    def test_accel_redirect_mode(self):
+        response = self.client.get(f"/media/payment_logos/../{self.method.qr.name}")
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.method.qr.name}")
+        self.assertEqual(response.content, b"")
+
+
+class PhotoStorageTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name, PHOTO_PIPELINE_ASYNC=False)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_identical_uploads_share_one_file(self):
+        photo = b"not a jpeg, stored as uploaded"
+        sessions = [ParkingSession.objects.create(car=Car.objects.create(car_plate=plate)) for plate in ("1111", "2222")]
+        with self.captureOnCommitCallbacks(execute=True):
+            for session in sessions:
+                submit_photo([(session, "entry_photo"), (session.car, "entry_photo")], photo)
+
+        name = content_name("car_photos/entry/", hashlib.sha256(photo).hexdigest())
+        self.assertEqual(set(ParkingSession.objects.values_list("entry_photo", flat=True)), {name})
+        self.assertEqual(set(Car.objects.values_list("entry_photo", flat=True)), {name})
+        _, files = default_storage.listdir(os.path.dirname(name))
+        self.assertEqual(files, [os.path.basename(name)])
+        with default_storage.open(name) as stored:
+            self.assertEqual(stored.read(), photo)
+
+    def test_multipart_upload(self):
+        photo = b"uploaded photo bytes"
+        operations = {
+            "query": 'mutation($file: Upload) { createEntryCar(input: {carPlate: "1234", entryPhotoFile: $file}) { gateOpen } }',
+            "variables": {"file": None},
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/graphql/", {
+                "operations": json.dumps(operations),
+                "map": json.dumps({"0": ["variables.file"]}),
+                "0": SimpleUploadedFile("entry.jpg", photo, content_type="image/jpeg"),
+            })
+        self.assertEqual(response.json(), {"data": {"createEntryCar": {"gateOpen": True}}})
+        name = content_name("car_photos/entry/", hashlib.sha256(photo).hexdigest())
+        self.assertEqual(ParkingSession.objects.get().entry_photo.name, name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_spooled_image_is_reencoded_from_disk(self):
+        from PIL import Image
+
+        image = BytesIO()
+        Image.new("RGB", (1280, 960), "red").save(image, "PNG")
+        fd, spool_path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as spooled:
+            spooled.write(image.getvalue())
+        session = ParkingSession.objects.create(car=Car.objects.create(car_plate="1234"))
+        name = process_job(PhotoJob(((ParkingSession, session.pk, "entry_photo"),), None, spool_path, "default"))
+
+        self.assertEqual(name, content_name("car_photos/entry/", hashlib.sha256(image.getvalue()).hexdigest()))
+        self.assertFalse(os.path.exists(spool_path))
+        with default_storage.open(name) as photo, default_storage.open(thumbnail_name(name)) as thumbnail:
+            self.assertEqual(Image.open(photo).format, "JPEG")
+            self.assertEqual(Image.open(thumbnail).size, (320, 240))
+
+    @override_settings(PHOTO_QUEUE_PUT_TIMEOUT=0)
+    def test_full_queue_processes_the_photo_inline(self):
+        session = ParkingSession.objects.create(car=Car.objects.create(car_plate="1234"))
+        job = PhotoJob(((ParkingSession, session.pk, "entry_photo"),), b"photo", None, "default")
+        stalled = PhotoPipeline(workers=0, queue_size=1)  # Nobody takes jobs off the queue
+        stalled.submit(job)
+        self.assertEqual(ParkingSession.objects.get().entry_photo, "")
+        stalled.submit(job)
+        self.assertNotEqual(ParkingSession.objects.get().entry_photo, "")
+        self.assertEqual(
+            {key: stalled.stats()[key] for key in ("depth", "overflowed", "processed")},
+            {"depth": 1, "overflowed": 1, "processed": 1},
+        )
+
+    def test_compact_photos_moves_merges_and_deletes_orphans(self):
+        for name, content in (("a.jpg", b"same"), ("b.jpg", b"same"), ("orphan.jpg", b"other")):
+            default_storage.save(f"car_photos/entry/{name}", ContentFile(content))
+        first = Car.objects.create(car_plate="1111", entry_photo="car_photos/entry/a.jpg")
+        session = ParkingSession.objects.create(car=first)
+        Car.objects.create(car_plate="2222", entry_photo="car_photos/entry/b.jpg")
+
+        out = StringIO()
+        call_command("compact_photos", "--delete-orphans", stdout=out)
+        self.assertIn("Photos moved: 1, merged duplicates: 1", out.getvalue())
+        self.assertIn("Orphaned photos deleted: 1", out.getvalue())
+
+        name = content_name("car_photos/entry", hashlib.sha256(b"same").hexdigest())
+        self.assertEqual(set(Car.objects.values_list("entry_photo", flat=True)), {name})
+        session.refresh_from_db()
+        self.assertEqual(session.entry_photo.name, name)  # Backfilled from its car
+        self.assertTrue(default_storage.exists(name))
+        for old in ("a.jpg", "b.jpg", "orphan.jpg"):
+            self.assertFalse(default_storage.exists(f"car_photos/entry/{old}"))
+
+
+class AsyncViewTests(GraphQLTestCase):
+    def post(self, query):
+        return self.client.post("/graphql/async/", {"query": query}, content_type="application/json")
+
+    def test_async_view_serves_queries_and_mutations(self):
+        result = self.post('mutation { createEntryCar(input: {carPlate: "1234", entryPhoto: "AAAA"}) { gateOpen } }').json()
+        self.assertEqual(result, {"data": {"createEntryCar": {"gateOpen": True}}})
+        self.assertEqual(self.post('{ occupancy carDetails(carPlate: "1234") { carPlate } }').json(), {
+            "data": {"occupancy": 1, "carDetails": {"carPlate": "1234"}},
+        })
+
+
+class PersistedQueryTests(GraphQLTestCase):
+    query = "{ occupancy }"
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.GRAPHQL_PERSISTED_QUERY_CACHE_ALIAS].clear()
+
+    def post(self, sha256_hash, query=None):
+        body = {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": sha256_hash}}}
+        if query:
+            body["query"] = query
+        return self.client.post("/graphql/", json.dumps(body), content_type="application/json")
+
+    def test_register_then_send_only_the_hash(self):
+        sha256_hash = hashlib.sha256(self.query.encode()).hexdigest()
+        response = self.post(sha256_hash)
+        self.assertEqual(response.json()["errors"][0]["message"], "PersistedQueryNotFound")
+
+        self.assertEqual(self.post(sha256_hash, self.query).json(), {"data": {"occupancy": 0}})
+        self.assertEqual(self.post(sha256_hash).json(), {"data": {"occupancy": 0}})
+        extensions = json.dumps({"persistedQuery": {"version": 1, "sha256Hash": sha256_hash}})
+        response = self.client.get("/graphql/", {"extensions": extensions}, headers={"Accept": "application/json"})
+        self.assertEqual(response.json(), {"data": {"occupancy": 0}})
+
+    def test_hash_must_match_the_query(self):
+        response = self.post("0" * 64, self.query)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post("0" * 64).json()["errors"][0]["message"], "PersistedQueryNotFound")
+
+    @override_settings(GRAPHQL_PERSISTED_QUERY_CACHE_ALIAS="unavailable")
+    def test_broken_cache_falls_back_to_full_queries(self):
+        sha256_hash = hashlib.sha256(self.query.encode()).hexdigest()
+        self.assertEqual(self.post(sha256_hash, self.query).json(), {"data": {"occupancy": 0}})
+        self.assertEqual(self.post(sha256_hash).json()["errors"][0]["message"], "PersistedQueryNotFound")
+
+    def test_schema_executes_the_cached_document(self):
+        nested = "id"
+        for _ in range(5):
+            nested = f"parkingSessions {{ car {{ {nested} }} }}"
+        result = schema.execute(f'{{ carDetails(carPlate: "1234") {{ {nested} }} }}')
+        self.assertIn("Query depth exceeds the limit of 10.", [error.message for error in result.errors])
+        self.assertEqual(schema.execute(self.query).data, {"occupancy": 0})
+
+
+class ResolverCacheTests(GraphQLTestCase):
+    def test_tariffs_are_cached_until_saved(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tariff = Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        query = "{ allTariffs { hourlyRate } }"
+        self.assertEqual(self.graphql(query)["data"]["allTariffs"], [{"hourlyRate": "1000.00"}])
+        with self.assertNumQueries(0):
+            self.graphql(query)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tariff.hourly_rate = Decimal("1500")
+            tariff.save()
+        self.assertEqual(self.graphql(query)["data"]["allTariffs"], [{"hourlyRate": "1500.00"}])
+
+    def test_fee_engine_tariffs_follow_commits_and_expire(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tariff = Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        self.assertEqual(active_tariff().hourly_rate, Decimal("1000"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tariff.hourly_rate = Decimal("1500")
+            tariff.save()
+            # Not before the change is committed
+            self.assertEqual(active_tariff().hourly_rate, Decimal("1000"))
+        self.assertEqual(active_tariff().hourly_rate, Decimal("1500"))
+
+        # A change made by another process shows up once the cache expires
+        Tariff.objects.filter(pk=tariff.pk).update(hourly_rate=Decimal("2000"))
+        self.assertEqual(active_tariff().hourly_rate, Decimal("1500"))
+        with override_settings(TARIFF_CACHE_TTL=-1):
+            self.assertEqual(active_tariff().hourly_rate, Decimal("2000"))
+
+    def test_car_details_cached_per_normalized_plate(self):
+        query = 'query($plate: String!) { carDetails(carPlate: $plate) { carPlate isEmployeeCar } }'
+        self.assertIsNone(self.graphql(query, {"plate": "1234УНА"})["data"]["carDetails"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            car = Car.objects.create(car_plate="1234УНА")
+        self.assertFalse(self.graphql(query, {"plate": "1234УНА"})["data"]["carDetails"]["isEmployeeCar"])
+        with self.assertNumQueries(0):
+            # Other spellings of the plate share the cache entry
+            self.assertEqual(self.graphql(query, {"plate": "1234 yha"})["data"]["carDetails"]["carPlate"], "1234УНА")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            car.car_plate = "5678УНА"
+            car.save()
+        self.assertIsNone(self.graphql(query, {"plate": "1234УНА"})["data"]["carDetails"])
+        self.assertEqual(self.graphql(query, {"plate": "5678УНА"})["data"]["carDetails"]["carPlate"], "5678УНА")
+
+    def test_invalidation_during_a_computation_is_kept(self):
+        def compute():
+            # Read the old row, then another request commits and invalidates
+            value = "old"
+            invalidate_car_details("1234УНА")
+            return value
+
+        args = car_details_key("1234УНА")
+        self.assertEqual(get_or_compute("carDetails", args, compute), "old")
+        self.assertEqual(get_or_compute("carDetails", args, lambda: "new"), "new")
+        self.assertEqual(get_or_compute("carDetails", args, lambda: "newer"), "new")
+
+
+class LotScopingTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        self.central = Kiosk.objects.create(location="Central")
+        self.pay_kiosk = Kiosk.objects.create(location="Central")
+        self.airport = Kiosk.objects.create(location="Airport")
+
+    def enter(self, plate, kiosk):
+        return self.graphql(
+            'mutation($plate: String!, $kiosk: ID) { createEntryCar(input: {carPlate: $plate, entryPhoto: "AAAA", kioskId: $kiosk}) { gateOpen } }',
+            {"plate": plate, "kiosk": kiosk.pk if kiosk else None},
+        )
+
+    def test_sessions_and_payments_are_scoped_by_lot(self):
+        self.enter("1111", self.central)
+        self.enter("2222", self.airport)
+        self.enter("3333", None)
+        result = self.graphql(
+            'mutation($kiosk: ID) { savePayment(input: {carPlate: "1111", paymentTime: "2026-01-01T00:00:00+00:00", kioskId: $kiosk}) { success } }',
+            {"kiosk": self.pay_kiosk.pk},
+        )
+        self.assertTrue(result["data"]["savePayment"]["success"])
+        self.assertEqual(Payment.objects.get().kiosk, self.pay_kiosk)
+        self.assertEqual(ParkingSession.objects.get(car__car_plate="1111").kiosk, self.central)
+
+        result = self.graphql("""{
+          occupancy
+          central: occupancy(lot: "Central")
+          allParkingSessions(lot: "Central") { edges { node { car { carPlate } kiosk { location } } } }
+          allPayments(lot: "Central") { edges { node { car { carPlate } } } }
+        }""")["data"]
+        self.assertEqual((result["occupancy"], result["central"]), (3, 1))
+        self.assertEqual(
+            [edge["node"] for edge in result["allParkingSessions"]["edges"]],
+            [{"car": {"carPlate": "1111"}, "kiosk": {"location": "Central"}}],
+        )
+        self.assertEqual(len(result["allPayments"]["edges"]), 1)
+
+    def test_unknown_kiosk_is_rejected(self):
+        result = self.enter("1111", Kiosk(pk=999))
+        self.assertEqual(result["errors"][0]["message"], "Kiosk not found.")
+        self.assertFalse(ParkingSession.objects.exists())
+
+    def lot_counters(self):
+        return dict(LotOccupancy.objects.values_list("lot", "active_sessions"))
+
+    def test_lot_counters_follow_sessions(self):
+        self.enter("1111", self.central)
+        self.enter("2222", self.airport)
+        self.assertEqual(self.lot_counters(), {"Central": 1, "Airport": 1})
+
+        # Moved to another lot's kiosk, e.g. in the admin
+        session = ParkingSession.objects.get(car__car_plate="2222")
+        session.kiosk = self.pay_kiosk
+        session.save()
+        self.assertEqual(self.lot_counters(), {"Central": 2, "Airport": 0})
+        session.exit_time = timezone.now()
+        session.save()
+        ParkingSession.objects.get(car__car_plate="1111").delete()
+        self.assertEqual(self.lot_counters(), {"Central": 0, "Airport": 0})
+
+        self.enter("3333", self.airport)
+        with CaptureQueriesContext(connection) as queries:
+            result = self.graphql('{ airport: occupancy(lot: "Airport") }')["data"]
+        self.assertEqual(result, {"airport": 1})
+        self.assertFalse([query for query in queries.captured_queries if "COUNT" in query["sql"].upper()])
+        recount_occupancy()
+        self.assertEqual(self.lot_counters(), {"Airport": 1})
+
+    def test_totals_add_up_every_database(self):
+        with override_settings(LOT_DATABASES={"Airport": "lot_west", "West": "lot_west", "Central": "default"}):
+            self.assertEqual(all_databases(), ["default", "lot_west"])
+
+    def test_ingest_endpoint_records_its_kiosk(self):
+        body = json.dumps({"type": "entry", "car_plate": "1111"}) + "\n"
+        response = self.client.post(
+            "/ingest/", body, content_type="application/x-ndjson", headers={"X-Kiosk-Id": str(self.airport.pk)}
+        )
+        self.assertTrue(json.loads(response.content)["ok"])
+        self.assertEqual(ParkingSession.objects.get().kiosk, self.airport)
+
+        response = self.client.post("/ingest/?kiosk_id=999", body, content_type="application/x-ndjson")
+        self.assertEqual((response.status_code, response.content), (400, b"Kiosk not found."))
+
+    def test_router_follows_the_operation_lot(self):
+        router = LotRouter()
+        with override_settings(LOT_DATABASES={"Airport": "lot_west"}):
+            with lot_scope("Airport"):
+                self.assertEqual(router.db_for_write(ParkingSession), "lot_west")
+                self.assertEqual(current_database(), "lot_west")
+            with lot_scope("Central"):
+                self.assertIsNone(router.db_for_read(ParkingSession))
+                self.assertEqual(current_database(), "default")
+
+
+@skipUnless("lot_west" in settings.DATABASES, "needs a lot database: DATABASE_LOT_HOSTS=west=<host>")
+class LotDatabaseTests(GraphQLTestCase):
+    databases = {"default", "lot_west"}
+    lookups = """query($kiosk: ID) {
+      quoteFee(carPlate: "1111", kioskId: $kiosk) { amount }
+      carDetails(carPlate: "1111", kioskId: $kiosk) { carPlate parkingSessions { id } }
+      searchCarByPlate(carPlate: "1111", kioskId: $kiosk) { carPlate }
+      searchCarsByPlate(carPlate: "1111", kioskId: $kiosk) { carPlate }
+    }"""
+
+    def setUp(self):
+        super().setUp()
+        lots = override_settings(LOT_DATABASES={"Airport": "lot_west"})
+        lots.enable()
+        self.addCleanup(lots.disable)
+        # Reference data is copied to every lot database with the same ids
+        for alias in ("default", "lot_west"):
+            Tariff.objects.using(alias).create(pk=1, free_duration=30, hourly_rate=Decimal("1000"))
+            Kiosk.objects.using(alias).create(pk=1, location="Central")
+            Kiosk.objects.using(alias).create(pk=2, location="Airport")
+        car = Car.objects.using("lot_west").create(car_plate="1111")
+        ParkingSession.objects.using("lot_west").create(car=car, entry_time=timezone.now() - timedelta(hours=2), kiosk_id=2)
+
+    def test_kiosk_lookups_read_the_kiosk_lot(self):
+        airport = self.graphql(self.lookups, {"kiosk": 2})["data"]
+        self.assertEqual(airport["quoteFee"], {"amount": "2000.00"})
+        self.assertEqual(len(airport["carDetails"]["parkingSessions"]), 1)
+        self.assertEqual(airport["searchCarByPlate"], {"carPlate": "1111"})
+        self.assertEqual(airport["searchCarsByPlate"], [{"carPlate": "1111"}])
+
+        # Not on the default database, and not served from the airport's cache
+        central = self.graphql(self.lookups, {"kiosk": 1})["data"]
+        self.assertEqual(central, {"quoteFee": None, "carDetails": None, "searchCarByPlate": None, "searchCarsByPlate": []})
+        self.assertFalse(Car.objects.exists())
+
+
+class AdmissionTests(GraphQLTestCase):
+    def post(self, query, **extra):
+        return self.client.post("/graphql/", {"query": query}, content_type="application/json", **extra)
+
+    def test_deep_and_costly_queries_are_rejected_before_execution(self):
+        nested = "id"
+        for _ in range(5):
+            nested = f"parkingSessions {{ car {{ {nested} }} }}"
+        with self.assertNumQueries(0):
+            errors = self.post(f'{{ carDetails(carPlate: "1234") {{ {nested} }} }}').json()["errors"]
+        self.assertIn("Query depth exceeds the limit of 10.", [error["message"] for error in errors])
+
+        costly = "{ allPayments(first: 100) { edges { node { car { parkingSessions { car { parkingSessions { id } } } } } } } }"
+        errors = self.post(costly).json()["errors"]
+        self.assertEqual(errors[0]["message"], "Query cost exceeds the limit of 5000.")
+
+        dashboard = "{ occupancy allParkingSessions(first: 50) { edges { node { id car { carPlate } } } } }"
+        self.assertNotIn("errors", self.post(dashboard).json())
+
+    def test_chained_fragments_are_measured_once(self):
+        # Each fragment spreads the next one twice: 2**30 walks if every
+        # spread were measured again
+        fragments = ["fragment F30 on CarType { id }"] + [
+            f"fragment F{n} on CarType {{ ...F{n + 1} ... on CarType {{ ...F{n + 1} }} }}" for n in range(30)
+        ]
+        started = time.monotonic()
+        errors = self.post('{ carDetails(carPlate: "1234") { ...F0 } } ' + " ".join(fragments)).json()["errors"]
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(errors[0]["message"], "Query cost exceeds the limit of 5000.")
+
+    @override_settings(GRAPHQL_MAX_TOKENS=50)
+    def test_long_documents_are_not_parsed(self):
+        errors = self.post("{ %s }" % " ".join(["occupancy"] * 100)).json()["errors"]
+        self.assertIn("more than 50 tokens", errors[0]["message"])
+
+    @override_settings(GRAPHQL_RATE_LIMIT_RATE=0.5, GRAPHQL_RATE_LIMIT_BURST=2, GRAPHQL_RATE_LIMIT_CLIENT_HEADER="X-Kiosk-Id")
+    def test_rate_limit_per_client(self):
+        kiosk = {"headers": {"X-Kiosk-Id": "1"}}
+        self.assertEqual([self.post("{ occupancy }", **kiosk).status_code for _ in range(2)], [200, 200])
+        limited = self.post("{ occupancy }", **kiosk)
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(limited["Retry-After"], "2")
+        self.assertEqual(self.post("{ occupancy }", headers={"X-Kiosk-Id": "2"}).status_code, 200)
+
+    @override_settings(GRAPHQL_MAX_BODY_SIZE=100)
+    def test_large_body_is_rejected(self):
+        response = self.post('mutation { createEntryCar(input: {carPlate: "1234", entryPhoto: "%s"}) { gateOpen } }' % ("A" * 200))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Car.objects.exists())
+
+    @override_settings(GRAPHQL_MAX_BODY_SIZE=100)
+    def test_body_without_length_is_refused(self):
+        # A chunked upload does not say how large it is
+        request = RequestFactory().post("/graphql/", "{}", content_type="application/json", HTTP_TRANSFER_ENCODING="chunked")
+        del request.META["CONTENT_LENGTH"]
+        self.assertEqual(admission.check(request).status_code, 411)
+        self.assertIsNone(admission.check(RequestFactory().get("/graphql/", {"query": "{ occupancy }"})))
+        self.assertEqual(admission.stats()["length_required"], 1)
+
+    @override_settings(GRAPHQL_MAX_IN_FLIGHT=1)
+    def test_load_is_shed_when_busy(self):
+        with admission.admit(RequestFactory().post("/graphql/")) as rejection:
+            self.assertIsNone(rejection)
+            response = self.post("{ occupancy }")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.post("{ occupancy }").status_code, 200)
+        self.assertIn('parkingpay_graphql_rejected_total{reason="overloaded"} 1', self.client.get("/metrics").content.decode())
+
+
+class ConnectionStatsTests(GraphQLTestCase):
+    def test_connection_stats_per_alias(self):
+        result = self.graphql("{ databaseConnectionStats { alias mode connectionsOpened poolSize } }")
+        stats = result["data"]["databaseConnectionStats"]
+        self.assertEqual(stats[0]["alias"], "default")
+        self.assertIn(stats[0]["mode"], ("pool", "persistent", "per-request"))
+        self.assertGreaterEqual(stats[0]["connectionsOpened"], 1)
+
+
+class MetricsTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    @override_settings(GRAPHQL_TRACING=True)
+    def test_tracing_extension_is_opt_in(self):
+        query = "query Occupancy { occupancy }"
+        plain = self.client.post("/graphql/", {"query": query}, content_type="application/json").json()
+        self.assertNotIn("extensions", plain)
+        traced = self.client.post(
+            "/graphql/", {"query": query}, content_type="application/json", headers={"X-GraphQL-Tracing": "1"}
+        ).json()
+        resolvers = traced["extensions"]["tracing"]["execution"]["resolvers"]
+        self.assertEqual([resolver["fieldName"] for resolver in resolvers], ["occupancy"])
+        self.assertGreaterEqual(traced["extensions"]["tracing"]["sql"]["count"], 1)
+
+    def test_prometheus_metrics(self):
+        Tariff.objects.create(free_duration=30, hourly_rate=Decimal("1000"))
+        self.graphql("query Occupancy { occupancy }")
+        self.graphql('mutation Entry { createEntryCar(input: {carPlate: "1234", entryPhoto: "AAAA"}) { gateOpen } }')
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn('parkingpay_graphql_operation_duration_seconds_count{operation="query",name="Occupancy"} 1', body)
+        self.assertIn('parkingpay_graphql_field_calls_total{type="Query",field="occupancy"} 1', body)
+        self.assertIn('parkingpay_graphql_field_input_bytes_total{type="Mutation",field="createEntryCar"} 8', body)
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.0.0.5").status_code, 403)
+
+
+class SeedBenchmarkDataTests(TestCase):
+    def test_seeded_rows_are_consistent(self):
+        call_command("seed_benchmark_data", rows=300, chunk_size=40, stdout=StringIO())
+        cars = Car.objects.count()
+        self.assertGreater(cars, 40)
+        self.assertEqual(Car.objects.exclude(normalized_plate=F("car_plate")).count(), 0)
+        self.assertEqual(
+            Occupancy.objects.get().active_sessions, ParkingSession.objects.filter(exit_time__isnull=True).count()
+        )
+        self.assertEqual(Payment.objects.count(), ParkingSession.objects.filter(paid_status=True).count())
+        self.assertEqual(
+            DailyRevenue.objects.aggregate(total=Sum("payments"))["total"], Payment.objects.count()
+        )
+        with self.assertRaises(CommandError):
+            call_command("seed_benchmark_data", rows=300, stdout=StringIO())
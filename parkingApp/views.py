@@ -1,3 +1,304 @@
-from django.shortcuts import render
+import asyncio
+import json
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, StreamingHttpResponse,
+)
+from django.views import View
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, validate_schema
+
+from parkingApp.admission import VALIDATION_RULES, admission
+from parkingApp.db import lot_scope, operation_scope
+from parkingApp.documents import get_persisted_query, parse_and_validate, persist_query, query_hash
+from parkingApp.events import broker
+from parkingApp.ingest import ingest_events
+from parkingApp.lots import kiosk_lot, kiosk_pk
+from parkingApp.metrics import registry, trace_operation, tracing_requested
+from parkingApp.occupancy import total_occupancy
+
+
+def _place_upload(operations, path, uploaded_file):
+    # Walk "variables.input.entryPhotoFile" (or "0.variables..." for batches)
+    # and replace the null placeholder with the uploaded file.
+    target = operations
+    keys = path.split(".")
+    for key in keys[:-1]:
+        target = target[int(key)] if isinstance(target, list) else target[key]
+    last = keys[-1]
+    if isinstance(target, list):
+        target[int(last)] = uploaded_file
+    else:
+        target[last] = uploaded_file
+
+
+class FileUploadGraphQLView(GraphQLView):
+    # Implements the GraphQL multipart request spec
+    # (https://github.com/jaydenseric/graphql-multipart-request-spec).
+    # Files are parsed by Django's upload handlers, which spill anything above
+    # FILE_UPLOAD_MAX_MEMORY_SIZE to a temporary file, so photos never have to
+    # be held in memory as one base64 string.
+    #
+    # Also serves Automatic Persisted Queries and reuses parsed documents,
+    # see parkingApp/documents.py. Requests pass admission control and the
+    # depth and cost limits first (parkingApp/admission.py).
+    _schema_validated = False
+    validation_rules = VALIDATION_RULES
+
+    def dispatch(self, request, *args, **kwargs):
+        with admission.admit(request) as rejection:
+            if rejection is not None:
+                return rejection
+            return super().dispatch(request, *args, **kwargs)
+
+    def parse_body(self, request):
+        content_type = self.get_content_type(request)
+        if content_type != "multipart/form-data" or "operations" not in request.POST:
+            return super().parse_body(request)
+
+        try:
+            operations = json.loads(request.POST["operations"])
+            files_map = json.loads(request.POST.get("map") or "{}")
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest("Invalid multipart 'operations' or 'map' field."))
+
+        for key, paths in files_map.items():
+            uploaded_file = request.FILES.get(key)
+            if uploaded_file is None:
+                raise HttpError(HttpResponseBadRequest(f"File '{key}' is missing from the request."))
+            for path in paths:
+                try:
+                    _place_upload(operations, path, uploaded_file)
+                except (KeyError, IndexError, ValueError, TypeError):
+                    raise HttpError(HttpResponseBadRequest(f"Invalid file path '{path}' in 'map'."))
+        return operations
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        persisted = (extensions or {}).get("persistedQuery")
+        if not persisted:
+            return query, variables, operation_name, id
+
+        sha256_hash = persisted.get("sha256Hash")
+        if persisted.get("version") != 1 or not sha256_hash:
+            raise HttpError(HttpResponseBadRequest("Unsupported persistedQuery extension."))
+        if query:
+            # First request for this operation: register it
+            if query_hash(query) != sha256_hash:
+                raise HttpError(HttpResponseBadRequest("provided sha does not match query"))
+            persist_query(sha256_hash, query)
+            return query, variables, operation_name, id
+
+        query = get_persisted_query(sha256_hash)
+        if query is None:
+            # Apollo clients retry with the full query on this message
+            raise HttpError(HttpResponse(), message="PersistedQueryNotFound")
+        return query, variables, operation_name, id
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        # Same as GraphQLView.execute_graphql_request, but the schema is only
+        # validated once, documents come from the parsed-document cache and
+        # the operation runs inside its operation_scope (parkingApp/db.py).
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+        if not FileUploadGraphQLView._schema_validated:
+            schema_validation_errors = validate_schema(schema)
+            if schema_validation_errors:
+                return ExecutionResult(data=None, errors=schema_validation_errors)
+            FileUploadGraphQLView._schema_validated = True
+
+        try:
+            document, validation_errors = parse_and_validate(
+                schema, query, self.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS
+            )
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    f"Can only perform a {operation_ast.operation.value} operation from a POST request.",
+                )
+            )
+
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            operation = operation_ast.operation.value if operation_ast is not None else None
+            name = operation_ast.name.value if operation_ast is not None and operation_ast.name else operation_name
+            with operation_scope(operation), trace_operation(operation, name, tracing_requested(request)) as trace:
+                request.graphql_trace = trace
+                if not self.batch:
+                    trace.request_bytes = int(request.META.get("CONTENT_LENGTH") or 0)
+                if (
+                    operation_ast is not None
+                    and operation_ast.operation == OperationType.MUTATION
+                    and (
+                        graphene_settings.ATOMIC_MUTATIONS is True
+                        or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                    )
+                ):
+                    with transaction.atomic():
+                        result = execute(schema, document, **execute_options)
+                        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                            transaction.set_rollback(True)
+                else:
+                    result = execute(schema, document, **execute_options)
+                trace.failed = bool(result.errors)
+                return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+    def get_response(self, request, data, show_graphiql=False):
+        result, status_code = super().get_response(request, data, show_graphiql)
+        trace = request.__dict__.pop("graphql_trace", None)  # One per operation of a batch
+        if trace is not None and result is not None:
+            registry.add_response_bytes(trace, len(result))
+            if trace.tracing:
+                response = json.loads(result)
+                response.setdefault("extensions", {})["tracing"] = trace.tracing_extension()
+                result = self.json_encode(request, response, pretty=show_graphiql)
+        return result, status_code
+
+
+_execution_slots = None
+
+
+def execution_slots():
+    # Created lazily so it binds to the server's event loop
+    global _execution_slots
+    if _execution_slots is None:
+        _execution_slots = asyncio.Semaphore(getattr(settings, "GRAPHQL_ASYNC_MAX_CONCURRENCY", 64))
+    return _execution_slots
+
+
+class AsyncGraphQLView(FileUploadGraphQLView):
+    # Served under ASGI: the request body, including slow photo uploads, is
+    # received on the event loop without holding a thread. The resolvers and
+    # graphene-django types are synchronous, so the operation itself runs in
+    # the request's sync thread, and at most GRAPHQL_ASYNC_MAX_CONCURRENCY
+    # operations run at once; the rest wait on the event loop.
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Admitted before waiting for a slot, so the wait counts as in flight
+        with admission.admit(request) as rejection:
+            if rejection is not None:
+                return rejection
+            async with execution_slots():
+                return await sync_to_async(super(FileUploadGraphQLView, self).dispatch)(request, *args, **kwargs)
+
+
+def _sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamView(View):
+    # Server-sent events for dashboards: the current occupancy on connect and
+    # as a heartbeat, then every entry/exit/payment event as it is published.
+    # Under ASGI each stream is a coroutine; under WSGI it holds a thread.
+    heartbeat_seconds = 15
+
+    def get(self, request):
+        stream = self.astream() if isinstance(request, ASGIRequest) else self.stream()
+        response = StreamingHttpResponse(stream, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Do not let nginx buffer the stream
+        return response
+
+    def stream(self):
+        subscription = broker.subscribe()
+        try:
+            yield _sse("occupancy", {"occupancy": total_occupancy()})
+            while not subscription.closed:
+                event = subscription.get(timeout=self.heartbeat_seconds)
+                if event is None:
+                    yield _sse("occupancy", {"occupancy": total_occupancy()})
+                else:
+                    yield _sse(event["type"], event)
+        finally:
+            subscription.close()
+
+    async def astream(self):
+        subscription = broker.subscribe()
+        subscription.bind_loop(asyncio.get_running_loop(), asyncio.Queue())
+        try:
+            yield _sse("occupancy", {"occupancy": await sync_to_async(total_occupancy)()})
+            while not subscription.closed:
+                event = await subscription.aget(timeout=self.heartbeat_seconds)
+                if event is None:
+                    yield _sse("occupancy", {"occupancy": await sync_to_async(total_occupancy)()})
+                else:
+                    yield _sse(event["type"], event)
+        finally:
+            subscription.close()
+
+
+class IngestView(View):
+    # NDJSON version of the ingestEvents mutation for gates replaying a large
+    # backlog: one event per line in, one result per line out. Blank lines
+    # are skipped, so result indexes count events, not lines. The kiosk
+    # (X-Kiosk-Id header or kiosk_id parameter) is recorded like the
+    # mutation's kioskId and routes the batch to its lot's database.
+    def post(self, request):
+        events = []
+        for number, line in enumerate(request.body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                return HttpResponseBadRequest(f"Line {number} is not valid JSON.")
+        try:
+            kiosk_id = kiosk_pk(request.headers.get("X-Kiosk-Id") or request.GET.get("kiosk_id"))
+            with lot_scope(kiosk_lot(kiosk_id) if kiosk_id is not None else None):
+                results = ingest_events(events, request.headers.get("Idempotency-Key"), kiosk_id)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        body = "".join(json.dumps(result) + "\n" for result in results)
+        return HttpResponse(body, content_type="application/x-ndjson")
+
+
+class MetricsView(View):
+    # Prometheus scrape endpoint (parkingApp/metrics.py); only answers the
+    # addresses in METRICS_ALLOWED_IPS, e.g. a scraper on the same host
+    def get(self, request):
+        if request.META.get("REMOTE_ADDR") not in getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"]):
+            return HttpResponseForbidden()
+        return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parkingpayBE.settings')
+# Persistent connections are per thread, and under ASGI every request's sync
+# code may run on a different thread, so connections would pile up; use the
+# pool unless DATABASE_PROFILE says otherwise
+os.environ.setdefault('DATABASE_PROFILE', 'pool')
 
 application = get_asgi_application()
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -56,8 +60,54 @@ MIDDLEWARE = [
 
 GRAPHENE = {
     'SCHEMA': 'parkingApp.schema.schema',  
+    'MIDDLEWARE': [
+        'parkingApp.db.MutationAtomicMiddleware',  # One transaction per top-level mutation
+        'parkingApp.db.LotRoutingMiddleware',  # Sends operations naming a lot to its database
+        'parkingApp.metrics.InstrumentationMiddleware',  # Last, so it wraps the others
+    ],
+}
+
+# GraphQL metrics on /metrics (parkingApp/metrics.py)
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+GRAPHQL_SLOW_QUERY_MS = 200  # Log SQL statements slower than this...
+GRAPHQL_SLOW_OPERATION_MS = 1000  # ...and operations slower than this
+GRAPHQL_SLOW_LOG_SAMPLE_RATE = 0.1  # Share of slow statements/operations that are logged
+GRAPHQL_TRACING = DEBUG  # Honour "X-GraphQL-Tracing: 1" with an extensions.tracing block
+
+# GraphQL operations executing at once under ASGI (/graphql/async/); further
+# requests wait on the event loop instead of each holding a thread
+GRAPHQL_ASYNC_MAX_CONCURRENCY = 64
+
+# Admission control on the GraphQL endpoints (parkingApp/admission.py); the
+# limits apply per worker process
+GRAPHQL_MAX_BODY_SIZE = 10 * 1024 * 1024  # Bytes, photos included (413 above)
+GRAPHQL_RATE_LIMIT_RATE = 20  # Requests per second per client (429 above)...
+GRAPHQL_RATE_LIMIT_BURST = 40  # ...with bursts up to this many
+GRAPHQL_RATE_LIMIT_CLIENT_HEADER = None  # e.g. 'X-Kiosk-Id' if a trusted proxy sets it; else the client address
+GRAPHQL_MAX_IN_FLIGHT = 128  # Requests in progress before new ones get a fast 503
+GRAPHQL_MAX_QUERY_DEPTH = 10
+GRAPHQL_MAX_QUERY_COST = 5000
+GRAPHQL_LIST_COST_SIZE = 10  # Assumed length of lists without a page size argument
+GRAPHQL_MAX_TOKENS = 5000  # Longer documents are refused by the parser
+
+# Pub/sub for the /events/ stream; use 'parkingApp.events.RedisBroker' with
+# EVENT_BROKER_URL when running more than one process
+EVENT_BROKER = 'parkingApp.events.LocalBroker'
+EVENT_BROKER_URL = 'redis://localhost:6379/0'
+
+# PostgreSQL statement timeout (ms) per GraphQL operation type; None leaves the
+# server default and saves the two SET round-trips per request
+GRAPHQL_STATEMENT_TIMEOUTS = {
+    'query': None,
+    'mutation': None,
 }
 
+# Parsed and validated GraphQL documents kept per process (0 disables the cache)
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+# How long Automatic Persisted Queries stay registered in the cache (None = forever)
+GRAPHQL_PERSISTED_QUERY_TIMEOUT = None
+GRAPHQL_PERSISTED_QUERY_CACHE_ALIAS = 'persisted_queries'  # Shared by the workers, see CACHES below
+
 ROOT_URLCONF = 'parkingpayBE.urls'
 
 TEMPLATES = [
@@ -82,16 +132,84 @@ WSGI_APPLICATION = 'parkingpayBE.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'parkingpaymentdb',
-        'USER': 'postgres',
-        'PASSWORD': '0113',
-        'HOST': 'localhost',  
-        'PORT': '5432',
+# DATABASE_PROFILE picks how connections are made:
+#   'persistent'  one connection per worker thread, reused for
+#                 DATABASE_CONN_MAX_AGE seconds and health-checked before each
+#                 request; the default under WSGI
+#   'pool'        psycopg 3 connection pool (pip install "psycopg[pool]"); the
+#                 default under ASGI (parkingpayBE/asgi.py), where requests do
+#                 not keep to one thread
+#   'sqlite'      local SQLite file for development and tests
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'persistent')
+
+if DATABASE_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            # The photo and employee workers write from their own threads;
+            # wait for the write lock instead of failing with "database is locked"
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'parkingpaymentdb'),
+            'USER': os.environ.get('DATABASE_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', '0113'),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'OPTIONS': {},
+        }
+    }
+    if DATABASE_PROFILE == 'pool':
+        # Each worker process gets its own pool, so split the connections the
+        # server allows us (DATABASE_MAX_CONNECTIONS) between WEB_CONCURRENCY
+        # workers unless DATABASE_POOL_MAX_SIZE says otherwise
+        _workers = max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+        _pool_max = int(os.environ.get(
+            'DATABASE_POOL_MAX_SIZE', max(int(os.environ.get('DATABASE_MAX_CONNECTIONS', 40)) // _workers, 2)
+        ))
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': min(int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)), _pool_max),
+            'max_size': _pool_max,
+            'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),  # Seconds to wait for a free connection
+            'max_idle': 300,
+        }
+    elif DATABASE_PROFILE == 'persistent':
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    else:
+        raise ImproperlyConfigured(f"Unknown DATABASE_PROFILE {DATABASE_PROFILE!r}.")
+
+# Optional read replica for GraphQL queries (see parkingApp/db.py)
+if os.environ.get('DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['DATABASE_REPLICA_HOST'],
+        'TEST': {'MIRROR': 'default'},
     }
-}
+
+# Optional databases for lot groups (see parkingApp/lots.py).
+# DATABASE_LOT_HOSTS names each group's server, e.g. "east=db-east,west=db-west",
+# and LOT_GROUPS puts kiosk locations in a group, e.g. "Central=east,Airport=west".
+# Lots not listed stay on the default database. With the 'sqlite' profile each
+# group gets its own file instead (the host is ignored), which is enough to
+# run the multi-database tests.
+def _env_pairs(name):
+    return dict(item.strip().split('=', 1) for item in os.environ.get(name, '').split(',') if '=' in item)
+
+for _group, _host in _env_pairs('DATABASE_LOT_HOSTS').items():
+    DATABASES[f'lot_{_group}'] = {**DATABASES['default'], 'HOST': _host}
+    if DATABASE_PROFILE == 'sqlite':
+        DATABASES[f'lot_{_group}']['NAME'] = BASE_DIR / f'db_{_group}.sqlite3'
+LOT_DATABASES = {_lot: f'lot_{_group}' for _lot, _group in _env_pairs('LOT_GROUPS').items()}
+if set(LOT_DATABASES.values()) - set(DATABASES):
+    raise ImproperlyConfigured("LOT_GROUPS names a group without a host in DATABASE_LOT_HOSTS.")
+
+DATABASE_ROUTERS = ['parkingApp.db.LotRouter', 'parkingApp.db.ReadReplicaRouter']
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -124,6 +242,78 @@ AUTH_PASSWORD_VALIDATORS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media serving (parkingApp/media.py). Versioned URLs (?v=<hash>) are cached
+# for a year; set MEDIA_SENDFILE to 'x-sendfile' or 'x-accel-redirect' to let
+# the front proxy send the files.
+MEDIA_CACHE_MAX_AGE = 300
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_PUBLIC_DIRS = ['payment_qrs/', 'payment_logos/']  # Served to everyone; car photos only to staff users
+
+# Cache for hot read queries (parkingApp/resolver_cache.py). Set REDIS_URL to
+# share it between workers; with the per-process LocMemCache another worker's
+# copy can be stale for up to the field's timeout.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Query texts registered through Automatic Persisted Queries have to be seen
+# by every worker, or a hash registered on one is unknown to the others: Redis
+# when REDIS_URL is set, otherwise files shared by the workers on this host.
+# A lost entry only costs the client one retry with the full query.
+CACHES['persisted_queries'] = {**CACHES['default'], 'KEY_PREFIX': 'apq'} if os.environ.get('REDIS_URL') else {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.environ.get('PERSISTED_QUERY_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'parkingpay-apq')),
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+RESOLVER_CACHE_ENABLED = True
+RESOLVER_CACHE_ALIAS = 'default'
+RESOLVER_CACHE_TIMEOUT = 300
+RESOLVER_CACHE_TIMEOUTS = {
+    'allTariffs': 300,
+    'allPaymentMethods': 300,
+    'carDetails': 60,
+}
+RESOLVER_CACHE_LOCK_WAIT = 2.0
+
+# Tariffs used by the fee engine are cached per process (parkingApp/fees.py)
+TARIFF_CACHE_TTL = 60  # Seconds before reloading changes made by other processes
+
+# Multipart photo uploads above this size are spooled to a temporary file
+# instead of being kept in memory.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+
+# Background photo pipeline (parkingApp/photos.py)
+PHOTO_PIPELINE_ASYNC = True  # False writes photos on commit in the request thread
+PHOTO_PIPELINE_WORKERS = 2
+PHOTO_QUEUE_SIZE = 200  # Back-pressure: a full queue makes the request process its own photo
+PHOTO_QUEUE_PUT_TIMEOUT = 0.05  # Seconds to wait for a free queue slot
+PHOTO_JPEG_QUALITY = 80
+PHOTO_THUMBNAIL_SIZE = (320, 240)
+
+# Bulk replay of events buffered by offline gates and kiosks (parkingApp/ingest.py)
+INGEST_MAX_EVENTS = 5000
+
+# Employee cars open the gate from an in-memory allowlist; their sessions are
+# written in batches (parkingApp/employees.py)
+EMPLOYEE_FAST_PATH = True
+EMPLOYEE_ALLOWLIST_TTL = 60  # Seconds before reloading changes made by other processes
+EMPLOYEE_SESSION_ASYNC = True  # False writes the session on commit in the request thread
+EMPLOYEE_SESSION_BATCH_SIZE = 200
+EMPLOYEE_SESSION_FLUSH_INTERVAL = 1.0  # Seconds
+
+# Where archive_partitions writes old months of sessions and payments (parkingApp/archive.py)
+PARTITION_ARCHIVE_DIR = BASE_DIR / 'archive'
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -15,14 +15,21 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
-from graphene_django.views import GraphQLView
+from django.urls import path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.views.decorators.csrf import csrf_exempt  # Import csrf_exempt
+from parkingApp.media import serve_media
+from parkingApp.views import AsyncGraphQLView, EventStreamView, FileUploadGraphQLView, IngestView, MetricsView
 from schema import schema
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("graphql/", csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True, schema=schema))),
+    # Same schema for gates and kiosks served by an ASGI server (parkingpayBE/asgi.py)
+    path("graphql/async/", csrf_exempt(AsyncGraphQLView.as_view(schema=schema))),
+    path("events/", EventStreamView.as_view()),  # Live entries/exits/payments for dashboards
+    path("ingest/", csrf_exempt(IngestView.as_view())),  # NDJSON backlog replay from offline gates
+    path("metrics", MetricsView.as_view()),  # Prometheus scrape endpoint, local addresses only
+    # QR codes, logos and photos with ETag/Cache-Control; see parkingApp/media.py
+    re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.+)$", serve_media),
+]
@@ -1,18 +1,63 @@
-from django.db import transaction
+from django.db import IntegrityError, transaction
 import traceback
+from itertools import islice
 from django.db.models import Q
 import graphene
 from parkingApp.models import *
 from django.core.files.storage import default_storage
 from graphene_django import DjangoObjectType
 from graphene import Mutation
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+from graphene.types.schema import normalize_execute_kwargs
+from graphql import ExecutionResult, GraphQLError, execute_sync, get_operation_ast
 import logging
-import re
 import base64
-from django.core.files.base import ContentFile
+from django.utils import timezone
+from parkingApp import idempotency
+from parkingApp.admission import VALIDATION_RULES
+from parkingApp.archive import archived_months, archived_rows
+from parkingApp.db import connection_stats, current_database, operation_scope
+from parkingApp.documents import parse_and_validate
+from parkingApp.employees import on_fast_path, recorder as employee_recorder
+from parkingApp.fees import quote_fee
+from parkingApp.ingest import ingest_events
+from parkingApp.lots import kiosk_pk, lot_kiosks
+from parkingApp.media import versioned_url
+from parkingApp.metrics import trace_operation
+from parkingApp.occupancy import current_occupancy, total_occupancy
+from parkingApp.optimizer import optimize_queryset
+from parkingApp.pagination import keyset_connection
+from parkingApp.photos import pipeline, submit_photo
+from parkingApp.plate_search import search_by_prefix, search_fuzzy
+from parkingApp.plates import INVALID_PLATE_MESSAGE, is_plate_prefix, is_plate_query, is_valid_plate, normalize_plate, plate_filter
+from parkingApp.resolver_cache import cached_resolver, car_details_key
+from parkingApp.rollups import occupancy_report, revenue_report
 
 logger = logging.getLogger("main")
 
+MAX_ARCHIVED_ROWS = 1000
+
+class Upload(graphene.Scalar):
+    # File sent through the GraphQL multipart request spec, see
+    # parkingApp.views.FileUploadGraphQLView. The value is a Django UploadedFile.
+    @staticmethod
+    def serialize(value):
+        return value
+
+    @staticmethod
+    def parse_literal(node, _variables=None):
+        return node
+
+    @staticmethod
+    def parse_value(value):
+        return value
+
+class KioskType(DjangoObjectType):
+    class Meta:
+        model = Kiosk
+        fields = ("id", "location", "status")
+
 class ParkingSessionType(DjangoObjectType):
     class Meta:
         model = ParkingSession
@@ -22,6 +67,15 @@ class PaymentType(DjangoObjectType):
         model = Payment
 
 
+class PaymentConnection(graphene.relay.Connection):
+    class Meta:
+        node = PaymentType
+
+class ParkingSessionConnection(graphene.relay.Connection):
+    class Meta:
+        node = ParkingSessionType
+
+
 class CarType(DjangoObjectType):
     parking_sessions = graphene.List(ParkingSessionType)
 
@@ -36,54 +90,155 @@ class TariffType(DjangoObjectType):
         model = Tariff
 
 class PaymentMethodType(DjangoObjectType):
+    # qr and logo are storage names; the URLs carry a content hash and can be
+    # cached by kiosks and CDNs until the image changes (parkingApp/media.py)
+    qr_url = graphene.String()
+    logo_url = graphene.String()
+
     class Meta:
         model = PaymentMethod
 
+    def resolve_qr_url(self, info):
+        return versioned_url(self.qr)
+
+    def resolve_logo_url(self, info):
+        return versioned_url(self.logo)
+
+class PhotoQueueStatsType(graphene.ObjectType):
+    depth = graphene.Int()
+    capacity = graphene.Int()
+    max_depth = graphene.Int()
+    processed = graphene.Int()
+    failed = graphene.Int()
+    overflowed = graphene.Int()
+
+class ConnectionStatsType(graphene.ObjectType):
+    alias = graphene.String()
+    mode = graphene.String()  # "pool", "persistent" or "per-request"
+    connections_opened = graphene.Int()
+    # Pool mode only
+    pool_size = graphene.Int()
+    pool_available = graphene.Int()
+    requests = graphene.Int()
+    requests_waiting = graphene.Int()
+    wait_ms = graphene.Float()  # Total time requests waited for a connection
+    average_wait_ms = graphene.Float()
+    timeouts = graphene.Int()
+
+class ReportPeriod(graphene.Enum):
+    DAY = "day"
+    MONTH = "month"
+
+class RevenueReportRowType(graphene.ObjectType):
+    period = graphene.Date()  # The day, or the first day of the month
+    payment_method_id = graphene.ID()  # Only with byPaymentMethod
+    is_employee_vehicle = graphene.Boolean()  # Only with byEmployee
+    payments = graphene.Int()
+    amount = graphene.Decimal()
+    average_duration = graphene.Float()  # Minutes
+
+class OccupancyReportRowType(graphene.ObjectType):
+    period = graphene.Date()
+    entries = graphene.Int()
+    exits = graphene.Int()
+    peak_occupancy = graphene.Int()
+
 class CreatePaymentInput(graphene.InputObjectType):
     session_id = graphene.Int(required=True)
     payment_method_id = graphene.Int(required=True)
 
 class SavePaymentInput(graphene.InputObjectType):
     car_plate = graphene.String(required=True)
-    duration = graphene.Int(required=True)
-    amount = graphene.Float(required=True)
+    duration = graphene.Int()  # Ignored, the server computes the duration
+    amount = graphene.Float()  # Ignored, the server computes the fee
     payment_time = graphene.DateTime(required=True)
+    idempotency_key = graphene.String()  # Same key on every retry of one payment
+    kiosk_id = graphene.ID()  # Kiosk taking the payment; defaults to the session's kiosk
+
+class FeeQuoteType(graphene.ObjectType):
+    car_plate = graphene.String()
+    entry_time = graphene.DateTime()
+    duration = graphene.Int()  # Minutes parked so far
+    amount = graphene.Decimal()
+    is_within_free_period = graphene.Boolean()
+    is_employee_vehicle = graphene.Boolean()
+def read_photo(photo_file, photo_base64):
+    # Multipart upload if there is one, else the decoded base64 fallback
+    if photo_file is not None:
+        return photo_file
+    if photo_base64:
+        try:
+            return base64.b64decode(photo_base64)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid Base64-encoded image.")
+    return None
+
+def lock_active_session(car_plate):
+    # Held until the mutation's transaction ends, so a concurrent payment or
+    # exit for the same car waits instead of acting on a stale session
+    return (
+        ParkingSession.objects.select_for_update(of=("self",))
+        .select_related("car__employee")
+        .filter(plate_filter(car_plate, "car__"), exit_time__isnull=True)
+        .first()
+    )
+
 # Input for the mutation
 class CreateEntryCarInput(graphene.InputObjectType):
     car_plate = graphene.String(required=True)
-    entry_photo = graphene.String(required=True)  # Assume Base64-encoded entry_photo
+    entry_photo = graphene.String()  # Base64-encoded entry_photo, fallback for clients without multipart
+    entry_photo_file = Upload()  # Multipart upload, streamed to storage in chunks
+    kiosk_id = graphene.ID()  # Gate kiosk; the session belongs to its lot
 
 class CreateEntryCarMutation(graphene.Mutation):
     class Arguments:
         input = CreateEntryCarInput(required=True)
 
-    car = graphene.Field(CarType)
+    car = graphene.Field(CarType)  # Null for employee cars, which are recorded in the background
     parking_session = graphene.Field(ParkingSessionType)
+    gate_open = graphene.Boolean()
 
     def mutate(self, info, input):
         car_plate = input["car_plate"]
-        entry_photo = input["entry_photo"]
-
-        # Validate car_plate format
-        if not re.match(r"^\d{4}$", car_plate):  # Only validate the first 4 digits
-            raise ValueError("Машины дугаарын формат буруу байна. 4 оронтой тоо байх ёстой.")
+        entry_photo = input.get("entry_photo")
+        entry_photo_file = input.get("entry_photo_file")
+
+        # Validate car_plate format: 4 digits, optionally followed by up to 3 letters
+        if not is_valid_plate(car_plate):
+            raise ValueError(INVALID_PLATE_MESSAGE)
+        car_plate = normalize_plate(car_plate)
+        kiosk_id = kiosk_pk(input.get("kiosk_id"))
+
+        # Employee cars get the gate without a database round-trip; the
+        # session is written later in a batch (parkingApp/employees.py)
+        if on_fast_path(car_plate):
+            employee_recorder.record("entry", car_plate, timezone.now(), kiosk_id)
+            return CreateEntryCarMutation(car=None, parking_session=None, gate_open=True)
+
+        photo = read_photo(entry_photo_file, entry_photo)
+        if photo is None:
+            raise ValueError("Entry photo is required.")
+
+        # Save Car; legacy rows can share a normalized plate, the oldest wins
+        # like everywhere else. A concurrent insert of the same plate is
+        # caught by car_plate's unique constraint inside get_or_create
+        car = Car.objects.filter(plate_filter(car_plate)).order_by("pk").first()
+        if car is None:
+            car, _ = Car.objects.get_or_create(car_plate=car_plate)
+
+        # Create Parking Session; the one_active_session_per_car constraint
+        # rejects a second open session, even from a concurrent request
         try:
-            decoded_image = base64.b64decode(entry_photo)
-        except (TypeError, ValueError):
-            raise ValueError("Invalid Base64-encoded image.")
-        
-        # Save Car
-        car, created = Car.objects.get_or_create(car_plate=car_plate)
-        car.entry_photo.save(f"{car_plate}_entry.jpg", ContentFile(decoded_image))
-
-        # Check for active sessions
-        if ParkingSession.objects.filter(car=car, exit_time__isnull=True).exists():
+            with transaction.atomic(using=current_database()):
+                parking_session = ParkingSession.objects.create(car=car, kiosk_id=kiosk_id)
+        except IntegrityError:
             raise ValueError("This car already has an active session.")
-        
-        # Create Parking Session
-        parking_session = ParkingSession.objects.create(car=car)
 
-        return CreateEntryCarMutation(car=car, parking_session=parking_session)
+        # The photo is written, compressed and attached by the background
+        # pipeline after the transaction commits
+        submit_photo([(parking_session, "entry_photo"), (car, "entry_photo")], photo)
+
+        return CreateEntryCarMutation(car=car, parking_session=parking_session, gate_open=True)
 
 # Mutation for saving payment
 from decimal import Decimal
@@ -98,86 +253,372 @@ class SavePayment(graphene.Mutation):
 
     @staticmethod
     def mutate(root, info, input):
+        key = input.get("idempotency_key")
         try:
-            # Retrieve the car and its session
-            car = Car.objects.get(car_plate=input.car_plate)
-            last_session = car.parkingsession_set.order_by('-entry_time').first()
-
-            if not last_session:
-                return SavePayment(success=False, message="No active parking session found.", payment=None)
-
-            # Convert the amount to a Decimal
-            amount = Decimal(str(input.amount))  # Ensure amount is a Decimal
-
-            # Ensure that the Payment model has these fields
-            payment = Payment.objects.create(
-                car=car,
-                parking_session=last_session,  # Use 'session' instead of 'parking_session'
-                amount=amount,  # Set the amount as a Decimal
-                payment_time=input.payment_time,
-                duration=input.duration,
-            )
+            kiosk_id = kiosk_pk(input.get("kiosk_id"))
+            with transaction.atomic(using=current_database()):
+                if key:
+                    request = {name: value for name, value in input.items() if name != "idempotency_key"}
+                    stored = idempotency.claim("savePayment", key, request)
+                    if stored is not None:
+                        # Retry of a payment that already went through
+                        payment = Payment.objects.filter(pk=stored["payment_id"]).first()
+                        return SavePayment(success=True, message=stored["message"], payment=payment)
+
+                car = Car.objects.filter(plate_filter(input.car_plate)).order_by("pk").first()
+                if car is None:
+                    raise Car.DoesNotExist
+                session = lock_active_session(car.car_plate)
+                if not session:
+                    raise ValueError("No active parking session found.")
+                if session.paid_status:
+                    raise ValueError("This parking session is already paid.")
+
+                # Quoted up to the recorded payment time; the kiosk's amount is
+                # only used to spot out-of-date kiosks
+                quote = quote_fee(session, input.payment_time)
+                if input.amount is not None and Decimal(str(input.amount)) != quote.amount:
+                    logger.warning(
+                        f"Kiosk amount {input.amount} for {car.car_plate} differs from the computed fee {quote.amount}"
+                    )
+
+                payment = Payment.objects.create(
+                    car=car,
+                    parking_session=session,
+                    amount=quote.amount,
+                    payment_time=input.payment_time,
+                    duration=quote.duration,
+                    status="paid",
+                    is_within_free_period=quote.is_within_free_period,
+                    is_employee_vehicle=quote.is_employee_vehicle,
+                    kiosk_id=kiosk_id or session.kiosk_id,
+                )
+                session.paid_status = True
+                session.save(update_fields=["paid_status"])
 
-            return SavePayment(success=True, message="Payment saved successfully.", payment=payment)
+                message = "Payment saved successfully."
+                if key:
+                    idempotency.record("savePayment", key, {"payment_id": payment.pk, "message": message})
+                return SavePayment(success=True, message=message, payment=payment)
         except Car.DoesNotExist:
             return SavePayment(success=False, message="Car not found.", payment=None)
+        except ValueError as e:
+            return SavePayment(success=False, message=str(e), payment=None)
         except Exception as e:
             return SavePayment(success=False, message=f"Error: {str(e)}", payment=None)
 
+class ExitCarInput(graphene.InputObjectType):
+    car_plate = graphene.String(required=True)
+    exit_photo = graphene.String()  # Base64-encoded exit photo, fallback for clients without multipart
+    exit_photo_file = Upload()
+    idempotency_key = graphene.String()  # Same key on every retry of one exit
+    kiosk_id = graphene.ID()  # Exit gate kiosk; routes the exit to its lot
+
+class ExitCarMutation(graphene.Mutation):
+    # Verifies payment, closes the session and opens the gate in one
+    # transaction; the occupancy counter and the exit event follow from the
+    # session's exit_time (parkingApp/signals.py).
+    class Arguments:
+        input = ExitCarInput(required=True)
+
+    parking_session = graphene.Field(ParkingSessionType)
+    gate_open = graphene.Boolean()
+    message = graphene.String()
+
+    def mutate(self, info, input):
+        if on_fast_path(input["car_plate"]):
+            # Employee cars never pay; the exit is recorded in the background
+            kiosk_id = kiosk_pk(input.get("kiosk_id"))
+            employee_recorder.record("exit", normalize_plate(input["car_plate"]), timezone.now(), kiosk_id)
+            return ExitCarMutation(parking_session=None, gate_open=True, message="Gate opened.")
+
+        key = input.get("idempotency_key")
+        photo = read_photo(input.get("exit_photo_file"), input.get("exit_photo"))
+
+        with transaction.atomic(using=current_database()):
+            if key:
+                # The photo is not part of it; a retry may send a new one
+                stored = idempotency.claim("exitCar", key, {"car_plate": input["car_plate"], "kiosk_id": input.get("kiosk_id")})
+                if stored is not None:
+                    session = ParkingSession.objects.filter(pk=stored["session_id"]).first()
+                    return ExitCarMutation(parking_session=session, gate_open=True, message=stored["message"])
+
+            session = lock_active_session(input["car_plate"])
+            if session is None:
+                raise ValueError("No active parking session found.")
+
+            if not session.paid_status and quote_fee(session).amount > 0:
+                if key:
+                    idempotency.release("exitCar", key)
+                return ExitCarMutation(parking_session=session, gate_open=False, message="Payment required.")
+
+            session.exit_time = timezone.now()
+            session.save(update_fields=["exit_time"])
+            if photo is not None:
+                submit_photo([(session, "exit_photo")], photo)
+
+            message = "Gate opened."
+            if key:
+                idempotency.record("exitCar", key, {"session_id": session.pk, "message": message})
+            return ExitCarMutation(parking_session=session, gate_open=True, message=message)
+
+class GateEventInput(graphene.InputObjectType):
+    type = graphene.String(required=True)  # "entry", "payment" or "exit"
+    car_plate = graphene.String(required=True)
+    time = graphene.DateTime()  # When it happened at the gate; defaults to now
+
+class IngestResultType(graphene.ObjectType):
+    index = graphene.Int()  # Position of the event in the batch
+    ok = graphene.Boolean()
+    message = graphene.String()
+    parking_session_id = graphene.ID()
+    payment_id = graphene.ID()
+
+class IngestEventsMutation(graphene.Mutation):
+    # Replays a backlog buffered while a gate or kiosk was offline; photos
+    # are not part of the batch. See parkingApp/ingest.py.
+    class Arguments:
+        events = graphene.List(graphene.NonNull(GateEventInput), required=True)
+        idempotency_key = graphene.String()  # Same key on every retry of one batch
+        kiosk_id = graphene.ID()  # Kiosk that buffered the events
+
+    results = graphene.List(IngestResultType)
+
+    def mutate(self, info, events, idempotency_key=None, kiosk_id=None):
+        results = ingest_events([dict(event) for event in events], idempotency_key, kiosk_pk(kiosk_id))
+        return IngestEventsMutation(results=[IngestResultType(**result) for result in results])
+
+def archived_query(model, month, car_plate, limit):
+    filters = {}
+    if car_plate:
+        car = Car.objects.filter(plate_filter(car_plate)).order_by("pk").first()
+        if car is None:
+            return []
+        filters["car_id"] = car.pk
+    rows = archived_rows(model, month.replace(day=1), **filters)
+    return list(islice(rows, min(limit, MAX_ARCHIVED_ROWS)))
+
 class Query(graphene.ObjectType):
-    all_parking_sessions = graphene.List(ParkingSessionType)
-    all_payments = graphene.List(PaymentType)
+    all_parking_sessions = graphene.relay.ConnectionField(
+        ParkingSessionConnection,
+        from_time=graphene.DateTime(),  # entry_time >= from_time
+        to_time=graphene.DateTime(),  # entry_time < to_time
+        active=graphene.Boolean(),  # Sessions without an exit time
+        paid_status=graphene.Boolean(),
+        car_plate=graphene.String(),
+        lot=graphene.String(),  # Kiosk location
+    )
+    all_payments = graphene.relay.ConnectionField(
+        PaymentConnection,
+        from_time=graphene.DateTime(),  # payment_time >= from_time
+        to_time=graphene.DateTime(),  # payment_time < to_time
+        status=graphene.String(),
+        car_plate=graphene.String(),
+        lot=graphene.String(),
+    )
     all_tariffs = graphene.List(TariffType)
     all_payment_methods = graphene.List(PaymentMethodType)
+    # Kiosks name themselves (kioskId) so the lookup reads their lot's database
     search_car_by_plate = graphene.Field(
         CarType,
         car_plate=graphene.String(required=True),
+        kiosk_id=graphene.ID(),
+    )
+    search_cars_by_plate = graphene.List(
+        CarType,
+        car_plate=graphene.String(required=True),
+        fuzzy=graphene.Boolean(default_value=False),  # Tolerate ANPR misreads such as 0/O and 8/B
+        limit=graphene.Int(default_value=10),
+        kiosk_id=graphene.ID(),
     )
     car_details = graphene.Field(
         CarType,
         car_plate=graphene.String(required=True),
+        kiosk_id=graphene.ID(),
+    )
+    photo_queue_stats = graphene.Field(PhotoQueueStatsType)
+    database_connection_stats = graphene.List(ConnectionStatsType)
+    occupancy = graphene.Int(lot=graphene.String())  # Cars currently parked, in one lot or everywhere
+    quote_fee = graphene.Field(
+        FeeQuoteType,
+        car_plate=graphene.String(required=True),
+        kiosk_id=graphene.ID(),
+    )
+    # Months moved out of the live tables by archive_partitions
+    archived_months = graphene.List(graphene.Date)
+    archived_parking_sessions = graphene.List(
+        ParkingSessionType,
+        month=graphene.Date(required=True),  # Any day of the month
+        car_plate=graphene.String(),
+        limit=graphene.Int(default_value=100),
+    )
+    archived_payments = graphene.List(
+        PaymentType,
+        month=graphene.Date(required=True),
+        car_plate=graphene.String(),
+        limit=graphene.Int(default_value=100),
+    )
+
+    def resolve_archived_months(self, info):
+        return sorted(set(archived_months(ParkingSession)) | set(archived_months(Payment)))
+
+    def resolve_archived_parking_sessions(self, info, month, limit, car_plate=None):
+        return archived_query(ParkingSession, month, car_plate, limit)
+
+    def resolve_archived_payments(self, info, month, limit, car_plate=None):
+        return archived_query(Payment, month, car_plate, limit)
+
+    # Served from the daily rollups (parkingApp/rollups.py); dates are inclusive
+    revenue_report = graphene.List(
+        RevenueReportRowType,
+        from_date=graphene.Date(required=True),
+        to_date=graphene.Date(required=True),
+        period=ReportPeriod(default_value=ReportPeriod.DAY),
+        by_payment_method=graphene.Boolean(default_value=False),
+        by_employee=graphene.Boolean(default_value=False),
+    )
+    occupancy_report = graphene.List(
+        OccupancyReportRowType,
+        from_date=graphene.Date(required=True),
+        to_date=graphene.Date(required=True),
+        period=ReportPeriod(default_value=ReportPeriod.DAY),
     )
-    def resolve_all_payments(self, info):
-        return Payment.objects.all()
 
+    def resolve_revenue_report(self, info, from_date, to_date, period, by_payment_method, by_employee):
+        rows = revenue_report(from_date, to_date, period.value, by_payment_method, by_employee)
+        return [RevenueReportRowType(**row) for row in rows]
+
+    def resolve_occupancy_report(self, info, from_date, to_date, period):
+        return [OccupancyReportRowType(**row) for row in occupancy_report(from_date, to_date, period.value)]
+
+    def resolve_quote_fee(self, info, car_plate, kiosk_id=None):
+        session = (
+            ParkingSession.objects.select_related("car__employee")
+            .filter(plate_filter(car_plate, "car__"), exit_time__isnull=True)
+            .first()
+        )
+        if session is None:
+            return None
+        quote = quote_fee(session)
+        return FeeQuoteType(
+            car_plate=car_plate,
+            entry_time=session.entry_time,
+            duration=quote.duration,
+            amount=quote.amount,
+            is_within_free_period=quote.is_within_free_period,
+            is_employee_vehicle=quote.is_employee_vehicle,
+        )
+
+    def resolve_occupancy(self, info, lot=None):
+        # A lot is read from its own database (LotRoutingMiddleware)
+        return current_occupancy(lot) if lot else total_occupancy()
+
+    def resolve_photo_queue_stats(self, info):
+        return PhotoQueueStatsType(**pipeline.stats())
+
+    def resolve_database_connection_stats(self, info):
+        return [ConnectionStatsType(**stats) for stats in connection_stats()]
+
+    def resolve_all_payments(self, info, from_time=None, to_time=None, status=None, car_plate=None, lot=None, **page):
+        payments = Payment.objects.all()
+        if lot:
+            payments = payments.filter(kiosk_id__in=lot_kiosks(lot))
+        if from_time:
+            payments = payments.filter(payment_time__gte=from_time)
+        if to_time:
+            payments = payments.filter(payment_time__lt=to_time)
+        if status:
+            payments = payments.filter(status=status)
+        if car_plate:
+            payments = payments.filter(plate_filter(car_plate, "car__"))
+        payments = optimize_queryset(payments, info, path=("edges", "node"))
+        return keyset_connection(PaymentConnection, payments, "payment_time", **page)
+
+    @cached_resolver("allTariffs")
     def resolve_all_tariffs(self, info):
-        return Tariff.objects.all()
+        return list(Tariff.objects.order_by("pk"))
 
+    @cached_resolver("allPaymentMethods")
     def resolve_all_payment_methods(self, info):
-        return PaymentMethod.objects.all()
+        return list(PaymentMethod.objects.order_by("pk"))
     
-    def resolve_all_sessions(self, info):
-        return ParkingSession.objects.select_related("car").all()
-
-    def resolve_car_details(self, info, car_plate):
-        try:
-            car = Car.objects.get(car_plate=car_plate)
-            return car
-        except Car.DoesNotExist:
-            return None
-        
-    def resolve_search_car_by_plate(self, info, car_plate):
+    def resolve_all_parking_sessions(self, info, from_time=None, to_time=None, active=None, paid_status=None, car_plate=None, lot=None, **page):
+        sessions = ParkingSession.objects.all()
+        if lot:
+            sessions = sessions.filter(kiosk_id__in=lot_kiosks(lot))
+        if from_time:
+            sessions = sessions.filter(entry_time__gte=from_time)
+        if to_time:
+            sessions = sessions.filter(entry_time__lt=to_time)
+        if active is not None:
+            sessions = sessions.filter(exit_time__isnull=active)
+        if paid_status is not None:
+            sessions = sessions.filter(paid_status=paid_status)
+        if car_plate:
+            sessions = sessions.filter(plate_filter(car_plate, "car__"))
+        sessions = optimize_queryset(sessions, info, path=("edges", "node"))
+        return keyset_connection(ParkingSessionConnection, sessions, "entry_time", **page)
+
+    # Keyed by database as well: LotRoutingMiddleware has already picked it
+    @cached_resolver("carDetails", key=lambda car_plate, kiosk_id=None: car_details_key(car_plate, current_database()))
+    def resolve_car_details(self, info, car_plate, kiosk_id=None):
+        # Only the car row is cached; its sessions are resolved fresh
+        return Car.objects.filter(plate_filter(car_plate)).order_by("pk").first()
+
+    def resolve_search_car_by_plate(self, info, car_plate, kiosk_id=None):
     # Validate car_plate format to ensure it's 4 digits
-        if not re.match(r"^\d{4}$", car_plate):
+        if not is_plate_prefix(car_plate):
             raise ValueError("Буруу формат. Машины улсын дугаарын эхний 4 цифрийг оруулна уу.")
 
-        car = Car.objects.filter(car_plate__startswith=car_plate).first()
-        return car  # Return None if no match
+        cars = search_by_prefix(optimize_queryset(Car.objects.all(), info), car_plate, limit=1)
+        return cars[0] if cars else None  # Return None if no match
+
+    def resolve_search_cars_by_plate(self, info, car_plate, fuzzy, limit, kiosk_id=None):
+        cars = optimize_queryset(Car.objects.all(), info)
+        if fuzzy:
+            if not is_plate_query(car_plate):
+                raise ValueError("Буруу формат. Машины улсын дугаарыг оруулна уу.")
+            return search_fuzzy(cars, car_plate, limit)
+        if not is_plate_prefix(car_plate):
+            raise ValueError("Буруу формат. Машины улсын дугаарын эхний 4 цифрийг оруулна уу.")
+        return search_by_prefix(cars, car_plate, limit)
 
 class Mutation(graphene.ObjectType):
     create_entry_car = CreateEntryCarMutation.Field()
     save_payment = SavePayment.Field()
+    exit_car = ExitCarMutation.Field()
+    ingest_events = IngestEventsMutation.Field()
     
 class AtomicSchema(graphene.Schema):
-    def execute(self, *args, **kwargs):
-        with transaction.atomic():
-            result = super().execute(*args, **kwargs)
-            if result.errors:
-                transaction.set_rollback(True)
-                logger.error(
-                    f"GQL Error Traceback: {result.errors}",
-                    extra={"details": traceback.format_exc()},
-                )
-            return result
+    # Queries run in autocommit mode (on the read replica when one is
+    # configured); each top-level mutation gets its own atomic block through
+    # MutationAtomicMiddleware. See parkingApp/db.py. The document comes
+    # from the parsed-document cache and is executed as is, not parsed again.
+    def execute(self, request_string, **kwargs):
+        kwargs = normalize_execute_kwargs(kwargs)
+        try:
+            document, errors = parse_and_validate(self.graphql_schema, request_string, VALIDATION_RULES)
+        except GraphQLError as error:
+            document, errors = None, [error]
+        operation_ast = get_operation_ast(document, kwargs.get("operation_name")) if document else None
+        kwargs.setdefault("middleware", list(instantiate_middleware(graphene_settings.MIDDLEWARE or [])))
+
+        operation = operation_ast.operation.value if operation_ast else None
+        name = operation_ast.name.value if operation_ast and operation_ast.name else kwargs.get("operation_name")
+        with operation_scope(operation), trace_operation(operation, name) as trace:
+            if errors:
+                result = ExecutionResult(data=None, errors=errors)
+            else:
+                result = execute_sync(self.graphql_schema, document, **kwargs)
+            trace.failed = bool(result.errors)
+        if result.errors:
+            logger.error(
+                f"GQL Error Traceback: {result.errors}",
+                extra={"details": "".join(
+                    "".join(traceback.format_exception(error.original_error))
+                    for error in result.errors if getattr(error, "original_error", None)
+                )},
+            )
+        return result
 
 schema = AtomicSchema(query=Query, mutation=Mutation)